@@ -0,0 +1,233 @@
+import os
+import re
+import time
+import asyncio
+import itertools
+import logging
+import threading
+from collections import defaultdict
+from contextlib import asynccontextmanager, contextmanager
+from typing import Callable, Dict, Iterator, List, Optional
+
+from metrics import observe_stage, record_admission, record_rejection
+
+logger = logging.getLogger(__name__)
+
+# Statements admitted to the warehouse at once, overall and per user (session); the rest queue by priority
+SQL_MAX_CONCURRENT = int(os.getenv("SQL_MAX_CONCURRENT", "8"))
+# The per-user limit stays above SQL_SPECULATIVE_FANOUT (3), so one question's candidates run side by side
+SQL_MAX_CONCURRENT_PER_USER = int(os.getenv("SQL_MAX_CONCURRENT_PER_USER", "4"))
+# A full queue refuses new statements at once, rather than letting waits grow without bound
+SQL_MAX_QUEUED = int(os.getenv("SQL_MAX_QUEUED", "64"))
+SQL_QUEUE_TIMEOUT_SECONDS = float(os.getenv("SQL_QUEUE_TIMEOUT_SECONDS", "30"))
+# Generated queries are EXPLAINed first; one estimated to scan more than this is refused (0 disables)
+SQL_MAX_SCAN_BYTES = int(os.getenv("SQL_MAX_SCAN_BYTES", str(100 * 1024 ** 3)))
+
+# Lower runs first
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BACKGROUND = 10
+
+_UNITS = {"": 1, "B": 1, **{f"{p}IB": 1024 ** (i + 1) for i, p in enumerate("KMGTPE")}}
+_SIZE_RE = re.compile(r"sizeInBytes=([\d.]+(?:E[+-]?\d+)?)\s*([KMGTPE]iB|B)?", re.I)
+_SCAN_LINE = re.compile(r"\b(Relation|Scan|FileScan)\b")
+
+
+class AdmissionError(RuntimeError):
+    """Statement refused by admission control. ``reason`` is cost, queue_full, queue_timeout or cancelled."""
+
+    def __init__(self, reason: str, message: str):
+        super().__init__(message)
+        self.reason = reason
+
+
+def _format_bytes(n: float) -> str:
+    for unit in ("B", "KiB", "MiB", "GiB", "TiB", "PiB"):
+        if n < 1024:
+            return f"{n:.1f} {unit}"
+        n /= 1024
+    return f"{n:.1f} EiB"
+
+
+def parse_scan_bytes(plan: str) -> Optional[int]:
+    """Bytes an ``EXPLAIN COST`` plan expects to read: the sum over its scans, else its largest estimate."""
+    scans, sizes = [], []
+    for line in plan.splitlines():
+        m = _SIZE_RE.search(line)
+        if not m:
+            continue
+        size = int(float(m.group(1)) * _UNITS[(m.group(2) or "").upper()])
+        sizes.append(size)
+        if _SCAN_LINE.search(line):
+            scans.append(size)
+    if scans:
+        return sum(scans)
+    return max(sizes) if sizes else None
+
+
+def check_scan(scan_bytes: Optional[int], budget: int = SQL_MAX_SCAN_BYTES) -> None:
+    if budget and scan_bytes is not None and scan_bytes > budget:
+        record_rejection("cost")
+        raise AdmissionError(
+            "cost",
+            f"Query would scan about {_format_bytes(scan_bytes)}, over the {_format_bytes(budget)} budget. "
+            "Filter on the columns in the question, or aggregate, so that less data is read.",
+        )
+
+
+class _Waiter:
+    def __init__(self, user: Optional[str], priority: int, seq: int, wake: Callable[[], None]):
+        self.user = user
+        self.priority = priority
+        self.seq = seq
+        self.wake = wake
+        self.granted = False
+        self.cancelled = False
+
+
+class AdmissionQueue:
+    """Bounded priority queue in front of the warehouse, with global and per-user concurrency limits.
+
+    Usable from threads (``slot``) and coroutines (``slot_async``). Statements without a user
+    only count against the global limit.
+    """
+
+    def __init__(
+        self,
+        max_running: int = SQL_MAX_CONCURRENT,
+        per_user: int = SQL_MAX_CONCURRENT_PER_USER,
+        max_queued: int = SQL_MAX_QUEUED,
+    ):
+        self.max_running = max_running
+        self.per_user = per_user
+        self.max_queued = max_queued
+        self._lock = threading.Lock()
+        self._waiting: List[_Waiter] = []
+        self._running = 0
+        self._running_by_user: Dict[str, int] = defaultdict(int)
+        self._seq = itertools.count()
+
+    def _eligible_locked(self, w: _Waiter) -> bool:
+        return w.user is None or self._running_by_user.get(w.user, 0) < self.per_user
+
+    def _grant_locked(self) -> None:
+        while self._running < self.max_running:
+            eligible = [w for w in self._waiting if self._eligible_locked(w)]
+            if not eligible:
+                break
+            w = min(eligible, key=lambda w: (w.priority, w.seq))
+            self._waiting.remove(w)
+            self._running += 1
+            if w.user is not None:
+                self._running_by_user[w.user] += 1
+            w.granted = True
+            w.wake()
+        record_admission(len(self._waiting), self._running)
+
+    def _enqueue(self, user: Optional[str], priority: int, wake: Callable[[], None]) -> _Waiter:
+        with self._lock:
+            if len(self._waiting) >= self.max_queued:
+                record_rejection("queue_full")
+                raise AdmissionError("queue_full", "The SQL warehouse is busy; try again shortly.")
+            w = _Waiter(user, priority, next(self._seq), wake)
+            self._waiting.append(w)
+            self._grant_locked()
+            return w
+
+    def _leave_locked(self, w: _Waiter) -> None:
+        if w in self._waiting:
+            self._waiting.remove(w)
+            record_admission(len(self._waiting), self._running)
+
+    def _settle(self, w: _Waiter, timeout: Optional[float]) -> None:
+        """After a wait ends: keep the slot if it was granted meanwhile, else leave the queue and raise."""
+        with self._lock:
+            if w.granted:
+                return
+            self._leave_locked(w)
+        if w.cancelled:
+            raise AdmissionError("cancelled", "Query was cancelled before it started.")
+        record_rejection("queue_timeout")
+        raise AdmissionError("queue_timeout", f"Waited {timeout}s for the SQL warehouse without getting a slot.")
+
+    def _release_locked(self, user: Optional[str]) -> None:
+        self._running -= 1
+        if user is not None:
+            self._running_by_user[user] -= 1
+            if self._running_by_user[user] <= 0:
+                del self._running_by_user[user]
+        self._grant_locked()
+
+    def release(self, user: Optional[str]) -> None:
+        with self._lock:
+            self._release_locked(user)
+
+    def cancel(self, user: str) -> int:
+        """Drop ``user``'s queued statements; their callers get ``AdmissionError("cancelled")``."""
+        with self._lock:
+            dropped = [w for w in self._waiting if w.user == user]
+            for w in dropped:
+                self._waiting.remove(w)
+                w.cancelled = True
+                w.wake()
+            if dropped:
+                record_admission(len(self._waiting), self._running)
+        return len(dropped)
+
+    @contextmanager
+    def slot(
+        self, user: Optional[str] = None, priority: int = PRIORITY_INTERACTIVE,
+        timeout: Optional[float] = SQL_QUEUE_TIMEOUT_SECONDS,
+    ) -> Iterator[None]:
+        t0 = time.perf_counter()
+        granted = threading.Event()
+        w = self._enqueue(user, priority, granted.set)
+        granted.wait(timeout)
+        try:
+            self._settle(w, timeout)
+        except AdmissionError:
+            observe_stage("sql_queue_wait", time.perf_counter() - t0, "rejected")
+            raise
+        observe_stage("sql_queue_wait", time.perf_counter() - t0)
+        try:
+            yield
+        finally:
+            self.release(user)
+
+    @asynccontextmanager
+    async def slot_async(
+        self, user: Optional[str] = None, priority: int = PRIORITY_INTERACTIVE,
+        timeout: Optional[float] = SQL_QUEUE_TIMEOUT_SECONDS,
+    ):
+        t0 = time.perf_counter()
+        loop = asyncio.get_running_loop()
+        granted = loop.create_future()
+
+        def wake() -> None:
+            loop.call_soon_threadsafe(lambda: granted.done() or granted.set_result(None))
+
+        w = self._enqueue(user, priority, wake)
+        try:
+            await asyncio.wait_for(granted, timeout)
+        except asyncio.TimeoutError:
+            pass
+        except asyncio.CancelledError:
+            with self._lock:
+                if w.granted:
+                    self._release_locked(w.user)
+                else:
+                    self._leave_locked(w)
+            raise
+        try:
+            self._settle(w, timeout)
+        except AdmissionError:
+            observe_stage("sql_queue_wait", time.perf_counter() - t0, "rejected")
+            raise
+        observe_stage("sql_queue_wait", time.perf_counter() - t0)
+        try:
+            yield
+        finally:
+            self.release(user)
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {"queued": len(self._waiting), "running": self._running, "users": len(self._running_by_user)}
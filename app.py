@@ -1,60 +1,168 @@
+import time
+_STARTED_AT = time.perf_counter()
+
 import os
+import json
+import uuid
+import hashlib
+import multiprocessing
 import logging
+from collections import defaultdict
+from typing import Optional
 import pandas as pd
 
 import dash
-from dash import dcc, html, Input, Output, State
+from flask import request
+from dash import dcc, html, Input, Output, State, MATCH, Patch
 import dash_bootstrap_components as dbc
 
-from dbsql import run_sql, get_trips_schema_text
+from dbsql import (
+    run_sql,
+    run_sql_async,
+    cancel_session_queries,
+    get_trips_schema_text,
+    fetch_trips_schema_text,
+    warm_pool,
+    TRIPS_SCHEMA_FALLBACK,
+    QueryCancelledError,
+)
+from admission import PRIORITY_BACKGROUND, AdmissionError
 from llm import (
-    list_llm_endpoints,
+    FOUNDATION_DEFAULTS,
+    fetch_llm_endpoints,
     get_chat_llm,
     generate_sql,
     refine_sql,
-    summarize_answer,
+    stream_summary,
     first_statement,
     ensure_limit,
+    remember_sql,
+    lookup_sql,
 )
 
-from rag import ingest_uploaded_files, retrieve_context
+from rag import DOCUMENT_EXTENSIONS, retrieve_context, embed_query, get_embeddings
+from jobs import IngestJobQueue, IngestJobError
+from catalog import SchemaCatalog
+from startup import WarmCache, check_startup_budget
+from speculative import SQL_SPECULATIVE, candidate_llms, speculative_sql
+from sqlcheck import check_sql, SQLValidationError
+from metrics import (
+    install_trace_logging,
+    new_trace_id,
+    ensure_trace_id,
+    observe_stage,
+    record_sql_attempts,
+    span,
+    metrics_response,
+)
+from streaming import StreamRegistry
+from pipeline import Pipeline, Stage, run_in_thread
+from grid import GRID_TYPE, result_grid, get_rows
+from sessions import SessionStore
+from followup import (
+    remember_result,
+    previous_result,
+    followup_schema_text,
+    uses_prev_result,
+    run_local_sql,
+    derived_sql,
+)
 
 logging.basicConfig(level=logging.INFO)
+install_trace_logging()
 logger = logging.getLogger(__name__)
 
 # Configurable max retries for fixing broken SQL
 MAX_SQL_RETRIES = int(os.getenv("MAX_SQL_RETRIES", "10"))
 
-# Discover available LLM endpoints for dropdown
-AVAILABLE_ENDPOINTS = list_llm_endpoints()
-DEFAULT_ENDPOINT = AVAILABLE_ENDPOINTS[0] if AVAILABLE_ENDPOINTS else "databricks-meta-llama-3-3-70b-instruct"
+# Fetch caps for query results: the preview and summary never need more than this
+RESULT_MAX_ROWS = int(os.getenv("RESULT_MAX_ROWS", "200"))
+RESULT_MAX_BYTES = int(os.getenv("RESULT_MAX_BYTES", str(32 * 1024 * 1024)))
+# Per-attempt deadline for generated queries; the statement is cancelled on the warehouse after it
+SQL_QUERY_TIMEOUT_SECONDS = float(os.getenv("SQL_QUERY_TIMEOUT_SECONDS", "120"))
+# Stage deadlines; past them the question is answered without RAG context or the SQL cache, and with
+# the snapshot (or static) trips schema instead of the catalog's tables
+RAG_TIMEOUT_SECONDS = float(os.getenv("RAG_TIMEOUT_SECONDS", "5"))
+SCHEMA_TEXT_TIMEOUT_SECONDS = float(os.getenv("SCHEMA_TEXT_TIMEOUT_SECONDS", "5"))
+SQL_CACHE_LOOKUP_TIMEOUT_SECONDS = float(os.getenv("SQL_CACHE_LOOKUP_TIMEOUT_SECONDS", "2"))
+# How often the page polls for newly streamed answer tokens
+ANSWER_POLL_MS = int(os.getenv("ANSWER_POLL_MS", "300"))
+# How often the page polls an upload's indexing progress
+INGEST_POLL_MS = int(os.getenv("INGEST_POLL_MS", "1000"))
 
 # -------- App bootstrap --------
 missing = [k for k in ("DATABRICKS_HOST", "DATABRICKS_TOKEN", "DATABRICKS_WAREHOUSE_ID") if not os.getenv(k)]
 if missing:
     logger.warning(f"Missing env vars: {', '.join(missing)}")
 
-schema_text = get_trips_schema_text()
-try:
-    tables_df = run_sql("SHOW TABLES IN samples.nyctaxi")
-except Exception as e:
-    logger.warning(f"Could not list tables: {e}")
-    tables_df = pd.DataFrame()
+def _list_tables():
+    df = run_sql("SHOW TABLES IN samples.nyctaxi", max_rows=100, priority=PRIORITY_BACKGROUND)
+    return df.astype(str).to_dict("records")
 
-app = dash.Dash(__name__, external_stylesheets=[dbc.themes.BOOTSTRAP])
+# Tables and columns of the configured schemas, crawled in the background and cached locally;
+# each SQL prompt gets only the ones relevant to its question
+schema_catalog = SchemaCatalog(
+    embed_documents=lambda docs: get_embeddings().embed_documents(docs), embed_query=embed_query
+)
+
+# Endpoints, schema and tables need workspace/warehouse round trips; serve the UI right away with the
+# last snapshot (or defaults) and load fresh values in the background. The SQL pool opens its
+# SQL_POOL_MIN connections here too, so the first questions skip connection setup
+warm = WarmCache(
+    loaders={
+        "sql_pool": warm_pool,
+        "endpoints": fetch_llm_endpoints,
+        "schema_text": fetch_trips_schema_text,
+        "tables": _list_tables,
+        "catalog_tables": schema_catalog.refresh,
+    },
+    defaults={"endpoints": FOUNDATION_DEFAULTS, "tables": []},
+    # The pool and the catalog keep their own state; their loaders' results are not worth restoring
+    transient=("sql_pool", "catalog_tables"),
+)
+# Ingestion parse workers import this module too; only the server process warms up
+if multiprocessing.parent_process() is None:
+    warm.start()
+
+DEFAULT_ENDPOINT = "databricks-meta-llama-3-3-70b-instruct"
+
+def get_schema_text(question: str) -> str:
+    schema_text = schema_catalog.schema_text(question)
+    if schema_text is not None:
+        return schema_text
+    # Catalog not crawled yet: fall back to the trips table alone
+    schema_text = warm.get("schema_text")
+    if schema_text is None:
+        # First start without a snapshot: the question needs the schema, so wait for it here
+        schema_text = get_trips_schema_text()
+    return schema_text
+
+# Answers are generated in background threads and polled by the page as they stream in
+answers = StreamRegistry()
+# Chat history lives here, keyed by session id; the page only receives each turn's new cards
+chat_sessions = SessionStore()
+# Uploads are indexed by background jobs, a limited number at a time
+ingest_jobs = IngestJobQueue()
+
+app = dash.Dash(__name__, external_stylesheets=[dbc.themes.BOOTSTRAP], use_async=True)
 app.title = "NYCTaxi Q&A"
 
-def df_to_table(df: pd.DataFrame, max_rows: int = 30):
+@app.server.before_request
+def _start_trace():
+    # One trace id per HTTP request (callbacks included); a proxy-supplied request id is reused
+    new_trace_id((request.headers.get("X-Request-ID") or "")[:64] or None)
+
+@app.server.route("/metrics")
+def prometheus_metrics():
+    return metrics_response()
+
+def df_to_table(df: pd.DataFrame, key: Optional[str] = None, height: str = "40vh"):
+    # The frame stays on the server; the grid pulls visible blocks through on_grid_rows
     if df is None or df.empty:
         return html.Div("No rows returned.", className="text-muted")
-    cols = list(df.columns)
-    rows = df.head(max_rows).to_dict("records")
-    return html.Table([
-        html.Thead(html.Tr([html.Th(c) for c in cols])),
-        html.Tbody([html.Tr([html.Td(row.get(c)) for c in cols]) for row in rows])
-    ], style={"width": "100%", "overflowX": "auto"})
-
-app.layout = dbc.Container([
+    return result_grid(df, key=key, height=height)
+
+main_layout = dbc.Container([
     html.H3("🧱 POC - Databricks AI Intelligence (samples.nyctaxi.trips)"),
 
     dbc.Row([
@@ -62,17 +170,18 @@ app.layout = dbc.Container([
             html.Label("Model endpoint"),
             dcc.Dropdown(
                 id="endpoint-select",
-                options=[{"label": name, "value": name} for name in AVAILABLE_ENDPOINTS],
+                options=[{"label": name, "value": name} for name in FOUNDATION_DEFAULTS],
                 value=DEFAULT_ENDPOINT,
                 clearable=False,
             ),
         ], width=6),
      dbc.Col([
-            html.Label("Upload knowledge files (.txt/.md)"),
+            html.Label("Upload knowledge files (.txt/.md/.pdf/.docx/.html)"),
             dcc.Upload(
                 id="file-upload",
                 children=html.Div(["Drag and drop or click to upload"]),
                 multiple=True,
+                accept=",".join(DOCUMENT_EXTENSIONS),
                 style={
                     "width": "100%", "height": "38px", "lineHeight": "38px",
                     "borderWidth": "1px", "borderStyle": "dashed",
@@ -80,18 +189,22 @@ app.layout = dbc.Container([
                 },
             ),
             html.Small(id="upload-status", className="text-muted"),
+            dcc.Store(id="ingest-job"),
+            dcc.Interval(id="ingest-poll", interval=INGEST_POLL_MS, disabled=True),
         ], width=6),
     ], className="mb-3"),
 
     html.H6("Tables in samples.nyctaxi"),
     html.Div(id="tables-preview"),
+    dcc.Interval(id="warmup-poll", interval=2000),
     html.Hr(),
 
-    dcc.Store(id="messages", data=[]),
+    dcc.Store(id="answer-stream"),
+    dcc.Interval(id="answer-poll", interval=ANSWER_POLL_MS, disabled=True),
 
     dbc.Row([
         dbc.Col([
-            html.Div(id="chat-log", style={
+            html.Div(id="chat-log", children=[], style={
                 "height": "45vh", "overflowY": "auto", "border": "1px solid #ddd",
                 "borderRadius": "6px", "padding": "8px", "backgroundColor": "white"
             })
@@ -106,6 +219,8 @@ app.layout = dbc.Container([
     dcc.Loading(
         id="loading",
         type="circle",
+        # The answer streams in through polling; a spinner on every poll would hide it
+        target_components={"sql-text": "children", "result-table": "children"},
         children=html.Div([
             html.H6("Proposed SQL"),
             html.Pre(id="sql-text", style={"whiteSpace": "pre-wrap"}),
@@ -119,106 +234,315 @@ app.layout = dbc.Container([
     ),
 ], fluid=True)
 
+def serve_layout():
+    # Session id: keys the chat history and cancels that session's running queries. It is kept in the
+    # tab's session storage, which overrides this fresh id, so a reload continues the same chat
+    return html.Div([dcc.Store(id="session-id", data=str(uuid.uuid4()), storage_type="session"), main_layout])
+
+app.layout = serve_layout
+
 @app.callback(
     Output("upload-status", "children"),
+    Output("ingest-job", "data"),
+    Output("ingest-poll", "disabled"),
     Input("file-upload", "contents"),
     State("file-upload", "filename"),
     prevent_initial_call=True
 )
 def on_upload(contents, filenames):
+    # Indexing runs as a background job; the page polls its progress instead of holding this request
     try:
-        n = ingest_uploaded_files(contents or [], filenames or [])
-        return f"Indexed {n} chunks from {len(filenames or [])} file(s)."
-    except Exception as e:
-        return f"Upload failed: {e}"
-
-def render_chat(messages):
-    children = []
-    for m in messages:
-        who = "You" if m["role"] == "user" else "Assistant"
-        bg = "#e9ecef" if m["role"] == "user" else "#f8f9fa"
-        content = html.Div(m["content"]) if m["role"] == "user" else dcc.Markdown(m["content"], link_target="_blank")
-        children.append(
-            dbc.Card(dbc.CardBody([
-                html.Small(who, className="text-muted"),
-                content
-            ]), style={"marginBottom": "8px", "backgroundColor": bg})
+        job_id = ingest_jobs.submit(contents or [], filenames or [])
+    except IngestJobError as e:
+        return str(e), None, True
+    return f"Queued {len(filenames or [])} file(s) for indexing...", job_id, False
+
+@app.callback(
+    Output("upload-status", "children", allow_duplicate=True),
+    Output("ingest-poll", "disabled", allow_duplicate=True),
+    Input("ingest-poll", "n_intervals"),
+    State("ingest-job", "data"),
+    prevent_initial_call=True
+)
+def on_ingest_poll(_, job_id):
+    status = ingest_jobs.status(job_id)
+    if status is None:
+        return "Upload status expired.", True
+    if status["state"] == "queued":
+        return "Waiting for other uploads to finish indexing...", False
+    if status["state"] == "running":
+        return (
+            f"Indexing: {status['files_done']}/{status['files']} file(s) read, "
+            f"{status['chunks_indexed']} chunks indexed...", False
         )
-    return children
+    if status["state"] == "failed":
+        return f"Upload failed: {status['error']}", True
+    failed = status["failed_files"]
+    note = f" Could not read: {', '.join(failed)}." if failed else ""
+    return f"Indexed {status['chunks_indexed']} chunks from {status['files'] - len(failed)} file(s).{note}", True
+
+def chat_card(m):
+    who = "You" if m["role"] == "user" else "Assistant"
+    bg = "#e9ecef" if m["role"] == "user" else "#f8f9fa"
+    content = html.Div(m["content"]) if m["role"] == "user" else dcc.Markdown(m["content"], link_target="_blank")
+    return dbc.Card(dbc.CardBody([
+        html.Small(who, className="text-muted"),
+        content
+    ]), style={"marginBottom": "8px", "backgroundColor": bg})
+
+def append_chat(session_id, *messages):
+    """Record messages in the session's history; the returned Patch adds only their cards to the chat log."""
+    chat_sessions.append(session_id, *messages)
+    patch = Patch()
+    patch.extend([chat_card(m) for m in messages])
+    return patch
 
 @app.callback(
+    Output("chat-log", "children", allow_duplicate=True),
+    Input("session-id", "data"),
+    prevent_initial_call="initial_duplicate",
+)
+def on_session(session_id):
+    # Rebuild the chat log from the server-side history when the page (re)loads
+    return [chat_card(m) for m in chat_sessions.history(session_id)] if session_id else []
+
+@app.callback(
+    Output("endpoint-select", "options"),
     Output("tables-preview", "children"),
-    Input("endpoint-select", "value")
+    Output("warmup-poll", "disabled"),
+    Input("warmup-poll", "n_intervals"),
+)
+def on_warmup_poll(_):
+    endpoints = warm.get("endpoints") or FOUNDATION_DEFAULTS
+    options = [{"label": name, "value": name} for name in endpoints]
+    tables = warm.get("tables") or []
+    # Keyed by content, so re-sending an unchanged list does not remount the grid
+    key = "tables-" + hashlib.sha256(json.dumps(tables, sort_keys=True).encode("utf-8")).hexdigest()[:16]
+    table = df_to_table(pd.DataFrame(tables), key=key, height="25vh")
+    # Stop polling once every background value has loaded
+    return options, table, warm.is_finished()
+
+@app.callback(
+    Output({"type": GRID_TYPE, "key": MATCH}, "getRowsResponse"),
+    Input({"type": GRID_TYPE, "key": MATCH}, "getRowsRequest"),
+    State({"type": GRID_TYPE, "key": MATCH}, "id"),
+    prevent_initial_call=True
 )
-def on_load_tables(_):
-    return df_to_table(tables_df, max_rows=100)
+def on_grid_rows(row_request, grid_id):
+    return get_rows(grid_id["key"], row_request)
+
+# -------- Question pipeline --------
+async def _find_sql(question, session_id, endpoint_name, chat_llm, schema_text, rag_context, cached_sql, prev_result):
+    attempt_logs = []
+    last_error = None
+    df = pd.DataFrame()
+    sql_final = ""
+    found = False
+    attempts = 0
+    errors = defaultdict(int)  # failed candidates by cause, for metrics
+    # With a previous result the model may answer a follow-up from it, as table prev_result
+    sql_schema = followup_schema_text(schema_text, prev_result)
+
+    async def validate(sql_text: str) -> pd.DataFrame:
+        nonlocal attempts
+        attempts += 1
+        try:
+            # Broken references and non-SELECT statements fail here, without a warehouse round trip
+            check_sql(sql_text, sql_schema)
+            local = prev_result is not None and uses_prev_result(sql_text)
+        except SQLValidationError:
+            errors["validation"] += 1
+            raise
+        if local:
+            try:
+                return await run_in_thread(run_local_sql, sql_text, prev_result.df)
+            except Exception:
+                errors["local"] += 1
+                raise
+        try:
+            return await run_sql_async(
+                sql_text,
+                timeout=SQL_QUERY_TIMEOUT_SECONDS,
+                session_id=session_id,
+                max_rows=RESULT_MAX_ROWS,
+                max_bytes=RESULT_MAX_BYTES,
+            )
+        except QueryCancelledError:
+            raise
+        except AdmissionError as e:
+            # Too costly: the refine loop rewrites it. Warehouse busy: another candidate would not help
+            errors[e.reason] += 1
+            raise
+        except TimeoutError:
+            errors["timeout"] += 1
+            raise
+        except Exception:
+            errors["warehouse"] += 1
+            raise
+
+    if SQL_SPECULATIVE:
+        try:
+            # The semantic cache was already checked by the cached_sql stage; a hit runs before any fan-out
+            sql_final, df = await speculative_sql(
+                question, sql_schema, candidate_llms(endpoint_name), validate, attempt_logs,
+                context=rag_context, cached_sql=cached_sql,
+            )
+            found = True
+        except QueryCancelledError as e:
+            attempt_logs.append(f"Cancelled:\n{e}")
+        except Exception as e:
+            attempt_logs.append(f"Speculative SQL search failed:\n{e}")
+    else:
+        for attempt in range(1, MAX_SQL_RETRIES + 1):
+            try:
+                if attempt == 1:
+                    sql_candidate = cached_sql or await run_in_thread(
+                        generate_sql, question, sql_schema, chat_llm, rag_context, False
+                    )
+                else:
+                    sql_candidate = await run_in_thread(
+                        refine_sql, question, sql_schema, sql_final, last_error or "Unknown error", chat_llm
+                    )
+
+                sql_candidate = first_statement(sql_candidate)
+                sql_candidate = ensure_limit(sql_candidate, 200)
+                sql_final = sql_candidate
+                attempt_logs.append(f"Attempt {attempt} SQL:\n{sql_candidate}")
+
+                df = await validate(sql_candidate)
+                found = True
+                break
+            except QueryCancelledError as e:
+                attempt_logs.append(f"Attempt {attempt} cancelled:\n{e}")
+                break
+            except AdmissionError as e:
+                last_error = str(e)
+                attempt_logs.append(f"Attempt {attempt} not admitted:\n{last_error}")
+                if e.reason == "cost":
+                    continue
+                break
+            except Exception as e:
+                last_error = str(e)
+                attempt_logs.append(f"Attempt {attempt} error:\n{last_error}")
+                continue
+
+    record_sql_attempts(attempts, errors)
+    if found:
+        # A result that hit the fetch caps may be partial, so it is not offered for follow-ups
+        complete = len(df) < RESULT_MAX_ROWS
+        if prev_result is not None and uses_prev_result(sql_final):
+            attempt_logs.append("Answered from the previous result, without querying the warehouse.")
+            remember_result(session_id, derived_sql(prev_result, sql_final), df, complete)
+        else:
+            # SQL over prev_result only means something for this session, so only warehouse SQL is cached
+            remember_sql(question, schema_text, sql_final)
+            remember_result(session_id, sql_final, df, complete)
+    return {"sql": sql_final, "df": df, "logs": "\n\n".join(attempt_logs)}
+
+def _render_table(query):
+    if query["df"].empty:
+        return html.Div("No rows returned.", className="text-muted")
+    return df_to_table(query["df"])
+
+def _start_answer(question, query, chat_llm, rag_context):
+    if query["df"].empty:
+        return None
+    return answers.start(stream_summary(question, query["df"], chat_llm, context=rag_context))
+
+# Independent stages run concurrently: RAG retrieval overlaps the schema fetch and the semantic
+# cache lookup, and the table is rendered while the summary starts streaming
+answer_pipeline = Pipeline([
+    Stage("chat_llm", lambda endpoint_name: get_chat_llm(endpoint_name), deps=["endpoint_name"]),
+    Stage(
+        # Catalog lookup embeds the question, and without a snapshot the trips table is described first
+        "schema_text", get_schema_text, deps=["question"],
+        timeout=SCHEMA_TEXT_TIMEOUT_SECONDS, fallback=lambda e: warm.get("schema_text") or TRIPS_SCHEMA_FALLBACK,
+    ),
+    Stage(
+        "rag_context", lambda question: retrieve_context(question, k=5), deps=["question"],
+        timeout=RAG_TIMEOUT_SECONDS, fallback="",
+    ),
+    Stage(
+        "cached_sql", lookup_sql, deps=["question", "schema_text"],
+        timeout=SQL_CACHE_LOOKUP_TIMEOUT_SECONDS, fallback=None,
+    ),
+    Stage("prev_result", previous_result, deps=["session_id"]),
+    Stage(
+        "query", _find_sql,
+        deps=[
+            "question", "session_id", "endpoint_name", "chat_llm", "schema_text", "rag_context", "cached_sql",
+            "prev_result",
+        ],
+    ),
+    Stage("table", _render_table, deps=["query"], fallback=lambda e: html.Div(f"Error: {e}")),
+    Stage("answer_stream", _start_answer, deps=["question", "query", "chat_llm", "rag_context"]),
+])
+answer_pipeline.add_listener(lambda name, seconds, outcome: observe_stage(f"on_send.{name}", seconds, outcome))
 
 @app.callback(
     Output("chat-log", "children"),
-    Output("messages", "data"),
     Output("sql-text", "children"),
     Output("result-table", "children"),
     Output("answer-text", "children"),
+    Output("answer-stream", "data"),
+    Output("answer-poll", "disabled"),
     Input("send-btn", "n_clicks"),
     State("user-input", "value"),
-    State("messages", "data"),
     State("endpoint-select", "value"),
+    State("session-id", "data"),
+    State("answer-stream", "data"),
     prevent_initial_call=True
 )
-def on_send(n_clicks, user_text, messages, endpoint_name):
-    messages = messages or []
+async def on_send(n_clicks, user_text, endpoint_name, session_id, stream_id):
     if not user_text:
-        return render_chat(messages), messages, "", html.Div(), ""
+        return dash.no_update, "", html.Div(), "", dash.no_update, dash.no_update
 
-    messages.append({"role": "user", "content": user_text})
-
-    attempt_logs = []
-    last_error = None
-    df = pd.DataFrame()
-    sql_final = ""
-
-    chat_llm = get_chat_llm(endpoint_name)
-
-    # Retrieve RAG context
-    try:
-        rag_context = retrieve_context(user_text, k=5)
-    except Exception as _:
-        rag_context = ""
-
-    for attempt in range(1, MAX_SQL_RETRIES + 1):
-        try:
-            if attempt == 1:
-                sql_candidate = generate_sql(user_text, schema_text, chat_llm, context=rag_context)
-            else:
-                sql_candidate = refine_sql(user_text, schema_text, sql_final, last_error or "Unknown error", chat_llm)
-
-            sql_candidate = first_statement(sql_candidate)
-            sql_candidate = ensure_limit(sql_candidate, 200)
-            sql_final = sql_candidate
-            attempt_logs.append(f"Attempt {attempt} SQL:\n{sql_candidate}")
-
-            df = run_sql(sql_candidate)
-            break
-        except Exception as e:
-            last_error = str(e)
-            attempt_logs.append(f"Attempt {attempt} error:\n{last_error}")
-            continue
-
-    sql_text_out = "\n\n".join(attempt_logs)
+    # A new question supersedes the answer still streaming and anything running on the warehouse
+    new_messages = []
+    previous = answers.abandon(stream_id)
+    if previous is not None:
+        text, done = previous
+        new_messages.append({"role": "assistant", "content": text if done else f"{text} …".lstrip()})
+    new_messages.append({"role": "user", "content": user_text})
+    await run_in_thread(cancel_session_queries, session_id)  # blocking Thrift calls
 
     try:
-        if df.empty:
-            table = html.Div("No rows returned.", className="text-muted")
-            answer = "No rows returned. Try refining your question."
-        else:
-            table = df_to_table(df)
-            answer = summarize_answer(user_text, df, chat_llm, context=rag_context)
+        ensure_trace_id()
+        logger.info(f"Question from session {session_id}: {user_text!r}")
+        with span("on_send"):
+            results = await answer_pipeline.run(question=user_text, endpoint_name=endpoint_name, session_id=session_id)
     except Exception as e:
-        table = html.Div()
         answer = f"Error: {e}"
+        new_messages.append({"role": "assistant", "content": answer})
+        return append_chat(session_id, *new_messages), "", html.Div(), answer, None, True
+    sql_text_out, table, stream_id = results["query"]["logs"], results["table"], results["answer_stream"]
+    if stream_id is None:
+        answer = "No rows returned. Try refining your question."
+        new_messages.append({"role": "assistant", "content": answer})
+        return append_chat(session_id, *new_messages), sql_text_out, table, answer, None, True
+
+    # Show the table now; the answer is streamed into the page by on_answer_poll
+    return append_chat(session_id, *new_messages), sql_text_out, table, "", stream_id, False
+
+@app.callback(
+    Output("answer-text", "children", allow_duplicate=True),
+    Output("chat-log", "children", allow_duplicate=True),
+    Output("answer-poll", "disabled", allow_duplicate=True),
+    Input("answer-poll", "n_intervals"),
+    State("answer-stream", "data"),
+    State("session-id", "data"),
+    prevent_initial_call=True
+)
+def on_answer_poll(_, stream_id, session_id):
+    text, done, error = answers.read(stream_id)
+    if not done:
+        return text, dash.no_update, False
+    if not answers.claim(stream_id):
+        return dash.no_update, dash.no_update, True
+    answer = f"Error: {error}" if error and not text else text
+    return answer, append_chat(session_id, {"role": "assistant", "content": answer}), True
 
-    messages.append({"role": "assistant", "content": answer})
-    return render_chat(messages), messages, sql_text_out, table, answer
+check_startup_budget(_STARTED_AT)
 
 if __name__ == "__main__":
-    app.run_server(debug=False, use_reloader=False)
\ No newline at end of file
+    app.run(debug=False, use_reloader=False)
\ No newline at end of file
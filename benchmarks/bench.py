@@ -0,0 +1,272 @@
+"""Offline end-to-end benchmark of the question -> SQL -> answer path and of RAG ingestion.
+
+Drives ``app.on_send`` for N concurrent simulated users against the stand-ins in
+standins.py (DuckDB warehouse, fake chat model, fake embeddings, local vector store) and
+reports p50/p95/p99 per pipeline stage and end to end. Results are written as JSON.
+
+    pip install -r benchmarks/requirements.txt
+    python benchmarks/bench.py --users 16 --questions 10 --rows 200000
+    python benchmarks/bench.py --compare benchmarks/results/<earlier>.json
+"""
+import os
+import sys
+import json
+import time
+import base64
+import asyncio
+import argparse
+import platform
+import subprocess
+import tempfile
+import threading
+from collections import defaultdict
+from datetime import datetime, timezone
+from typing import Dict, List, Optional
+
+import numpy as np
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(HERE)
+sys.path.insert(0, ROOT)
+
+QUESTIONS = [
+    "Which pickup zip codes have the most trips?",
+    "What is the average fare and trip distance?",
+    "How many trips start in each hour?",
+    "Which dropoff zips have the highest fare per mile?",
+    "Show the most expensive trips longer than 10 miles.",
+    "What is the median fare by day of week?",
+    "Where do airport trips get dropped off?",
+    "How does fare depend on distance?",
+]
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    p = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    p.add_argument("--users", type=int, default=8, help="concurrent simulated users")
+    p.add_argument("--questions", type=int, default=5, help="questions asked by each user")
+    p.add_argument("--think-time", type=float, default=0.0, help="seconds between a user's questions")
+    p.add_argument("--unique-questions", action="store_true", help="make every question distinct (defeats caches)")
+    p.add_argument("--rows", type=int, default=100_000, help="rows in the synthetic trips table")
+    p.add_argument("--sql-latency", type=float, default=0.05, help="seconds added to every statement")
+    p.add_argument("--pool-size", type=int, default=8, help="max warehouse connections")
+    p.add_argument("--llm-latency", type=float, default=0.2, help="seconds before the first token")
+    p.add_argument("--llm-token-latency", type=float, default=0.005, help="seconds per generated token")
+    p.add_argument("--llm-failure-rate", type=float, default=0.0, help="fraction of model calls that fail")
+    p.add_argument("--bad-sql-rate", type=float, default=0.2, help="fraction of first SQL drafts that are wrong")
+    p.add_argument("--embed-latency", type=float, default=0.01, help="seconds per embedding call")
+    p.add_argument("--docs", type=int, default=20, help="documents ingested before the queries (0 to skip)")
+    p.add_argument("--doc-words", type=int, default=3000, help="words per ingested document")
+    p.add_argument("--speculative", action="store_true", help="enable speculative SQL generation")
+    p.add_argument("--no-cache", action="store_true", help="disable the SQL result and semantic caches")
+    p.add_argument("--seed", type=int, default=0)
+    p.add_argument("--output", help="result file (default: benchmarks/results/<time>_<commit>.json)")
+    p.add_argument("--compare", help="earlier result file to compare against")
+    return p.parse_args(argv)
+
+
+def _configure_env(args: argparse.Namespace, workdir: str) -> None:
+    # Must happen before the app modules are imported: they read their settings at import time
+    os.environ.update({
+        "RAG_BACKEND": "local",
+        "RAG_LOCAL_INDEX_DIR": os.path.join(workdir, "index"),
+        "RAG_INGEST_MANIFEST": os.path.join(workdir, "manifest.json"),
+        "SCHEMA_CATALOG_PATH": os.path.join(workdir, "schema_catalog.json"),
+        "STARTUP_SNAPSHOT_PATH": "",
+        "SQL_ASYNC_POLL_SECONDS": "0.01",
+        "SQL_POOL_MIN": "0",
+        "SQL_SPECULATIVE": "1" if args.speculative else "0",
+    })
+    if args.no_cache:
+        os.environ.update({"SQL_CACHE_TTL_SECONDS": "0", "SQL_SEMANTIC_CACHE": "0", "RAG_RESULTS_TTL_SECONDS": "0"})
+
+
+def _git_commit() -> str:
+    try:
+        out = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True, text=True)
+        return out.stdout.strip() or "unknown"
+    except OSError:
+        return "unknown"
+
+
+def percentiles(values: List[float]) -> Dict[str, float]:
+    if not values:
+        return {"count": 0}
+    arr = np.asarray(values)
+    return {
+        "count": len(values),
+        "mean": round(float(arr.mean()), 4),
+        "p50": round(float(np.percentile(arr, 50)), 4),
+        "p95": round(float(np.percentile(arr, 95)), 4),
+        "p99": round(float(np.percentile(arr, 99)), 4),
+        "max": round(float(arr.max()), 4),
+    }
+
+
+class Recorder:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.samples: Dict[str, List[float]] = defaultdict(list)
+        self.outcomes: Dict[str, Dict[str, int]] = defaultdict(lambda: defaultdict(int))
+
+    def add(self, name: str, seconds: float, outcome: str = "ok") -> None:
+        with self._lock:
+            self.samples[name].append(seconds)
+            self.outcomes[name][outcome] += 1
+
+
+def run_ingest(args: argparse.Namespace) -> Dict:
+    import rag
+    from standins import synthetic_document
+
+    docs = [synthetic_document(i, args.doc_words, args.seed) for i in range(args.docs)]
+    contents = ["data:text/plain;base64," + base64.b64encode(d.encode("utf-8")).decode("ascii") for d in docs]
+    names = [f"doc_{i}.txt" for i in range(args.docs)]
+    t0 = time.perf_counter()
+    chunks = rag.ingest_uploaded_files(contents, names)
+    seconds = time.perf_counter() - t0
+    stats = rag.last_ingest_stats
+    return {
+        "documents": args.docs,
+        "chunks": chunks,
+        "seconds": round(seconds, 4),
+        "chunks_per_second": round(chunks / seconds, 2) if seconds else None,
+        "stages": {k: round(v, 4) for k, v in stats.seconds.items()} if stats else {},
+    }
+
+
+async def run_users(args: argparse.Namespace, app, recorder: Recorder) -> Dict:
+    from metrics import new_trace_id
+
+    errors = defaultdict(int)
+
+    async def user(uid: int) -> None:
+        session_id = f"bench-{uid}"
+        for i in range(args.questions):
+            question = QUESTIONS[(uid + i) % len(QUESTIONS)]
+            if args.unique_questions:
+                question = f"{question} (user {uid}, question {i})"
+            new_trace_id()  # one trace per question, as the Flask request hook would do
+            t0 = time.perf_counter()
+            out = await app.on_send(1, question, app.DEFAULT_ENDPOINT, session_id, None)
+            recorder.add("on_send", time.perf_counter() - t0)
+            answer, stream_id = out[3], out[4]
+            if stream_id is None:
+                errors["error" if answer.startswith("Error") else "no_rows"] += 1
+            else:
+                # Poll as the page does, so the answer also lands in the session history
+                first = None
+                while True:
+                    text, _, finished = app.on_answer_poll(0, stream_id, session_id)
+                    if isinstance(text, str) and text and first is None:
+                        first = time.perf_counter() - t0
+                        recorder.add("first_token", first)
+                    if finished:
+                        break
+                    await asyncio.sleep(0.002)
+                if isinstance(text, str) and text.startswith("Error"):
+                    errors["answer_error"] += 1
+            recorder.add("total", time.perf_counter() - t0)
+            if args.think_time:
+                await asyncio.sleep(args.think_time)
+
+    t0 = time.perf_counter()
+    await asyncio.gather(*(user(u) for u in range(args.users)))
+    wall = time.perf_counter() - t0
+    requests = args.users * args.questions
+    return {"requests": requests, "wall_seconds": round(wall, 4), "qps": round(requests / wall, 3), "errors": dict(errors)}
+
+
+def print_report(report: Dict, baseline: Optional[Dict] = None) -> None:
+    print(f"\n{report['run']['requests']} requests from {report['params']['users']} users "
+          f"in {report['run']['wall_seconds']:.2f}s ({report['run']['qps']} q/s), errors: {report['run']['errors']}")
+    if report.get("ingest"):
+        ing = report["ingest"]
+        print(f"Ingest: {ing['chunks']} chunks from {ing['documents']} docs in {ing['seconds']:.2f}s")
+    header = f"{'metric':<22}{'p50':>9}{'p95':>9}{'p99':>9}{'n':>7}"
+    if baseline:
+        header += f"{'Δp50':>9}{'Δp95':>9}"
+    print(header)
+    base = (baseline or {}).get("latency", {})
+    for name, s in report["latency"].items():
+        if not s.get("count"):
+            continue
+        line = f"{name:<22}{s['p50']:>9.3f}{s['p95']:>9.3f}{s['p99']:>9.3f}{s['count']:>7}"
+        b = base.get(name)
+        if b and b.get("count"):
+            line += f"{s['p50'] - b['p50']:>+9.3f}{s['p95'] - b['p95']:>+9.3f}"
+        print(line)
+
+
+def main(argv: Optional[List[str]] = None) -> Dict:
+    args = parse_args(argv)
+    workdir = tempfile.mkdtemp(prefix="bench-")
+    _configure_env(args, workdir)
+
+    import dbsql
+    import llm
+    import rag
+    from standins import DuckDBWarehouse, FakeChatModel, FakeEmbeddings
+
+    warehouse = DuckDBWarehouse(rows=args.rows, seed=args.seed, latency=args.sql_latency)
+    dbsql._POOL = dbsql.ConnectionPool(connect=warehouse.connect, min_size=0, max_size=args.pool_size)
+    embeddings = FakeEmbeddings(latency=args.embed_latency)
+    rag.get_embeddings = lambda: embeddings
+
+    def fake_llm(endpoint: str, temperature: Optional[float] = None) -> FakeChatModel:
+        return FakeChatModel(
+            endpoint=endpoint,
+            latency=args.llm_latency,
+            token_latency=args.llm_token_latency,
+            failure_rate=args.llm_failure_rate,
+            bad_sql_rate=args.bad_sql_rate,
+            seed=args.seed + int((temperature or 0) * 100),
+        )
+
+    llm.get_chat_llm = fake_llm
+    llm.fetch_llm_endpoints = lambda: list(llm.FOUNDATION_DEFAULTS)
+
+    import app  # picks up the patched functions above
+
+    recorder = Recorder()
+    app.answer_pipeline.add_listener(lambda name, seconds, outcome: recorder.add(f"stage.{name}", seconds, outcome))
+
+    ingest = run_ingest(args) if args.docs else None
+    run = asyncio.run(run_users(args, app, recorder))
+
+    report = {
+        "meta": {
+            "commit": _git_commit(),
+            "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+        },
+        "params": vars(args),
+        "run": run,
+        "ingest": ingest,
+        "latency": {name: percentiles(values) for name, values in sorted(recorder.samples.items())},
+        "stage_outcomes": {name: dict(o) for name, o in sorted(recorder.outcomes.items()) if set(o) != {"ok"}},
+        "sql_cache": dbsql.cache_stats(),
+        "sql_pool": dbsql.pool_stats(),
+        "llm_router": llm.router.stats(),
+        "sql_admission": dbsql.admission_stats(),
+    }
+
+    output = args.output or os.path.join(
+        HERE, "results", f"{datetime.now().strftime('%Y%m%d-%H%M%S')}_{report['meta']['commit']}.json"
+    )
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2, default=str)
+
+    baseline = None
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+    print_report(report, baseline)
+    print(f"\nResults written to {output}")
+    return report
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,305 @@
+"""Local stand-ins for the Databricks services the app talks to, for offline benchmarks.
+
+- ``DuckDBWarehouse``: an embedded DuckDB database with a synthetic ``samples.nyctaxi.trips``,
+  exposing the subset of the databricks-sql cursor API that dbsql.py uses.
+- ``FakeChatModel``: a deterministic chat model with configurable latency and failure rates.
+- ``FakeEmbeddings``: deterministic hashed bag-of-words embeddings.
+"""
+import re
+import time
+import zlib
+import random
+import hashlib
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Iterator, List, Optional
+
+import duckdb
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import sqlglot
+from langchain_core.embeddings import Embeddings
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk, BaseMessage
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+
+TRIPS_TABLE = "samples.nyctaxi.trips"
+
+_DESCRIBE_RE = re.compile(r"^\s*describe\s+(?:table\s+)?([\w.`]+)\s*;?\s*$", re.I)
+_EXPLAIN_COST_RE = re.compile(r"^\s*explain\s+cost\s+(.*)$", re.I | re.S)
+_SHOW_TABLES_RE = re.compile(r"^\s*show\s+tables\s+in\s+([\w`]+)\.([\w`]+)\s*;?\s*$", re.I)
+_TYPES = {"INTEGER": "int", "BIGINT": "bigint", "DOUBLE": "double", "VARCHAR": "string", "TIMESTAMP": "timestamp"}
+
+
+def synthetic_trips(rows: int, seed: int = 0) -> pd.DataFrame:
+    """Trips with the columns and rough distributions of samples.nyctaxi.trips."""
+    rng = np.random.default_rng(seed)
+    pickup = pd.Timestamp("2016-01-01") + pd.to_timedelta(rng.integers(0, 60 * 24 * 3600, rows), unit="s")
+    distance = np.round(rng.gamma(1.5, 2.0, rows), 2)
+    duration = pd.to_timedelta((distance * rng.uniform(2.5, 6.0, rows) + 2) * 60, unit="s")
+    zips = rng.integers(10001, 10300, (2, rows)).astype(np.int32)
+    return pd.DataFrame({
+        "tpep_pickup_datetime": pickup,
+        "tpep_dropoff_datetime": pickup + duration,
+        "trip_distance": distance,
+        "fare_amount": np.round(2.5 + distance * 2.5 + rng.normal(0, 1.5, rows).clip(-2, None), 2),
+        "pickup_zip": zips[0],
+        "dropoff_zip": zips[1],
+    })
+
+
+class _Cursor:
+    def __init__(self, conn: "_Connection"):
+        self._conn = conn
+        self._result: Optional[pa.Table] = None
+        self._offset = 0
+        self._future: Optional[Future] = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _run(self, query: str) -> pa.Table:
+        if self._conn.latency:
+            time.sleep(self._conn.latency)  # warehouse round trip
+        return self._conn.query(query)
+
+    def _set_result(self, table: pa.Table) -> None:
+        self._result = table
+        self._offset = 0
+
+    @property
+    def description(self) -> Optional[List[tuple]]:
+        # DB-API: one (name, type_code, ...) entry per column, None when there is no result set
+        if self._result is None:
+            return None
+        return [(f.name, str(f.type), None, None, None, None, None) for f in self._result.schema]
+
+    def execute(self, query: str) -> "_Cursor":
+        self._set_result(self._run(query))
+        return self
+
+    def execute_async(self, query: str) -> None:
+        self._future = self._conn.executor.submit(self._run, query)
+
+    def is_query_pending(self) -> bool:
+        return self._future is not None and not self._future.done()
+
+    def get_async_execution_result(self) -> None:
+        self._set_result(self._future.result())
+
+    def cancel(self) -> None:
+        self._conn.interrupt()
+
+    def fetchmany_arrow(self, size: int) -> pa.Table:
+        if self._result is None:
+            raise RuntimeError("No result set.")
+        table = self._result.slice(self._offset, size)
+        self._offset += table.num_rows
+        return table
+
+    def fetchall_arrow(self) -> pa.Table:
+        return self.fetchmany_arrow(max(0, self._result.num_rows - self._offset) if self._result else 0)
+
+    def fetchall(self) -> List[tuple]:
+        return [tuple(row.values()) for row in self.fetchall_arrow().to_pylist()]
+
+    def close(self) -> None:
+        self._result = None
+
+
+class _Connection:
+    def __init__(self, db: duckdb.DuckDBPyConnection, latency: float, executor: ThreadPoolExecutor):
+        self._db = db
+        self._lock = threading.Lock()
+        self.latency = latency
+        self.executor = executor
+
+    def cursor(self) -> _Cursor:
+        return _Cursor(self)
+
+    def query(self, query: str) -> pa.Table:
+        m = _DESCRIBE_RE.match(query)
+        if m:
+            return self._describe(m.group(1).replace("`", ""))
+        m = _EXPLAIN_COST_RE.match(query)
+        if m:
+            return self._explain_cost(m.group(1))
+        m = _SHOW_TABLES_RE.match(query)
+        if m:
+            catalog, schema = (g.replace("`", "") for g in m.groups())
+            sql = (
+                f"SELECT '{schema}' AS database, table_name AS tableName, false AS isTemporary "
+                f"FROM information_schema.tables WHERE table_catalog = '{catalog}' AND table_schema = '{schema}'"
+            )
+        else:
+            sql = sqlglot.transpile(query, read="databricks", write="duckdb")[0]
+        with self._lock:
+            result = self._db.execute(sql).arrow()
+        return result.read_all() if isinstance(result, pa.RecordBatchReader) else result
+
+    def _describe(self, table: str) -> pa.Table:
+        with self._lock:
+            rows = self._db.execute(f"DESCRIBE {table}").fetchall()
+        return pa.table({
+            "col_name": [r[0] for r in rows],
+            "data_type": [_TYPES.get(r[1], r[1].lower()) for r in rows],
+            "comment": [None] * len(rows),
+        })
+
+    def _explain_cost(self, query: str) -> pa.Table:
+        # Spark-style plan with one scan per table, sized as 8 bytes per value
+        lines = ["== Optimized Logical Plan =="]
+        for table in sqlglot.parse_one(query, read="databricks").find_all(sqlglot.exp.Table):
+            with self._lock:
+                row = self._db.execute(
+                    "SELECT estimated_size, column_count FROM duckdb_tables() "
+                    "WHERE database_name = ? AND schema_name = ? AND table_name = ?",
+                    [table.catalog, table.db, table.name],
+                ).fetchone()
+            if row:
+                lines.append(f"Relation {table.sql()}, Statistics(sizeInBytes={row[0] * row[1] * 8} B)")
+        return pa.table({"plan": ["\n".join(lines)]})
+
+    def interrupt(self) -> None:
+        self._db.interrupt()
+
+    def close(self) -> None:
+        self._db.close()
+
+
+class DuckDBWarehouse:
+    """Embedded stand-in for the SQL warehouse. Pass ``connect`` to ``dbsql.ConnectionPool``.
+
+    Queries are transpiled from Databricks SQL to DuckDB with sqlglot. ``latency`` seconds are
+    added to every statement to model the warehouse round trip.
+    """
+
+    def __init__(self, rows: int = 100_000, seed: int = 0, latency: float = 0.0):
+        self.latency = latency
+        self._db = duckdb.connect()
+        self._db.execute("ATTACH ':memory:' AS samples")
+        self._db.execute("CREATE SCHEMA samples.nyctaxi")
+        self._db.register("synthetic_trips", synthetic_trips(rows, seed))
+        self._db.execute(f"CREATE TABLE {TRIPS_TABLE} AS SELECT * FROM synthetic_trips")
+        self._db.unregister("synthetic_trips")
+        self._executor = ThreadPoolExecutor(thread_name_prefix="duckdb")
+
+    def connect(self) -> _Connection:
+        return _Connection(self._db.cursor(), self.latency, self._executor)
+
+
+# -------- chat model --------
+SQL_TEMPLATES = [
+    f"SELECT pickup_zip, COUNT(*) AS trips FROM {TRIPS_TABLE} GROUP BY pickup_zip ORDER BY trips DESC LIMIT 10",
+    f"SELECT AVG(fare_amount) AS avg_fare, AVG(trip_distance) AS avg_distance FROM {TRIPS_TABLE}",
+    f"SELECT date_trunc('HOUR', tpep_pickup_datetime) AS hour, COUNT(*) AS trips FROM {TRIPS_TABLE} "
+    "GROUP BY 1 ORDER BY 1 LIMIT 200",
+    f"SELECT dropoff_zip, ROUND(AVG(fare_amount / NULLIF(trip_distance, 0)), 2) AS fare_per_mile "
+    f"FROM {TRIPS_TABLE} GROUP BY dropoff_zip ORDER BY fare_per_mile DESC LIMIT 20",
+    f"SELECT * FROM {TRIPS_TABLE} WHERE trip_distance > 10 ORDER BY fare_amount DESC LIMIT 50",
+    f"SELECT dayofweek(tpep_pickup_datetime) AS dow, percentile_approx(fare_amount, 0.5) AS median_fare "
+    f"FROM {TRIPS_TABLE} GROUP BY 1 ORDER BY 1",
+]
+_QUESTION_RE = re.compile(r"Question:\n(.*?)(?:\n\n|$)", re.S)
+_WORDS = (
+    "the trips fares distance zip pickup dropoff average higher lower than most during hours weekdays "
+    "weekends rides across city airport longer shorter typical result shows"
+).split()
+
+
+class FakeChatModel(BaseChatModel):
+    """Deterministic chat model answering the prompts in llm.py.
+
+    SQL prompts get one of ``SQL_TEMPLATES`` chosen by question; ``bad_sql_rate`` of first
+    attempts reference a missing column so the refine loop is exercised. ``failure_rate`` of
+    calls raise. ``latency`` is paid before the first token, ``token_latency`` per token.
+    """
+
+    endpoint: str = ""
+    latency: float = 0.0
+    token_latency: float = 0.0
+    failure_rate: float = 0.0
+    bad_sql_rate: float = 0.0
+    answer_words: int = 60
+    seed: int = 0
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake-benchmark"
+
+    def _rng(self, messages: List[BaseMessage]) -> random.Random:
+        text = "\n".join(str(m.content) for m in messages)
+        digest = hashlib.sha256(f"{self.seed}:{text}".encode("utf-8")).digest()
+        return random.Random(int.from_bytes(digest[:8], "big"))
+
+    def _respond(self, messages: List[BaseMessage]) -> List[str]:
+        rng = self._rng(messages)
+        if rng.random() < self.failure_rate:
+            raise RuntimeError("Simulated model endpoint failure.")
+        system, human = str(messages[0].content), str(messages[-1].content)
+        m = _QUESTION_RE.search(human)
+        question = m.group(1).strip() if m else human
+        if "Databricks SQL expert" in system:
+            sql = SQL_TEMPLATES[zlib.crc32(question.encode("utf-8")) % len(SQL_TEMPLATES)]
+            if "Fix the SQL" not in system and rng.random() < self.bad_sql_rate:
+                sql = sql.replace("fare_amount", "fare_amt").replace("pickup_zip", "pickup_zipcode")
+            return ["```sql\n", *re.findall(r"\S+\s*", sql), "\n```"]
+        words = [rng.choice(_WORDS) for _ in range(self.answer_words)]
+        return [f"{w} " for w in words]
+
+    def _generate(self, messages: List[BaseMessage], stop=None, run_manager=None, **kwargs: Any) -> ChatResult:
+        tokens = self._respond(messages)
+        time.sleep(self.latency + self.token_latency * len(tokens))
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content="".join(tokens)))])
+
+    def _stream(
+        self, messages: List[BaseMessage], stop=None, run_manager=None, **kwargs: Any
+    ) -> Iterator[ChatGenerationChunk]:
+        tokens = self._respond(messages)
+        time.sleep(self.latency)
+        for token in tokens:
+            time.sleep(self.token_latency)
+            yield ChatGenerationChunk(message=AIMessageChunk(content=token))
+
+
+# -------- embeddings --------
+class FakeEmbeddings(Embeddings):
+    """Hashed bag-of-words vectors: deterministic, and texts sharing words score as similar."""
+
+    def __init__(self, dim: int = 256, latency: float = 0.0):
+        self.dim = dim
+        self.latency = latency
+
+    def _embed(self, text: str) -> List[float]:
+        vec = np.zeros(self.dim, dtype=np.float32)
+        for word in re.findall(r"\w+", text.lower()):
+            h = zlib.crc32(word.encode("utf-8"))
+            vec[h % self.dim] += 1.0 if h & 0x80000000 else -1.0
+        norm = float(np.linalg.norm(vec))
+        return (vec / norm if norm else vec).tolist()
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        if self.latency:
+            time.sleep(self.latency)  # one round trip per batch
+        return [self._embed(t) for t in texts]
+
+    def embed_query(self, text: str) -> List[float]:
+        if self.latency:
+            time.sleep(self.latency)
+        return self._embed(text)
+
+
+def synthetic_document(index: int, words: int, seed: int = 0) -> str:
+    """Plain-text document of roughly ``words`` words in sentences and paragraphs."""
+    rng = random.Random(seed * 1_000_003 + index)
+    sentences, n = [], 0
+    while n < words:
+        length = rng.randint(8, 20)
+        sentences.append(" ".join(rng.choice(_WORDS) for _ in range(length)).capitalize() + ".")
+        n += length
+    paragraphs = [" ".join(sentences[i:i + 5]) for i in range(0, len(sentences), 5)]
+    return f"Document {index}\n\n" + "\n\n".join(paragraphs)
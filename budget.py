@@ -0,0 +1,165 @@
+import os
+import re
+import math
+import logging
+import threading
+from typing import Dict, Optional
+
+import pandas as pd
+
+from rag import count_tokens
+
+logger = logging.getLogger(__name__)
+
+# Prompt size limit in tokens; PROMPT_TOKEN_BUDGETS overrides it per endpoint ("endpoint=tokens,...")
+PROMPT_TOKEN_BUDGET = int(os.getenv("PROMPT_TOKEN_BUDGET", "6000"))
+PROMPT_TOKEN_BUDGETS = os.getenv("PROMPT_TOKEN_BUDGETS", "")
+# Most of the budget a query result may take in the summary prompt
+PROMPT_RESULT_TOKENS = int(os.getenv("PROMPT_RESULT_TOKENS", "1500"))
+# Results up to this many rows are sent as CSV; larger ones as column statistics plus a few rows
+PROMPT_RESULT_ROWS = int(os.getenv("PROMPT_RESULT_ROWS", "10"))
+PROMPT_ERROR_TOKENS = int(os.getenv("PROMPT_ERROR_TOKENS", "200"))
+
+_TERM_RE = re.compile(r"\w{3,}")
+# Stack frames and echoed SQL in warehouse errors; never the part the model needs
+_NOISE_LINE = re.compile(r"^\s*(at |File \"|Traceback|Caused by:|\.\.\. \d+ more|JVM stacktrace)")
+_ERROR_LINE = re.compile(r"\[[A-Z][A-Z0-9_.]+\]|Error|Exception|cannot|not found|mismatch|invalid", re.I)
+
+
+def _budgets() -> Dict[str, int]:
+    budgets = {}
+    for item in PROMPT_TOKEN_BUDGETS.split(","):
+        name, _, value = item.partition("=")
+        if name.strip() and value.strip():
+            budgets[name.strip()] = int(value)
+    return budgets
+
+
+_BUDGETS = _budgets()
+# Endpoint -> tokens reported by the endpoint per token counted by count_tokens, learned from responses
+_RATIOS: Dict[str, float] = {}
+_RATIOS_LOCK = threading.Lock()
+
+
+def endpoint_of(llm) -> str:
+    return getattr(llm, "endpoint", None) or getattr(llm, "model", None) or type(llm).__name__
+
+
+def prompt_budget(endpoint: Optional[str] = None) -> int:
+    return _BUDGETS.get(endpoint or "", PROMPT_TOKEN_BUDGET)
+
+
+def calibrate(endpoint: str, estimated: int, reported: int) -> None:
+    """Fold a reported prompt token count into the endpoint's tokenizer ratio (moving average)."""
+    if estimated <= 0 or reported <= 0:
+        return
+    with _RATIOS_LOCK:
+        ratio = reported / estimated
+        prev = _RATIOS.get(endpoint)
+        _RATIOS[endpoint] = ratio if prev is None else 0.8 * prev + 0.2 * ratio
+
+
+def tokens(text: str, endpoint: Optional[str] = None) -> int:
+    """``count_tokens`` scaled to the endpoint's tokenizer, once responses have calibrated it."""
+    return math.ceil(count_tokens(text) * _RATIOS.get(endpoint or "", 1.0))
+
+
+def truncate(text: str, max_tokens: int, endpoint: Optional[str] = None) -> str:
+    n = tokens(text, endpoint)
+    if n <= max_tokens:
+        return text
+    if max_tokens <= 0:
+        return ""
+    cut = text[: int(len(text) * max_tokens / n)]
+    return cut.rsplit(None, 1)[0] + " …" if " " in cut else cut + " …"
+
+
+def fit_context(question: str, context: Optional[str], max_tokens: int, endpoint: Optional[str] = None) -> str:
+    """The passages of ``context`` most relevant to ``question`` that fit in ``max_tokens``.
+
+    Passages are ranked by the question terms they share, ties going to retrieval order, and
+    are returned in retrieval order; the first passage that does not fit is cut to the space left.
+    """
+    if not context or max_tokens <= 0:
+        return ""
+    if tokens(context, endpoint) <= max_tokens:
+        return context
+    passages = [p.strip() for p in context.split("\n\n") if p.strip()]
+    terms = set(_TERM_RE.findall(question.lower()))
+    ranked = sorted(
+        range(len(passages)), key=lambda i: (-len(terms & set(_TERM_RE.findall(passages[i].lower()))), i)
+    )
+    kept: Dict[int, str] = {}
+    left = max_tokens
+    for i in ranked:
+        n = tokens(passages[i], endpoint)
+        if n <= left:
+            kept[i] = passages[i]
+            left -= n
+        elif left >= 32:
+            kept[i] = truncate(passages[i], left, endpoint)
+            break
+    logger.info(f"RAG context trimmed to {len(kept)} of {len(passages)} passages ({max_tokens} token budget)")
+    return "\n\n".join(kept[i] for i in sorted(kept))
+
+
+def compact_error(error_text: str, max_tokens: int = PROMPT_ERROR_TOKENS) -> str:
+    """The essential line(s) of a warehouse error: no stack frames, no echoed SQL."""
+    lines = []
+    for line in error_text.splitlines():
+        if line.strip().startswith("== SQL"):
+            break
+        if line.strip() and not _NOISE_LINE.match(line):
+            lines.append(line.strip())
+    essential = [line for line in lines if _ERROR_LINE.search(line)][:2] or lines[:1]
+    return truncate(" ".join(essential) or error_text.strip(), max_tokens)
+
+
+def _number(value) -> str:
+    return "" if pd.isna(value) else f"{value:.6g}"
+
+
+def column_stats(df: pd.DataFrame) -> str:
+    """Per-column statistics of ``df``, computed a column at a time rather than row by row."""
+    parts = []
+    numeric = df.select_dtypes(include="number").select_dtypes(exclude="bool")
+    if not numeric.empty:
+        stats = pd.DataFrame({
+            "nulls": numeric.isna().sum(),
+            "mean": numeric.mean(),
+            "min": numeric.min(),
+            "median": numeric.median(),
+            "max": numeric.max(),
+        })
+        rows = [
+            ",".join([str(col), str(int(s["nulls"]))] + [_number(s[k]) for k in ("mean", "min", "median", "max")])
+            for col, s in stats.iterrows()
+        ]
+        parts.append("Numeric columns (column,nulls,mean,min,median,max):\n" + "\n".join(rows))
+    others = []
+    for col in df.columns.difference(numeric.columns, sort=False):
+        series = df[col]
+        if pd.api.types.is_datetime64_any_dtype(series.dtype):
+            others.append(f"- {col}: from {series.min()} to {series.max()}, {int(series.isna().sum())} nulls")
+        else:
+            top = series.value_counts().head(5)
+            values = ", ".join(f"{v} ({n})" for v, n in top.items())
+            others.append(f"- {col}: {series.nunique()} distinct, {int(series.isna().sum())} nulls; top: {values}")
+    if others:
+        parts.append("Other columns:\n" + "\n".join(others))
+    return "\n\n".join(parts)
+
+
+def describe_result(df: pd.DataFrame, max_tokens: int = PROMPT_RESULT_TOKENS, endpoint: Optional[str] = None) -> str:
+    """The query result for a prompt: CSV when small, else column statistics and the first rows that fit."""
+    if len(df) <= PROMPT_RESULT_ROWS:
+        csv = df.to_csv(index=False)
+        if tokens(csv, endpoint) <= max_tokens:
+            return f"Result ({len(df)} rows, CSV):\n{csv}"
+    text = truncate(f"Result: {len(df)} rows, {len(df.columns)} columns.\n\n{column_stats(df)}", max_tokens, endpoint)
+    left = max_tokens - tokens(text, endpoint)
+    for n in (PROMPT_RESULT_ROWS, 5, 3, 1):
+        head = df.head(n).to_csv(index=False)
+        if tokens(head, endpoint) <= left:
+            return f"{text}\n\nFirst {min(n, len(df))} rows (CSV):\n{head}"
+    return text
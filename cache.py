@@ -0,0 +1,228 @@
+import os
+import time
+import asyncio
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional, Tuple, Type
+
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+_MISSING = object()
+
+
+def dataframe_nbytes(df: pd.DataFrame) -> int:
+    return int(df.memory_usage(index=True, deep=True).sum())
+
+
+class TTLCache:
+    """Thread-safe LRU cache with optional TTL, entry limit and memory budget in bytes."""
+
+    def __init__(
+        self,
+        max_bytes: Optional[int] = None,
+        max_entries: Optional[int] = None,
+        ttl: Optional[float] = None,
+        sizeof: Callable[[Any], int] = lambda _: 1,
+    ):
+        self._max_bytes = max_bytes
+        self._max_entries = max_entries
+        self._ttl = ttl
+        self._sizeof = sizeof
+        self._data: "OrderedDict[Hashable, tuple]" = OrderedDict()  # key -> (value, nbytes, expires_at)
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+
+    def _drop_locked(self, key: Hashable) -> None:
+        _, nbytes, _ = self._data.pop(key)
+        self._bytes -= nbytes
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                self._misses += 1
+                return default
+            value, _, expires_at = entry
+            if expires_at is not None and expires_at <= time.monotonic():
+                self._drop_locked(key)
+                self._misses += 1
+                return default
+            self._data.move_to_end(key)
+            self._hits += 1
+            return value
+
+    def set(self, key: Hashable, value: Any) -> None:
+        nbytes = self._sizeof(value)
+        if self._max_bytes is not None and nbytes > self._max_bytes:
+            return  # would evict everything else and still not fit
+        expires_at = time.monotonic() + self._ttl if self._ttl is not None else None
+        with self._lock:
+            if key in self._data:
+                self._drop_locked(key)
+            self._data[key] = (value, nbytes, expires_at)
+            self._bytes += nbytes
+            while self._data and (
+                (self._max_bytes is not None and self._bytes > self._max_bytes)
+                or (self._max_entries is not None and len(self._data) > self._max_entries)
+            ):
+                oldest = next(iter(self._data))
+                self._drop_locked(oldest)
+                self._evictions += 1
+
+    def pop(self, key: Hashable) -> None:
+        with self._lock:
+            if key in self._data:
+                self._drop_locked(key)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+            self._bytes = 0
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "entries": len(self._data),
+                "bytes": self._bytes,
+                "hits": self._hits,
+                "misses": self._misses,
+                "evictions": self._evictions,
+            }
+
+
+class _Flight:
+    def __init__(self):
+        self.done = threading.Event()
+        self.value = None
+        self.error: Optional[BaseException] = None
+
+
+class SingleFlight:
+    """Coalesce concurrent calls for the same key into one execution."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._flights: Dict[Hashable, _Flight] = {}
+
+    def do(self, key: Hashable, fn: Callable[[], Any]) -> Any:
+        with self._lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight()
+        if not leader:
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.value
+        try:
+            flight.value = fn()
+            return flight.value
+        except BaseException as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._flights[key]
+            flight.done.set()
+
+
+class AsyncSingleFlight:
+    """``SingleFlight`` for coroutines. Callers may be on different event loops (threads).
+
+    A follower whose leader fails with one of ``retry_on``, or whose leader is cancelled, runs the
+    call again rather than sharing an outcome that belongs to the leader's own caller.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._flights: Dict[Hashable, Future] = {}
+
+    def _land(self, key: Hashable) -> None:
+        with self._lock:
+            del self._flights[key]
+
+    async def do(
+        self,
+        key: Hashable,
+        fn: Callable[[], Awaitable[Any]],
+        retry_on: Tuple[Type[BaseException], ...] = (),
+    ) -> Any:
+        while True:
+            with self._lock:
+                flight = self._flights.get(key)
+                leader = flight is None
+                if leader:
+                    flight = self._flights[key] = Future()
+            if leader:
+                break
+            try:
+                # Shielded: a follower that is cancelled must not cancel the shared flight
+                return await asyncio.shield(asyncio.wrap_future(flight))
+            except asyncio.CancelledError:
+                if not flight.cancelled():
+                    raise
+            except retry_on:
+                pass
+        try:
+            value = await fn()
+        except asyncio.CancelledError:
+            self._land(key)
+            flight.cancel()
+            raise
+        except BaseException as e:
+            self._land(key)
+            flight.set_exception(e)
+            raise
+        self._land(key)
+        flight.set_result(value)
+        return value
+
+
+class DataFrameDiskCache:
+    """Parquet-backed cache tier that survives restarts. Entries expire ``ttl`` seconds after writing."""
+
+    def __init__(self, directory: str, ttl: Optional[float] = None):
+        self._dir = directory
+        self._ttl = ttl
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self._dir, hashlib.sha256(key.encode("utf-8")).hexdigest() + ".parquet")
+
+    def get(self, key: str) -> Optional[pd.DataFrame]:
+        path = self._path(key)
+        try:
+            if self._ttl is not None and time.time() - os.path.getmtime(path) > self._ttl:
+                os.remove(path)
+                return None
+            return pd.read_parquet(path)
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            logger.warning(f"Could not read disk cache entry {path}: {e}")
+            return None
+
+    def set(self, key: str, df: pd.DataFrame) -> None:
+        path = self._path(key)
+        tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            df.to_parquet(tmp, index=False)
+            os.replace(tmp, path)
+        except Exception as e:
+            logger.warning(f"Could not write disk cache entry {path}: {e}")
+            if os.path.exists(tmp):
+                os.remove(tmp)
+
+    def clear(self) -> None:
+        for name in os.listdir(self._dir):
+            if name.endswith(".parquet"):
+                os.remove(os.path.join(self._dir, name))
@@ -0,0 +1,239 @@
+import os
+import re
+import json
+import time
+import hashlib
+import logging
+import threading
+from typing import Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+# Schemas crawled into the catalog, as catalog.schema
+SCHEMA_CATALOG_SCHEMAS = [
+    s.strip() for s in os.getenv("SCHEMA_CATALOG_SCHEMAS", "samples.nyctaxi").split(",") if s.strip()
+]
+SCHEMA_CATALOG_PATH = os.getenv("SCHEMA_CATALOG_PATH", ".schema_catalog.json")
+# A crawl re-describes a known table only once its description is older than this
+SCHEMA_CATALOG_REFRESH_SECONDS = float(os.getenv("SCHEMA_CATALOG_REFRESH_SECONDS", str(24 * 3600)))
+# Tables, and columns per table, put in a SQL prompt
+SCHEMA_CATALOG_TOP_K = int(os.getenv("SCHEMA_CATALOG_TOP_K", "4"))
+SCHEMA_CATALOG_MAX_COLUMNS = int(os.getenv("SCHEMA_CATALOG_MAX_COLUMNS", "40"))
+
+_TERM_RE = re.compile(r"[a-z0-9]+")
+_SAVE_EVERY = 20
+
+
+def _terms(text: str) -> set:
+    # Singular forms, so "fares" finds fare_amount
+    return {t[:-1] if len(t) > 3 and t.endswith("s") else t for t in _TERM_RE.findall(text.lower()) if len(t) > 2}
+
+
+def _doc(name: str, columns: List[List[str]]) -> str:
+    """Text a table is retrieved by: its name and its columns' names, types and comments."""
+    cols = "; ".join(" ".join(part for part in c if part) for c in columns)
+    return f"Table {name}. Columns: {cols}"
+
+
+class SchemaCatalog:
+    """Tables and columns of the configured schemas, crawled incrementally and cached in a local file.
+
+    Tables are indexed by an embedding of their description, plus term overlap with the question,
+    so that a SQL prompt only carries the few tables (and columns) relevant to it.
+    """
+
+    def __init__(
+        self,
+        schemas: List[str] = SCHEMA_CATALOG_SCHEMAS,
+        path: Optional[str] = SCHEMA_CATALOG_PATH,
+        run_sql: Optional[Callable[[str], pd.DataFrame]] = None,
+        embed_documents: Optional[Callable[[List[str]], List[List[float]]]] = None,
+        embed_query: Optional[Callable[[str], List[float]]] = None,
+    ):
+        self._schemas = schemas
+        self._path = path
+        self._run_sql = run_sql
+        self._embed_documents = embed_documents
+        self._embed_query = embed_query
+        self._tables: Dict[str, Dict] = {}  # name -> {"columns": [[name, type, comment]], "described_at": ts}
+        self._vectors: Dict[str, Tuple[str, np.ndarray]] = {}  # name -> (doc hash, unit vector)
+        self._lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+        self._load()
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._tables)
+
+    # -------- cache file --------
+    def _vectors_path(self) -> str:
+        return f"{self._path}.vectors.npz"
+
+    def _load(self) -> None:
+        if not self._path or not os.path.exists(self._path):
+            return
+        try:
+            with open(self._path, "r", encoding="utf-8") as f:
+                self._tables = json.load(f).get("tables", {})
+            if os.path.exists(self._vectors_path()):
+                data = np.load(self._vectors_path())
+                self._vectors = {
+                    str(n): (str(h), v) for n, h, v in zip(data["names"], data["hashes"], data["vectors"])
+                }
+            logger.info(f"Loaded schema catalog with {len(self._tables)} tables from {self._path}")
+        except Exception as e:
+            logger.warning(f"Could not read schema catalog {self._path}: {e}")
+
+    def _save(self) -> None:
+        if not self._path:
+            return
+        with self._lock:
+            tables = dict(self._tables)
+            vectors = dict(self._vectors)
+        try:
+            tmp = f"{self._path}.tmp"
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump({"saved_at": time.time(), "tables": tables}, f)
+            os.replace(tmp, self._path)
+            if vectors:
+                names = list(vectors)
+                with open(f"{self._vectors_path()}.tmp", "wb") as f:
+                    np.savez(
+                        f,
+                        names=np.array(names),
+                        hashes=np.array([vectors[n][0] for n in names]),
+                        vectors=np.stack([vectors[n][1] for n in names]),
+                    )
+                os.replace(f"{self._vectors_path()}.tmp", self._vectors_path())
+        except Exception as e:
+            logger.warning(f"Could not write schema catalog {self._path}: {e}")
+
+    # -------- crawl --------
+    def _sql(self, query: str) -> pd.DataFrame:
+        if self._run_sql is not None:
+            return self._run_sql(query)
+        from dbsql import run_sql
+        from admission import PRIORITY_BACKGROUND
+
+        return run_sql(query, use_cache=False, priority=PRIORITY_BACKGROUND)
+
+    def _list_tables(self, schema: str) -> List[str]:
+        catalog_name, schema_name = schema.split(".", 1)
+        df = self._sql(f"SHOW TABLES IN `{catalog_name}`.`{schema_name}`")
+        if "isTemporary" in df.columns:
+            df = df[~df["isTemporary"].astype(str).str.lower().eq("true")]
+        return [f"{catalog_name}.{schema_name}.{t}" for t in df["tableName"].astype(str)]
+
+    def _describe(self, table: str) -> List[List[str]]:
+        df = self._sql(f"DESCRIBE TABLE {table}")
+        columns = []
+        for row in df.itertuples(index=False):
+            name = str(row.col_name or "").strip()
+            if not name or name.startswith("#"):
+                break  # partition and detail sections repeat columns
+            comment = getattr(row, "comment", None)
+            columns.append([name, str(row.data_type), "" if comment is None or pd.isna(comment) else str(comment)])
+        return columns
+
+    def refresh(self) -> int:
+        """Crawl the schemas: describe new and stale tables, drop removed ones, re-index; return the table count.
+
+        Progress is saved every ``_SAVE_EVERY`` tables, so an interrupted crawl resumes where it stopped.
+        """
+        with self._refresh_lock:
+            for schema in self._schemas:
+                try:
+                    names = self._list_tables(schema)
+                except Exception as e:
+                    logger.warning(f"Could not list tables in {schema}: {e}")
+                    continue
+                with self._lock:
+                    removed = [n for n in self._tables if n.startswith(f"{schema}.") and n not in set(names)]
+                    for name in removed:
+                        self._tables.pop(name, None)
+                        self._vectors.pop(name, None)
+                    stale = [
+                        n for n in names
+                        if time.time() - self._tables.get(n, {}).get("described_at", 0) >= SCHEMA_CATALOG_REFRESH_SECONDS
+                    ]
+                for i, name in enumerate(stale, 1):
+                    try:
+                        columns = self._describe(name)
+                    except Exception as e:
+                        logger.warning(f"Could not describe {name}: {e}")
+                        continue
+                    with self._lock:
+                        self._tables[name] = {"columns": columns, "described_at": time.time()}
+                    if i % _SAVE_EVERY == 0:
+                        self._save()
+                self._index()
+                self._save()
+                logger.info(
+                    f"Schema catalog: {schema} has {len(names)} tables "
+                    f"({len(stale)} described, {len(removed)} removed)"
+                )
+            return len(self)
+
+    def _index(self) -> None:
+        """Embed the descriptions of tables that are new or changed since they were last embedded."""
+        if self._embed_documents is None:
+            return
+        with self._lock:
+            docs = {name: _doc(name, t["columns"]) for name, t in self._tables.items()}
+            hashes = {name: hashlib.sha256(doc.encode("utf-8")).hexdigest()[:16] for name, doc in docs.items()}
+            stale = [n for n in docs if self._vectors.get(n, ("",))[0] != hashes[n]]
+        if not stale:
+            return
+        try:
+            vectors = np.asarray(self._embed_documents([docs[n] for n in stale]), dtype=np.float32)
+        except Exception as e:
+            logger.warning(f"Could not embed schema catalog; tables are ranked by name and column terms: {e}")
+            return
+        vectors /= np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+        with self._lock:
+            for name, vec in zip(stale, vectors):
+                self._vectors[name] = (hashes[name], vec)
+
+    # -------- retrieval --------
+    def select(self, question: str, k: int = SCHEMA_CATALOG_TOP_K) -> List[Tuple[str, List[List[str]]]]:
+        """The ``k`` tables most relevant to ``question``, each with its most relevant columns."""
+        with self._lock:
+            tables = dict(self._tables)
+            vectors = dict(self._vectors)
+        if not tables:
+            return []
+        terms = _terms(question)
+        names = list(tables)
+        lexical = np.array([
+            len(terms & _terms(_doc(n, tables[n]["columns"]))) / max(1, len(terms)) for n in names
+        ])
+        semantic = np.zeros(len(names))
+        if vectors and self._embed_query is not None:
+            try:
+                q = np.asarray(self._embed_query(question), dtype=np.float32)
+                q /= max(float(np.linalg.norm(q)), 1e-12)
+                semantic = np.array([float(vectors[n][1] @ q) if n in vectors else 0.0 for n in names])
+            except Exception as e:
+                logger.warning(f"Schema catalog lookup without embeddings: {e}")
+        order = np.argsort(-(semantic + lexical), kind="stable")[:k]
+        return [(names[i], self._columns_for(terms, tables[names[i]]["columns"])) for i in order]
+
+    @staticmethod
+    def _columns_for(terms: set, columns: List[List[str]]) -> List[List[str]]:
+        if len(columns) <= SCHEMA_CATALOG_MAX_COLUMNS:
+            return columns
+        # Columns the question mentions first, then the rest in table order
+        ranked = sorted(columns, key=lambda c: -len(terms & _terms(f"{c[0]} {c[2]}")))
+        keep = {c[0] for c in ranked[:SCHEMA_CATALOG_MAX_COLUMNS]}
+        return [c for c in columns if c[0] in keep]
+
+    def schema_text(self, question: str, k: int = SCHEMA_CATALOG_TOP_K) -> Optional[str]:
+        """Schema text of the tables relevant to ``question``, one ``Table <name>:`` section each; None if empty."""
+        sections = []
+        for name, columns in self.select(question, k):
+            lines = [f"- {c[0]} {c[1]}" + (f" -- {c[2]}" if c[2] else "") for c in columns]
+            sections.append(f"Table {name}:\nColumns:\n" + "\n".join(lines))
+        return "\n\n".join(sections) or None
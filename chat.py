@@ -1,11 +1,11 @@
 import logging
 import os
 import re
+import uuid
+from typing import Iterator
 import pandas as pd
 import streamlit as st
 from dotenv import load_dotenv  
-from databricks import sql
-from databricks.sdk.core import Config
 from langchain_community.llms import Databricks
 
 logging.basicConfig(level=logging.INFO)
@@ -13,27 +13,16 @@ logger = logging.getLogger(__name__)
 
 load_dotenv()  # Load environment variables from .env file
 
+from dbsql import run_sql, stream_sql, batches_to_pandas  # noqa: E402 - reads env at import
+from llm import timed_stream  # noqa: E402
+
 LLM_ENDPOINT_NAME = "databricks-meta-llama-3-3-70b-instruct"
+RESULT_MAX_ROWS = int(os.getenv("RESULT_MAX_ROWS", "200"))
 
 # Helpers
-def run_sql(query: str) -> pd.DataFrame:
-    cfg = Config()  # uses DATABRICKS_HOST/TOKEN from env
-    http_path = f"/sql/1.0/warehouses/{os.getenv('DATABRICKS_WAREHOUSE_ID')}"
-    with sql.connect(
-        server_hostname=cfg.host,
-        http_path=http_path,
-        credentials_provider=lambda: cfg.authenticate
-    ) as conn:
-        with conn.cursor() as cur:
-            cur.execute(query)
-            try:
-                return cur.fetchall_arrow().to_pandas()
-            except Exception:
-                return pd.DataFrame()
-
 def get_trips_schema_text() -> str:
     try:
-        df = run_sql("DESCRIBE TABLE samples.nyctaxi.trips")
+        df = run_sql("DESCRIBE TABLE samples.nyctaxi.trips", session_id=st.session_state.session_id)
         df = df[df["col_name"].notna() & df["data_type"].notna()]
         cols = [f"{r.col_name} {r.data_type}" for _, r in df.iterrows()]
         return "Columns:\n- " + "\n- ".join(cols)
@@ -73,7 +62,7 @@ Question:
     raw = llm.invoke(prompt)
     return extract_sql(raw)
 
-def summarize_answer(question: str, df: pd.DataFrame, llm: Databricks) -> str:
+def stream_answer(question: str, df: pd.DataFrame, llm: Databricks) -> Iterator[str]:
     sample = df.head(10)
     csv_preview = sample.to_csv(index=False)
     prompt = f"""
@@ -86,13 +75,17 @@ Question:
 CSV preview (up to 10 rows):
 {csv_preview}
 """
-    return llm.invoke(prompt)
+    return timed_stream(llm.stream(prompt), "summary")
 
 # App
 missing = [k for k in ("DATABRICKS_HOST", "DATABRICKS_TOKEN", "DATABRICKS_WAREHOUSE_ID") if not os.getenv(k)]
 if missing:
     st.warning(f"Missing env vars: {', '.join(missing)}")
 
+# Per-browser-session id: admission control limits each session's concurrent warehouse statements
+if "session_id" not in st.session_state:
+    st.session_state.session_id = uuid.uuid4().hex
+
 llm = Databricks(endpoint_name=LLM_ENDPOINT_NAME)
 schema_text = get_trips_schema_text()
 
@@ -118,14 +111,24 @@ if question := st.chat_input("Ask about the taxi trips data..."):
             st.markdown("Proposed SQL:")
             st.code(sql_text, language="sql")
 
-            df = run_sql(f"{sql_text} LIMIT 200")
+            # Render the first batch as soon as it arrives, then the full (capped) result
+            table_slot = st.empty()
+            batches = []
+            for batch in stream_sql(
+                f"{sql_text} LIMIT 200", max_rows=RESULT_MAX_ROWS, session_id=st.session_state.session_id
+            ):
+                if not batches:
+                    table_slot.dataframe(batch.to_pandas(), use_container_width=True)
+                batches.append(batch)
+            df = batches_to_pandas(batches)
             if df.empty:
+                table_slot.empty()
                 answer = "No rows returned or query failed."
                 st.warning(answer)
             else:
-                st.dataframe(df, use_container_width=True)
-                answer = summarize_answer(question, df, llm)
-                st.markdown(answer)
+                table_slot.dataframe(df, use_container_width=True)
+                # Tokens are written as they arrive; write_stream returns the full text
+                answer = st.write_stream(stream_answer(question, df, llm))
         except Exception as e:
             answer = f"Error: {e}"
             st.error(answer)
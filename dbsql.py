@@ -1,71 +1,693 @@
 import os
+import re
+import time
+import asyncio
 import atexit
 import logging
+import threading
+from collections import deque
+from contextlib import contextmanager
+from functools import lru_cache
+from typing import Callable, Dict, Iterator, List, Optional, Set
+
 import pandas as pd
+import pyarrow as pa
 from databricks import sql
+from databricks.sql import exc as sql_exc
 from databricks.sdk.core import Config
 
+from cache import TTLCache, SingleFlight, AsyncSingleFlight, DataFrameDiskCache, dataframe_nbytes
+from metrics import span, record_fetch
+from pipeline import run_in_thread
+from admission import (
+    SQL_MAX_SCAN_BYTES,
+    PRIORITY_INTERACTIVE,
+    AdmissionError,
+    AdmissionQueue,
+    check_scan,
+    parse_scan_bytes,
+)
+
 logger = logging.getLogger(__name__)
 
-# Reuse a single SQL connection
+# Pool of warehouse connections shared by all callback threads
 os.environ.setdefault("DATABRICKS_AUTH_TYPE", "pat")
-_cfg = Config(auth_type="pat")  # uses DATABRICKS_HOST/TOKEN
 _HTTP_PATH = f"/sql/1.0/warehouses/{os.getenv('DATABRICKS_WAREHOUSE_ID')}"
-_SQL_CONN = None
 
-def _get_conn():
-    global _SQL_CONN
-    if _SQL_CONN is not None:
-        return _SQL_CONN
-    if not _cfg.host or not _HTTP_PATH:
+SQL_POOL_MIN = int(os.getenv("SQL_POOL_MIN", "1"))
+SQL_POOL_MAX = int(os.getenv("SQL_POOL_MAX", "8"))
+SQL_POOL_IDLE_SECONDS = float(os.getenv("SQL_POOL_IDLE_SECONDS", "600"))
+SQL_POOL_CHECKOUT_TIMEOUT = float(os.getenv("SQL_POOL_CHECKOUT_TIMEOUT", "30"))
+# Idle connections older than this are pinged with SELECT 1 before reuse
+SQL_POOL_PING_AFTER = float(os.getenv("SQL_POOL_PING_AFTER", "60"))
+
+# Result cache in front of the warehouse
+SQL_CACHE_TTL_SECONDS = float(os.getenv("SQL_CACHE_TTL_SECONDS", "300"))
+SQL_CACHE_MAX_BYTES = int(os.getenv("SQL_CACHE_MAX_BYTES", str(256 * 1024 * 1024)))
+SQL_CACHE_DIR = os.getenv("SQL_CACHE_DIR")  # optional on-disk tier, e.g. /tmp/sql_cache
+
+# Rows requested per fetchmany_arrow call when streaming results
+SQL_FETCH_BATCH_ROWS = int(os.getenv("SQL_FETCH_BATCH_ROWS", "10000"))
+
+# Deadline for run_sql_async; the statement is cancelled on the warehouse when it passes
+SQL_QUERY_TIMEOUT_SECONDS = float(os.getenv("SQL_QUERY_TIMEOUT_SECONDS", "120"))
+SQL_ASYNC_POLL_SECONDS = float(os.getenv("SQL_ASYNC_POLL_SECONDS", "0.5"))
+
+
+@lru_cache(maxsize=1)
+def _config() -> Config:
+    # Built on first connect, not at import: resolving it can take a network round trip, and
+    # offline users of this module (benchmarks, tests) swap out the pool and never connect
+    return Config(auth_type="pat")  # uses DATABRICKS_HOST/TOKEN
+
+
+def _connect():
+    cfg = _config()
+    if not cfg.host or not os.getenv("DATABRICKS_WAREHOUSE_ID"):
         raise RuntimeError("DATABRICKS_HOST and DATABRICKS_WAREHOUSE_ID must be set.")
-    _SQL_CONN = sql.connect(
-        server_hostname=_cfg.host,
+    return sql.connect(
+        server_hostname=cfg.host,
         http_path=_HTTP_PATH,
-        credentials_provider=lambda: _cfg.authenticate
+        credentials_provider=lambda: cfg.authenticate
     )
-    return _SQL_CONN
 
-def _close_conn():
-    global _SQL_CONN
+
+def _is_connection_error(e: Exception) -> bool:
+    # ServerOperationError & co. are SQL errors on a healthy session; these mean the session itself is gone
+    return isinstance(e, (sql_exc.OperationalError, sql_exc.InterfaceError, OSError))
+
+
+def _safe_close(conn) -> None:
     try:
-        if _SQL_CONN is not None:
-            _SQL_CONN.close()
-    finally:
-        _SQL_CONN = None
+        conn.close()
+    except Exception as e:
+        logger.debug(f"Error closing SQL connection: {e}")
+
+
+class ConnectionPool:
+    """Bounded, thread-safe pool of warehouse connections.
+
+    Idle connections above ``min_size`` are closed after ``idle_seconds``. A connection that
+    fails is discarded on release instead of being returned, so other checkouts are unaffected.
+    """
+
+    def __init__(
+        self,
+        connect: Callable = _connect,
+        min_size: int = SQL_POOL_MIN,
+        max_size: int = SQL_POOL_MAX,
+        idle_seconds: float = SQL_POOL_IDLE_SECONDS,
+        checkout_timeout: float = SQL_POOL_CHECKOUT_TIMEOUT,
+        ping_after: float = SQL_POOL_PING_AFTER,
+    ):
+        self._connect = connect
+        self._min_size = max(0, min_size)
+        self._max_size = max(1, max_size, self._min_size)
+        self._idle_seconds = idle_seconds
+        self._checkout_timeout = checkout_timeout
+        self._ping_after = ping_after
+        self._idle: deque = deque()  # (conn, last_used) pairs, most recently used on the right
+        self._cond = threading.Condition()
+        self._size = 0
+        self._in_use = 0
+        self._waiting = 0
+        self._created = 0
+        self._evicted = 0
+        self._closed = False
+
+    def _evict_idle_locked(self) -> List:
+        expired = []
+        now = time.monotonic()
+        while self._idle and self._size > self._min_size and now - self._idle[0][1] > self._idle_seconds:
+            conn, _ = self._idle.popleft()
+            self._size -= 1
+            self._evicted += 1
+            expired.append(conn)
+        return expired
+
+    def _healthy(self, conn, last_used: float) -> bool:
+        if getattr(conn, "open", True) is False:
+            return False
+        if time.monotonic() - last_used < self._ping_after:
+            return True
+        try:
+            with conn.cursor() as cur:
+                cur.execute("SELECT 1")
+                cur.fetchall()
+            return True
+        except Exception as e:
+            logger.info(f"Discarding stale SQL connection: {e}")
+            return False
+
+    def acquire(self):
+        deadline = time.monotonic() + self._checkout_timeout
+        while True:
+            with self._cond:
+                if self._closed:
+                    raise RuntimeError("SQL connection pool is closed.")
+                expired = self._evict_idle_locked()
+                while not self._idle and self._size >= self._max_size:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        raise TimeoutError(
+                            f"Timed out after {self._checkout_timeout}s waiting for a SQL connection "
+                            f"({self._in_use}/{self._max_size} in use)."
+                        )
+                    self._waiting += 1
+                    try:
+                        self._cond.wait(remaining)
+                    finally:
+                        self._waiting -= 1
+                if self._idle:
+                    conn, last_used = self._idle.pop()
+                else:
+                    conn, last_used = None, 0.0
+                    self._size += 1
+                self._in_use += 1
+            for stale in expired:
+                _safe_close(stale)
+
+            if conn is None:
+                try:
+                    conn = self._connect()
+                except Exception:
+                    with self._cond:
+                        self._size -= 1
+                        self._in_use -= 1
+                        self._cond.notify()
+                    raise
+                with self._cond:
+                    self._created += 1
+                return conn
+
+            if self._healthy(conn, last_used):
+                return conn
+            self.release(conn, broken=True)
+
+    def release(self, conn, broken: bool = False) -> None:
+        with self._cond:
+            self._in_use -= 1
+            if broken or self._closed:
+                self._size -= 1
+                if broken:
+                    self._evicted += 1
+            else:
+                self._idle.append((conn, time.monotonic()))
+            self._cond.notify()
+        if broken or self._closed:
+            _safe_close(conn)
+
+    @contextmanager
+    def connection(self):
+        conn = self.acquire()
+        broken = False
+        try:
+            yield conn
+        except Exception as e:
+            broken = _is_connection_error(e)
+            raise
+        finally:
+            self.release(conn, broken=broken)
+
+    def warm(self) -> None:
+        """Open connections up to ``min_size`` ahead of the first query."""
+        conns = []
+        try:
+            for _ in range(self._min_size):
+                conns.append(self.acquire())
+        finally:
+            for conn in conns:
+                self.release(conn)
+
+    def stats(self) -> Dict[str, int]:
+        with self._cond:
+            return {
+                "size": self._size,
+                "idle": len(self._idle),
+                "in_use": self._in_use,
+                "waiting": self._waiting,
+                "created": self._created,
+                "evicted": self._evicted,
+                "min_size": self._min_size,
+                "max_size": self._max_size,
+            }
+
+    def close(self) -> None:
+        with self._cond:
+            self._closed = True
+            idle = [conn for conn, _ in self._idle]
+            self._idle.clear()
+            self._size -= len(idle)
+            self._cond.notify_all()
+        for conn in idle:
+            _safe_close(conn)
+
 
-atexit.register(_close_conn)
+_POOL = ConnectionPool()
+atexit.register(_POOL.close)
 
-def run_sql(query: str) -> pd.DataFrame:
+
+def pool_stats() -> Dict[str, int]:
+    return _POOL.stats()
+
+
+def warm_pool() -> int:
+    """Open ``SQL_POOL_MIN`` connections ahead of the first query; return the pool's size."""
+    _POOL.warm()
+    return _POOL.stats()["size"]
+
+
+def _iter_batches(cur, max_rows: Optional[int], max_bytes: Optional[int], batch_rows: int) -> Iterator[pa.RecordBatch]:
+    if cur.description is None:
+        return  # statement produced no result set
+    rows = 0
+    nbytes = 0
+    while max_rows is None or rows < max_rows:
+        want = batch_rows if max_rows is None else min(batch_rows, max_rows - rows)
+        # A statement with a result set that fails to fetch (e.g. a cast error) raises; it is not an empty result
+        table = cur.fetchmany_arrow(want)
+        if table.num_rows == 0:
+            return
+        record_fetch(table.num_rows, table.nbytes)
+        for batch in table.to_batches():
+            rows += batch.num_rows
+            nbytes += batch.nbytes
+            yield batch
+        if max_bytes is not None and nbytes >= max_bytes:
+            return
+
+
+def stream_sql(
+    query: str,
+    max_rows: Optional[int] = None,
+    max_bytes: Optional[int] = None,
+    batch_rows: int = SQL_FETCH_BATCH_ROWS,
+    session_id: Optional[str] = None,
+    priority: int = PRIORITY_INTERACTIVE,
+) -> Iterator[pa.RecordBatch]:
+    """Yield Arrow record batches as they arrive from the warehouse.
+
+    Fetching stops once ``max_rows`` rows or ``max_bytes`` bytes have been yielded (the last batch
+    may overshoot the byte cap). Closing the generator early closes the cursor and returns the
+    connection to the pool, so callers that only need the first page should ``close()`` it.
+    The statement holds an admission slot until then, and is cost-checked like ``run_sql``.
+    """
+    with _ADMISSION.slot(session_id, priority):
+        with _POOL.connection() as conn:
+            with conn.cursor() as cur:
+                _check_cost(cur, query)
+                cur.execute(query)
+                yield from _iter_batches(cur, max_rows, max_bytes, batch_rows)
+
+
+def batches_to_pandas(batches: List[pa.RecordBatch]) -> pd.DataFrame:
+    if not batches:
+        return pd.DataFrame()
+    # self_destruct frees Arrow buffers column by column so the result is not held twice
+    return pa.Table.from_batches(batches).to_pandas(split_blocks=True, self_destruct=True)
+
+
+def _fetch_frame(cur, max_rows: Optional[int], max_bytes: Optional[int]) -> pd.DataFrame:
+    if max_rows is None and max_bytes is None:
+        if cur.description is None:
+            return pd.DataFrame()
+        table = cur.fetchall_arrow()
+        record_fetch(table.num_rows, table.nbytes)
+        return table.to_pandas(split_blocks=True, self_destruct=True)
+    return batches_to_pandas(list(_iter_batches(cur, max_rows, max_bytes, SQL_FETCH_BATCH_ROWS)))
+
+
+# Every statement waits here for a warehouse slot: bounded concurrency, overall and per session
+_ADMISSION = AdmissionQueue()
+
+def admission_stats() -> Dict[str, int]:
+    return _ADMISSION.stats()
+
+
+_NO_ESTIMATE = object()
+_SCAN_ESTIMATES = TTLCache(max_entries=1000, ttl=SQL_CACHE_TTL_SECONDS)
+_COSTED = re.compile(r"^\s*(select|with)\b", flags=re.I)
+
+def _explain_scan_bytes(cur, query: str) -> Optional[int]:
+    """Bytes ``query`` is estimated to read, from EXPLAIN COST; None when the plan has no estimate."""
+    key = normalize_sql(query)
+    scan = _SCAN_ESTIMATES.get(key, _NO_ESTIMATE)
+    if scan is not _NO_ESTIMATE:
+        return scan
     try:
-        conn = _get_conn()
-        with conn.cursor() as cur:
-            cur.execute(query)
-            try:
-                return cur.fetchall_arrow().to_pandas()
-            except Exception:
-                return pd.DataFrame()
+        cur.execute(f"EXPLAIN COST {query.strip().rstrip(';')}")
+        plan = "\n".join(str(row[0]) for row in cur.fetchall())
+    except Exception as e:
+        if _is_connection_error(e):
+            raise
+        # Without an estimate the query is admitted; if it is broken, running it reports why
+        logger.debug(f"EXPLAIN failed: {e}")
+        plan = ""
+    scan = parse_scan_bytes(plan)
+    _SCAN_ESTIMATES.set(key, scan)
+    return scan
+
+
+def _check_cost(cur, query: str) -> None:
+    if SQL_MAX_SCAN_BYTES and _COSTED.match(query):
+        check_scan(_explain_scan_bytes(cur, query))
+
+
+def _execute(
+    query: str,
+    max_rows: Optional[int] = None,
+    max_bytes: Optional[int] = None,
+    priority: int = PRIORITY_INTERACTIVE,
+    session_id: Optional[str] = None,
+) -> pd.DataFrame:
+    with _ADMISSION.slot(session_id, priority):
+        with _POOL.connection() as conn:
+            with conn.cursor() as cur:
+                _check_cost(cur, query)
+                cur.execute(query)
+                return _fetch_frame(cur, max_rows, max_bytes)
+
+
+def _run_uncached(
+    query: str,
+    max_rows: Optional[int] = None,
+    max_bytes: Optional[int] = None,
+    priority: int = PRIORITY_INTERACTIVE,
+    session_id: Optional[str] = None,
+) -> pd.DataFrame:
+    try:
+        return _execute(query, max_rows, max_bytes, priority, session_id)
     except Exception as e:
-        logger.warning(f"SQL error (first attempt): {e}")
-        _close_conn()
-        conn = _get_conn()
-        with conn.cursor() as cur:
-            cur.execute(query)
+        if not _is_connection_error(e):
+            raise
+        # Only the failed connection was discarded; retry once on another one
+        logger.warning(f"SQL connection error (first attempt): {e}")
+        return _execute(query, max_rows, max_bytes, priority, session_id)
+
+
+_QUOTED = re.compile(r"('(?:[^'\\]|\\.)*'|\"(?:[^\"\\]|\\.)*\"|`[^`]*`)")
+_CACHEABLE = re.compile(r"^\s*(select|with|describe|show)\b", flags=re.I)
+
+
+def normalize_sql(query: str) -> str:
+    """Cache key for a query: whitespace collapsed and lower-cased outside string literals.
+
+    A trailing ``;`` is dropped, so ``... LIMIT 200`` from ``ensure_limit`` and a hand-written
+    ``... limit  200;`` map to the same key.
+    """
+    parts = _QUOTED.split(query.strip().rstrip(";").strip())
+    out = []
+    for i, part in enumerate(parts):
+        # odd indexes are the quoted literals captured by the split
+        out.append(part if i % 2 else re.sub(r"\s+", " ", part.lower()))
+    return "".join(out).strip()
+
+
+class ResultCache:
+    """In-memory LRU/TTL result cache with an optional parquet tier on disk."""
+
+    def __init__(self, max_bytes: int, ttl: float, directory: Optional[str] = None):
+        self._memory = TTLCache(max_bytes=max_bytes, ttl=ttl, sizeof=dataframe_nbytes)
+        self._disk = DataFrameDiskCache(directory, ttl=ttl) if directory else None
+
+    def get(self, key: str) -> Optional[pd.DataFrame]:
+        df = self._memory.get(key)
+        if df is None and self._disk is not None:
+            df = self._disk.get(key)
+            if df is not None:
+                self._memory.set(key, df)
+        return df
+
+    def set(self, key: str, df: pd.DataFrame) -> None:
+        self._memory.set(key, df)
+        if self._disk is not None:
+            self._disk.set(key, df)
+
+    def clear(self) -> None:
+        self._memory.clear()
+        if self._disk is not None:
+            self._disk.clear()
+
+    def stats(self) -> Dict[str, int]:
+        return self._memory.stats()
+
+
+_RESULT_CACHE = ResultCache(SQL_CACHE_MAX_BYTES, SQL_CACHE_TTL_SECONDS, SQL_CACHE_DIR)
+_IN_FLIGHT = SingleFlight()
+_IN_FLIGHT_ASYNC = AsyncSingleFlight()
+
+
+def cache_stats() -> Dict[str, int]:
+    return _RESULT_CACHE.stats()
+
+
+def clear_result_cache() -> None:
+    _RESULT_CACHE.clear()
+
+
+def _load_cached(
+    key: str,
+    query: str,
+    max_rows: Optional[int],
+    max_bytes: Optional[int],
+    priority: int = PRIORITY_INTERACTIVE,
+    session_id: Optional[str] = None,
+) -> pd.DataFrame:
+    df = _RESULT_CACHE.get(key)
+    if df is None:
+        df = _run_uncached(query, max_rows, max_bytes, priority, session_id)
+        _RESULT_CACHE.set(key, df)
+    return df
+
+
+def _cache_key(base: str, max_rows: Optional[int], max_bytes: Optional[int]) -> str:
+    if max_rows is None and max_bytes is None:
+        return base
+    return f"{base}|max_rows={max_rows}|max_bytes={max_bytes}"
+
+
+def _cached_result(base: str, max_rows: Optional[int], max_bytes: Optional[int]) -> Optional[pd.DataFrame]:
+    if max_rows is not None and max_bytes is None:
+        full = _RESULT_CACHE.get(base)
+        if full is not None:
+            return full.head(max_rows)
+    df = _RESULT_CACHE.get(_cache_key(base, max_rows, max_bytes))
+    return df.copy(deep=False) if df is not None else None
+
+
+def run_sql(
+    query: str,
+    use_cache: bool = True,
+    max_rows: Optional[int] = None,
+    max_bytes: Optional[int] = None,
+    priority: int = PRIORITY_INTERACTIVE,
+    session_id: Optional[str] = None,
+) -> pd.DataFrame:
+    """Run ``query`` and return its result; with ``max_rows``/``max_bytes`` the fetch stops early.
+
+    Uncached statements wait for an admission slot (lower ``priority`` first, at most
+    ``SQL_MAX_CONCURRENT_PER_USER`` per ``session_id``), and SELECTs estimated to scan more than
+    ``SQL_MAX_SCAN_BYTES`` are refused with ``AdmissionError``.
+    """
+    with span("run_sql") as s:
+        if not use_cache or not _CACHEABLE.match(query):
+            return _run_uncached(query, max_rows, max_bytes, priority, session_id)
+        base = normalize_sql(query)
+        df = _cached_result(base, max_rows, max_bytes)
+        if df is None:
+            key = _cache_key(base, max_rows, max_bytes)
+            # Identical queries already in flight wait for that execution instead of hitting the warehouse
+            df = _IN_FLIGHT.do(
+                key, lambda: _load_cached(key, query, max_rows, max_bytes, priority, session_id)
+            ).copy(deep=False)
+        else:
+            s.outcome = "cache_hit"
+        return df
+
+
+class QueryCancelledError(Exception):
+    """The statement was cancelled on the warehouse because its session moved on."""
+
+
+class _RunningQuery:
+    def __init__(self, cur):
+        self.cur = cur
+        self.cancelled = False
+
+    def cancel(self) -> None:
+        self.cancelled = True
+        try:
+            self.cur.cancel()
+        except Exception as e:
+            logger.debug(f"Could not cancel statement: {e}")
+
+
+_RUNNING: Dict[str, Set[_RunningQuery]] = {}  # session id -> statements in flight
+_RUNNING_LOCK = threading.Lock()
+
+
+def cancel_session_queries(session_id: Optional[str]) -> int:
+    """Cancel every statement ``run_sql_async`` is running or queueing for ``session_id``; return how many."""
+    if not session_id:
+        return 0
+    queued = _ADMISSION.cancel(session_id)
+    with _RUNNING_LOCK:
+        running = list(_RUNNING.get(session_id, ()))
+    for q in running:
+        q.cancel()
+    if running or queued:
+        logger.info(f"Cancelled {len(running)} running and {queued} queued statement(s) for session {session_id}")
+    return len(running) + queued
+
+
+def _track(session_id: Optional[str], q: _RunningQuery, add: bool) -> None:
+    if not session_id:
+        return
+    with _RUNNING_LOCK:
+        if add:
+            _RUNNING.setdefault(session_id, set()).add(q)
+        else:
+            running = _RUNNING.get(session_id)
+            if running is not None:
+                running.discard(q)
+                if not running:
+                    del _RUNNING[session_id]
+
+
+async def _execute_async(cur, query: str, max_rows: Optional[int], max_bytes: Optional[int]) -> pd.DataFrame:
+    await run_in_thread(_check_cost, cur, query)
+    # Only the short Thrift calls run on worker threads; waiting for the warehouse is an asyncio sleep
+    await run_in_thread(cur.execute_async, query)
+    while await run_in_thread(cur.is_query_pending):
+        await asyncio.sleep(SQL_ASYNC_POLL_SECONDS)
+    await run_in_thread(cur.get_async_execution_result)
+    return await run_in_thread(_fetch_frame, cur, max_rows, max_bytes)
+
+
+def _finish_query(session_id: Optional[str], running: _RunningQuery, conn, broken: bool, abandoned: bool) -> None:
+    if abandoned:
+        running.cancel()
+    _track(session_id, running, add=False)
+    _safe_close(running.cur)
+    # A worker thread may still be using an abandoned query's connection; never hand it to another query
+    _POOL.release(conn, broken=broken or abandoned)
+
+
+async def _acquire_async():
+    """``_POOL.acquire`` off the event loop. If the caller is cancelled while the worker thread is
+    still acquiring, the connection it gets goes straight back to the pool."""
+    acquiring = asyncio.ensure_future(run_in_thread(_POOL.acquire))
+    try:
+        return await asyncio.shield(acquiring)
+    except asyncio.CancelledError:
+        acquiring.add_done_callback(
+            lambda f: None if f.cancelled() or f.exception() is not None else _POOL.release(f.result())
+        )
+        raise
+
+
+async def _run_async_uncached(
+    query: str,
+    timeout: Optional[float],
+    session_id: Optional[str],
+    max_rows: Optional[int],
+    max_bytes: Optional[int],
+    priority: int,
+) -> pd.DataFrame:
+    try:
+        async with _ADMISSION.slot_async(session_id, priority):
+            conn = await _acquire_async()
+            broken = False
+            abandoned = False
+            cur = conn.cursor()
+            running = _RunningQuery(cur)
+            _track(session_id, running, add=True)
             try:
-                return cur.fetchall_arrow().to_pandas()
-            except Exception:
-                return pd.DataFrame()
+                return await asyncio.wait_for(_execute_async(cur, query, max_rows, max_bytes), timeout)
+            except asyncio.TimeoutError:
+                abandoned = True
+                raise TimeoutError(f"Query exceeded {timeout}s and was cancelled on the warehouse.")
+            except asyncio.CancelledError:
+                abandoned = True
+                raise
+            except Exception as e:
+                if running.cancelled:
+                    raise QueryCancelledError("Query was cancelled because a newer question was asked.") from e
+                broken = _is_connection_error(e)
+                raise
+            finally:
+                # Cancel, close and release are blocking calls; shielded, so they finish even if the
+                # caller is cancelled again meanwhile
+                await asyncio.shield(run_in_thread(_finish_query, session_id, running, conn, broken, abandoned))
+    except AdmissionError as e:
+        if e.reason == "cancelled":
+            raise QueryCancelledError("Query was cancelled because a newer question was asked.") from e
+        raise
+
+
+async def run_sql_async(
+    query: str,
+    timeout: Optional[float] = SQL_QUERY_TIMEOUT_SECONDS,
+    session_id: Optional[str] = None,
+    use_cache: bool = True,
+    max_rows: Optional[int] = None,
+    max_bytes: Optional[int] = None,
+    priority: int = PRIORITY_INTERACTIVE,
+) -> pd.DataFrame:
+    """Async counterpart of ``run_sql`` with a deadline and server-side cancellation.
+
+    Statements started with a ``session_id`` can be cancelled with ``cancel_session_queries``;
+    the awaiting caller then gets ``QueryCancelledError``. A passed deadline raises ``TimeoutError``.
+    """
+    with span("run_sql_async") as s:
+        cacheable = use_cache and _CACHEABLE.match(query)
+        if cacheable:
+            base = normalize_sql(query)
+            df = _cached_result(base, max_rows, max_bytes)
+            if df is not None:
+                s.outcome = "cache_hit"
+                return df
+        try:
+            if not cacheable:
+                return await _run_async_uncached(query, timeout, session_id, max_rows, max_bytes, priority)
+            key = _cache_key(base, max_rows, max_bytes)
+
+            async def load() -> pd.DataFrame:
+                df = _RESULT_CACHE.get(key)
+                if df is not None:
+                    return df  # stored by a flight that landed after the lookup above
+                df = await _run_async_uncached(query, timeout, session_id, max_rows, max_bytes, priority)
+                _RESULT_CACHE.set(key, df)
+                return df
+
+            # Identical queries already in flight, from any session, wait for that execution; if it is
+            # cancelled because its own session moved on, the waiters run the query themselves
+            df = await _IN_FLIGHT_ASYNC.do(key, load, retry_on=(QueryCancelledError,))
+            return df.copy(deep=False)
+        except QueryCancelledError:
+            s.outcome = "cancelled"
+            raise
+        except TimeoutError:
+            s.outcome = "timeout"
+            raise
+
+def fetch_trips_schema_text() -> str:
+    """Schema text of samples.nyctaxi.trips from the warehouse; raises if it cannot be described."""
+    df = run_sql("DESCRIBE TABLE samples.nyctaxi.trips")
+    df = df[df["col_name"].notna() & df["data_type"].notna()]
+    cols = [f"{r.col_name} {r.data_type}" for _, r in df.iterrows()]
+    return "Columns:\n- " + "\n- ".join(cols)
+
+# Used when the warehouse cannot describe the table
+TRIPS_SCHEMA_FALLBACK = (
+    "Columns:\n"
+    "- trip_distance double\n- fare_amount double\n"
+    "- pickup_zip int\n- dropoff_zip int\n- pickup_datetime timestamp\n- dropoff_datetime timestamp"
+)
 
 def get_trips_schema_text() -> str:
     try:
-        df = run_sql("DESCRIBE TABLE samples.nyctaxi.trips")
-        df = df[df["col_name"].notna() & df["data_type"].notna()]
-        cols = [f"{r.col_name} {r.data_type}" for _, r in df.iterrows()]
-        return "Columns:\n- " + "\n- ".join(cols)
+        return fetch_trips_schema_text()
     except Exception as e:
         logger.warning(f"Could not fetch schema: {e}")
-        return (
-            "Columns:\n"
-            "- trip_distance double\n- fare_amount double\n"
-            "- pickup_zip int\n- dropoff_zip int\n- pickup_datetime timestamp\n- dropoff_datetime timestamp"
-        )
\ No newline at end of file
+        return TRIPS_SCHEMA_FALLBACK
\ No newline at end of file
@@ -0,0 +1,112 @@
+import os
+import re
+import logging
+from typing import NamedTuple, Optional
+
+import duckdb
+import pandas as pd
+import sqlglot
+from sqlglot import exp
+
+from cache import TTLCache, dataframe_nbytes
+from sqlcheck import SQL_DIALECT, TRIPS_TABLE, SQLValidationError
+
+logger = logging.getLogger(__name__)
+
+# Follow-up questions may query the session's previous result locally instead of the warehouse
+SQL_LOCAL_FOLLOWUP = os.getenv("SQL_LOCAL_FOLLOWUP", "1") == "1"
+FOLLOWUP_STORE_MAX_BYTES = int(os.getenv("FOLLOWUP_STORE_MAX_BYTES", str(256 * 1024 * 1024)))
+FOLLOWUP_TTL_SECONDS = float(os.getenv("FOLLOWUP_TTL_SECONDS", "3600"))
+
+PREV_RESULT_TABLE = "prev_result"
+# Schema text from the catalog already names its tables
+_TABLE_SECTION = re.compile(r"^\s*Table\s+\S+:\s*$", re.M)
+
+
+class PreviousResult(NamedTuple):
+    sql: str  # how the rows were produced, for the model
+    df: pd.DataFrame
+    complete: bool  # False when the fetch caps may have cut the result short
+
+
+_RESULTS = TTLCache(
+    max_bytes=FOLLOWUP_STORE_MAX_BYTES, ttl=FOLLOWUP_TTL_SECONDS, sizeof=lambda r: dataframe_nbytes(r.df)
+)
+
+
+def remember_result(session_id: Optional[str], sql_text: str, df: pd.DataFrame, complete: bool) -> None:
+    if SQL_LOCAL_FOLLOWUP and session_id and not df.empty:
+        _RESULTS.set(session_id, PreviousResult(sql_text, df, complete))
+
+
+def previous_result(session_id: Optional[str]) -> Optional[PreviousResult]:
+    """The session's last result, if it can answer follow-ups: a partial result would give wrong answers."""
+    if not SQL_LOCAL_FOLLOWUP or not session_id:
+        return None
+    prev = _RESULTS.get(session_id)
+    return prev if prev is not None and prev.complete else None
+
+
+def _sql_type(dtype) -> str:
+    if pd.api.types.is_bool_dtype(dtype):
+        return "boolean"
+    if pd.api.types.is_integer_dtype(dtype):
+        return "bigint"
+    if pd.api.types.is_float_dtype(dtype):
+        return "double"
+    if pd.api.types.is_datetime64_any_dtype(dtype):
+        return "timestamp"
+    return "string"
+
+
+def _quote(name: str) -> str:
+    return name if re.fullmatch(r"\w+", name) else "`" + name.replace("`", "``") + "`"
+
+
+def followup_schema_text(schema_text: str, prev: Optional[PreviousResult]) -> str:
+    """``schema_text`` plus a ``prev_result`` table section describing the previous result, when there is one."""
+    if prev is None:
+        return schema_text
+    columns = "\n- ".join(f"{_quote(str(c))} {_sql_type(t)}" for c, t in prev.df.dtypes.items())
+    if not _TABLE_SECTION.match(schema_text):
+        schema_text = f"Table {TRIPS_TABLE}:\n{schema_text}"
+    return (
+        f"{schema_text}\n\n"
+        f"Table {PREV_RESULT_TABLE}:\n"
+        f"All {len(prev.df)} rows returned for the previous question, by this query:\n{prev.sql}\n"
+        f"Query {PREV_RESULT_TABLE} when the question only filters, sorts or re-aggregates that result; "
+        f"query the warehouse tables when it needs other rows or columns. Never use both in one query.\n"
+        f"Columns:\n- {columns}"
+    )
+
+
+def uses_prev_result(sql_text: str) -> bool:
+    """Whether ``sql_text`` reads ``prev_result``; mixing it with warehouse tables is a validation error."""
+    try:
+        tree = sqlglot.parse_one(sql_text, read=SQL_DIALECT)
+    except sqlglot.errors.ParseError:
+        return False
+    ctes = {cte.alias_or_name.lower() for cte in tree.find_all(exp.CTE)}
+    names = {t.name.lower() for t in tree.find_all(exp.Table) if t.db or t.name.lower() not in ctes}
+    if PREV_RESULT_TABLE not in names:
+        return False
+    if names != {PREV_RESULT_TABLE}:
+        raise SQLValidationError(
+            "table",
+            f"{PREV_RESULT_TABLE} is held locally and cannot be joined with warehouse tables; "
+            f"query one or the other.",
+        )
+    return True
+
+
+def run_local_sql(sql_text: str, df: pd.DataFrame) -> pd.DataFrame:
+    """Run Databricks SQL over ``df`` as ``prev_result`` in an embedded DuckDB, without the warehouse."""
+    local_sql = sqlglot.transpile(sql_text, read=SQL_DIALECT, write="duckdb")[0]
+    with duckdb.connect() as con:
+        con.register(PREV_RESULT_TABLE, df)
+        return con.execute(local_sql).df()
+
+
+def derived_sql(prev: PreviousResult, sql_text: str) -> str:
+    """Lineage of a result computed from ``prev``, so a further follow-up is described correctly."""
+    return f"{prev.sql}\n/* then, over that result as {PREV_RESULT_TABLE}: */\n{sql_text}"
@@ -0,0 +1,172 @@
+import os
+import uuid
+import logging
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+import dash_ag_grid as dag
+
+from cache import TTLCache, dataframe_nbytes
+
+logger = logging.getLogger(__name__)
+
+# Results kept server-side for grids to page through; the browser only ever receives one block
+GRID_STORE_MAX_BYTES = int(os.getenv("GRID_STORE_MAX_BYTES", str(256 * 1024 * 1024)))
+GRID_STORE_TTL_SECONDS = float(os.getenv("GRID_STORE_TTL_SECONDS", "3600"))
+GRID_BLOCK_ROWS = int(os.getenv("GRID_BLOCK_ROWS", "100"))
+
+GRID_TYPE = "result-grid"
+
+_STORE = TTLCache(max_bytes=GRID_STORE_MAX_BYTES, ttl=GRID_STORE_TTL_SECONDS, sizeof=dataframe_nbytes)
+
+
+def store_result(df: pd.DataFrame, key: Optional[str] = None) -> str:
+    key = key or uuid.uuid4().hex
+    _STORE.set(key, df)
+    return key
+
+
+def get_result(key: str) -> Optional[pd.DataFrame]:
+    return _STORE.get(key)
+
+
+def _column_def(name: str, dtype) -> Dict[str, Any]:
+    if pd.api.types.is_bool_dtype(dtype):
+        kind = "agTextColumnFilter"
+    elif pd.api.types.is_numeric_dtype(dtype):
+        kind = "agNumberColumnFilter"
+    elif pd.api.types.is_datetime64_any_dtype(dtype):
+        kind = "agDateColumnFilter"
+    else:
+        kind = "agTextColumnFilter"
+    return {"field": str(name), "filter": kind, "sortable": True}
+
+
+def result_grid(df: pd.DataFrame, key: Optional[str] = None, height: str = "40vh") -> dag.AgGrid:
+    """A virtualized grid over ``df``, which stays on the server; rows are fetched block by block.
+
+    Every grid gets a pattern-matching id ``{"type": GRID_TYPE, "key": key}`` so that
+    one ``get_rows`` callback serves them all.
+    """
+    key = store_result(df, key)
+    return dag.AgGrid(
+        id={"type": GRID_TYPE, "key": key},
+        rowModelType="infinite",
+        columnDefs=[_column_def(c, t) for c, t in df.dtypes.items()],
+        defaultColDef={"resizable": True, "floatingFilter": True, "minWidth": 110},
+        dashGridOptions={
+            "cacheBlockSize": GRID_BLOCK_ROWS,
+            "maxBlocksInCache": 10,
+            "infiniteInitialRowCount": min(len(df), GRID_BLOCK_ROWS),
+            "rowBuffer": 0,
+        },
+        style={"height": height, "width": "100%"},
+    )
+
+
+# -------- server-side row model --------
+def _parse_value(series: pd.Series, value: Any) -> Any:
+    if value is None:
+        return None
+    if pd.api.types.is_datetime64_any_dtype(series.dtype):
+        return pd.Timestamp(value)
+    if pd.api.types.is_numeric_dtype(series.dtype) and not pd.api.types.is_bool_dtype(series.dtype):
+        return float(value)
+    return str(value).lower()
+
+
+def _condition_mask(series: pd.Series, cond: Dict[str, Any]) -> pd.Series:
+    op = cond.get("type", "contains")
+    if op == "blank":
+        return series.isna() | (series.astype(str).str.strip() == "")
+    if op == "notBlank":
+        return series.notna() & (series.astype(str).str.strip() != "")
+    if cond.get("filterType") == "date":
+        a, b = _parse_value(series, cond.get("dateFrom")), _parse_value(series, cond.get("dateTo"))
+        # Date filters compare calendar days
+        values = series.dt.normalize()
+    elif cond.get("filterType") == "number":
+        a, b = _parse_value(series, cond.get("filter")), _parse_value(series, cond.get("filterTo"))
+        values = series
+    else:
+        a = _parse_value(series, cond.get("filter")) or ""
+        values = series.astype(str).str.lower()
+        if op == "contains":
+            return values.str.contains(a, regex=False)
+        if op == "notContains":
+            return ~values.str.contains(a, regex=False)
+        if op == "startsWith":
+            return values.str.startswith(a)
+        if op == "endsWith":
+            return values.str.endswith(a)
+        b = None
+    if op == "equals":
+        return values == a
+    if op == "notEqual":
+        return values != a
+    if op == "lessThan":
+        return values < a
+    if op == "lessThanOrEqual":
+        return values <= a
+    if op == "greaterThan":
+        return values > a
+    if op == "greaterThanOrEqual":
+        return values >= a
+    if op == "inRange":
+        return (values >= a) & (values <= b)
+    raise ValueError(f"Unsupported filter type {op!r}.")
+
+
+def _filter_mask(series: pd.Series, model: Dict[str, Any]) -> pd.Series:
+    conditions = model.get("conditions")
+    if conditions is None and "condition1" in model:
+        conditions = [c for c in (model.get("condition1"), model.get("condition2")) if c]
+    if not conditions:
+        return _condition_mask(series, model)
+    masks = [_condition_mask(series, {"filterType": model.get("filterType"), **c}) for c in conditions]
+    if model.get("operator", "AND").upper() == "OR":
+        return np.logical_or.reduce(masks)
+    return np.logical_and.reduce(masks)
+
+
+def apply_row_request(df: pd.DataFrame, request: Dict[str, Any]) -> pd.DataFrame:
+    """Filter and sort ``df`` by an AG Grid ``filterModel``/``sortModel``; unknown columns are ignored."""
+    filter_model = request.get("filterModel") or {}
+    if filter_model:
+        mask = pd.Series(True, index=df.index)
+        for col, model in filter_model.items():
+            if col in df.columns:
+                mask &= _filter_mask(df[col], model)
+        df = df[mask]
+    sort_model = [s for s in request.get("sortModel") or [] if s.get("colId") in df.columns]
+    if sort_model:
+        df = df.sort_values(
+            by=[s["colId"] for s in sort_model],
+            ascending=[s.get("sort", "asc") == "asc" for s in sort_model],
+            kind="stable",
+        )
+    return df
+
+
+def _records(page: pd.DataFrame) -> List[Dict[str, Any]]:
+    page = page.copy()
+    for col, dtype in page.dtypes.items():
+        if pd.api.types.is_datetime64_any_dtype(dtype):
+            page[col] = page[col].dt.strftime("%Y-%m-%d %H:%M:%S")
+    # NaN/NaT are not valid JSON
+    return page.astype(object).where(page.notna(), None).to_dict("records")
+
+
+def get_rows(key: str, request: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+    """Answer an infinite row model ``getRowsRequest`` from the stored result ``key``."""
+    df = get_result(key)
+    if df is None or not request:
+        return {"rowData": [], "rowCount": 0}
+    try:
+        view = apply_row_request(df, request)
+    except (ValueError, TypeError) as e:
+        logger.warning(f"Ignoring grid filter: {e}")
+        view = apply_row_request(df, {**request, "filterModel": None})
+    start, end = int(request.get("startRow", 0)), int(request.get("endRow", GRID_BLOCK_ROWS))
+    return {"rowData": _records(view.iloc[start:end]), "rowCount": len(view)}
@@ -0,0 +1,123 @@
+import os
+import time
+import uuid
+import logging
+import threading
+import contextvars
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Dict, List, Optional
+
+from cache import TTLCache
+from rag import IngestStats, ingest_uploaded_files
+
+logger = logging.getLogger(__name__)
+
+# Ingestion jobs run at once; the rest wait, so uploads cannot take over the embedding endpoint and CPU
+INGEST_MAX_CONCURRENT_JOBS = int(os.getenv("INGEST_MAX_CONCURRENT_JOBS", "1"))
+INGEST_MAX_QUEUED_JOBS = int(os.getenv("INGEST_MAX_QUEUED_JOBS", "16"))
+# Processes parsing and chunking uploaded PDF/DOCX/HTML files, off the serving threads' GIL
+INGEST_PARSE_WORKERS = int(os.getenv("INGEST_PARSE_WORKERS", str(max(1, min(4, (os.cpu_count() or 2) - 1)))))
+# Finished jobs stay readable this long
+INGEST_JOB_TTL_SECONDS = float(os.getenv("INGEST_JOB_TTL_SECONDS", "3600"))
+
+
+class IngestJobError(RuntimeError):
+    pass
+
+
+class IngestJob:
+    """One upload being indexed in the background; ``status()`` is what the page polls."""
+
+    def __init__(self, filenames: List[str]):
+        self.id = uuid.uuid4().hex
+        self.filenames = filenames
+        self.stats = IngestStats()
+        self.state = "queued"  # queued -> running -> done | failed
+        self.chunks: Optional[int] = None
+        self.error: Optional[str] = None
+        self.submitted_at = time.time()
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+
+    def status(self) -> Dict[str, Any]:
+        end = self.finished_at or time.time()
+        return {
+            "id": self.id,
+            "state": self.state,
+            "files": len(self.filenames),
+            "files_done": self.stats.files_done,
+            "chunks_indexed": self.chunks if self.chunks is not None else self.stats.items["upsert"],
+            "skipped": self.stats.skipped,
+            "failed_files": list(self.stats.failed_files),
+            "error": self.error,
+            "seconds": round(end - (self.started_at or end), 1),
+        }
+
+
+class IngestJobQueue:
+    """Runs uploads as background jobs, at most ``max_jobs`` at a time, with parsing in a process pool."""
+
+    def __init__(
+        self,
+        max_jobs: int = INGEST_MAX_CONCURRENT_JOBS,
+        max_queued: int = INGEST_MAX_QUEUED_JOBS,
+        parse_workers: int = INGEST_PARSE_WORKERS,
+        ttl: float = INGEST_JOB_TTL_SECONDS,
+    ):
+        self.max_queued = max_queued
+        self._parse_workers = parse_workers
+        self._jobs = TTLCache(ttl=ttl)
+        self._runner = ThreadPoolExecutor(max_workers=max(1, max_jobs), thread_name_prefix="ingest-job")
+        self._parse_pool: Optional[ProcessPoolExecutor] = None
+        self._queued = 0
+        self._lock = threading.Lock()
+
+    def _pool(self) -> Optional[ProcessPoolExecutor]:
+        if self._parse_workers <= 0:
+            return None  # parse on the job thread
+        with self._lock:
+            if self._parse_pool is None:
+                # Never fork: forking a multithreaded server can copy a lock held by another thread and
+                # deadlock the child. Workers re-import app.py, which skips its warm-up in child processes
+                methods = multiprocessing.get_all_start_methods()
+                ctx = multiprocessing.get_context("forkserver" if "forkserver" in methods else "spawn")
+                self._parse_pool = ProcessPoolExecutor(max_workers=self._parse_workers, mp_context=ctx)
+            return self._parse_pool
+
+    def submit(self, contents: List[str], filenames: List[str]) -> str:
+        with self._lock:
+            if self._queued >= self.max_queued:
+                raise IngestJobError("Too many uploads are waiting to be indexed; try again shortly.")
+            self._queued += 1
+        job = IngestJob(list(filenames))
+        self._jobs.set(job.id, job)
+        self._runner.submit(contextvars.copy_context().run, self._run, job, contents)
+        logger.info(f"Queued ingestion job {job.id} ({len(filenames)} file(s))")
+        return job.id
+
+    def _run(self, job: IngestJob, contents: List[str]) -> None:
+        with self._lock:
+            self._queued -= 1
+        job.state = "running"
+        job.started_at = time.time()
+        try:
+            job.chunks = ingest_uploaded_files(contents, job.filenames, stats=job.stats, parse_pool=self._pool())
+            job.state = "done"
+        except Exception as e:
+            if isinstance(e, BrokenProcessPool):
+                with self._lock:
+                    self._parse_pool = None  # a worker died (e.g. out of memory); the next job gets a fresh pool
+            logger.warning(f"Ingestion job {job.id} failed: {e}")
+            job.error = str(e)
+            job.state = "failed"
+        finally:
+            job.finished_at = time.time()
+            # Refresh the expiry from the finish time, not the submit time
+            self._jobs.set(job.id, job)
+        logger.info(f"Ingestion job {job.id} {job.state} in {job.finished_at - job.started_at:.1f}s")
+
+    def status(self, job_id: Optional[str]) -> Optional[Dict[str, Any]]:
+        job = self._jobs.get(job_id) if job_id else None
+        return job.status() if job is not None else None
@@ -1,13 +1,34 @@
+import os
 import re
+import time
+import hashlib
 import logging
-from typing import List
+import threading
+from functools import lru_cache
+from typing import Any, Callable, Dict, Iterable, Iterator, List
+import numpy as np
 import pandas as pd
 from databricks.sdk import WorkspaceClient
 from databricks.sdk.core import Config
 from typing import List, Optional
 from langchain_community.chat_models import ChatDatabricks
+from langchain_core.callbacks import BaseCallbackHandler
 from langchain_core.messages import SystemMessage, HumanMessage
 
+from rag import embed_query, count_tokens
+from metrics import observe_stage, record_tokens
+from router import Router
+from budget import (
+    PROMPT_RESULT_TOKENS,
+    endpoint_of,
+    prompt_budget,
+    calibrate,
+    tokens,
+    fit_context,
+    compact_error,
+    describe_result,
+)
+
 logger = logging.getLogger(__name__)
 
 FOUNDATION_DEFAULTS = [
@@ -17,17 +38,105 @@ FOUNDATION_DEFAULTS = [
     "databricks-mixtral-8x7b-instruct",
 ]
 
+# Semantic question -> SQL cache; a hit skips the generate_sql LLM call
+SQL_SEMANTIC_CACHE = os.getenv("SQL_SEMANTIC_CACHE", "1") == "1"
+SQL_SEMANTIC_CACHE_THRESHOLD = float(os.getenv("SQL_SEMANTIC_CACHE_THRESHOLD", "0.95"))
+SQL_SEMANTIC_CACHE_SIZE = int(os.getenv("SQL_SEMANTIC_CACHE_SIZE", "1000"))
+
+# Model calls are routed across endpoints by latency and health (see router.py); 0 pins them to the selection
+LLM_ROUTING = os.getenv("LLM_ROUTING", "1") == "1"
+# Smaller, faster endpoints tried first for cheap calls such as refine_sql
+LLM_SMALL_ENDPOINTS = [
+    e.strip() for e in os.getenv("LLM_SMALL_ENDPOINTS", "databricks-meta-llama-3-1-8b-instruct").split(",")
+    if e.strip()
+]
+
+_CLIENTS: Dict[tuple, ChatDatabricks] = {}
+_CLIENTS_LOCK = threading.Lock()
+
+@lru_cache(maxsize=1)
+def _workspace_client() -> WorkspaceClient:
+    return WorkspaceClient(config=Config(auth_type="pat"))
+
+def fetch_llm_endpoints() -> List[str]:
+    """Serving endpoints of the workspace plus the foundation defaults; raises if the workspace is unreachable."""
+    names = [e.name for e in _workspace_client().serving_endpoints.list()]
+    return sorted(set(names) | set(FOUNDATION_DEFAULTS))
+
 def list_llm_endpoints() -> List[str]:
     try:
-        w = WorkspaceClient(config=Config(auth_type="pat"))
-        names = [e.name for e in w.serving_endpoints.list()]
-        return sorted(set(names) | set(FOUNDATION_DEFAULTS))
+        return fetch_llm_endpoints()
     except Exception as e:
         logger.warning(f"Could not list serving endpoints: {e}")
         return FOUNDATION_DEFAULTS
 
-def get_chat_llm(endpoint: str) -> ChatDatabricks:
-    return ChatDatabricks(endpoint=endpoint)
+def get_chat_llm(endpoint: str, temperature: Optional[float] = None) -> ChatDatabricks:
+    # One long-lived client per endpoint and temperature, so requests reuse its HTTP connections
+    key = (endpoint, temperature)
+    with _CLIENTS_LOCK:
+        llm = _CLIENTS.get(key)
+        if llm is None:
+            if temperature is None:
+                llm = ChatDatabricks(endpoint=endpoint)
+            else:
+                llm = ChatDatabricks(endpoint=endpoint, temperature=temperature)
+            _CLIENTS[key] = llm
+        return llm
+
+# Looks get_chat_llm up on every call, so a replaced client factory is picked up
+router = Router(lambda endpoint, temperature: get_chat_llm(endpoint, temperature), FOUNDATION_DEFAULTS)
+
+class _TokenUsage(BaseCallbackHandler):
+    """Records prompt and completion tokens of a model call, estimated when the endpoint reports none."""
+
+    def __init__(self, call: str, endpoint: str):
+        self.call = call
+        self.endpoint = endpoint
+        self._prompt_estimate = 0
+
+    def on_chat_model_start(self, serialized, messages, **kwargs) -> None:
+        self._prompt_estimate = sum(count_tokens(str(m.content)) for batch in messages for m in batch)
+
+    def on_llm_end(self, response, **kwargs) -> None:
+        usage = (response.llm_output or {}).get("usage") or response.llm_output or {}
+        prompt = usage.get("prompt_tokens")
+        if prompt is None:
+            prompt = self._prompt_estimate
+        else:
+            # Teaches the prompt budget this endpoint's tokenizer
+            calibrate(self.endpoint, self._prompt_estimate, prompt)
+        completion = usage.get("completion_tokens")
+        if completion is None:
+            completion = sum(count_tokens(g.text) for gens in response.generations for g in gens)
+        record_tokens(self.call, prompt, completion)
+
+
+def _usage(call: str, llm) -> dict:
+    return {"callbacks": [_TokenUsage(call, endpoint_of(llm))]}
+
+
+def _invoke(call: str, llm, build: Callable[[Any], list], pool: Optional[List[str]] = None):
+    """Invoke the model with the messages ``build(client)`` assembles for the client that serves the call.
+
+    With routing on, the call may go to another endpoint than ``llm``'s (see ``Router.call``).
+    """
+    endpoint = getattr(llm, "endpoint", None)
+    if not LLM_ROUTING or not endpoint:
+        return llm.invoke(build(llm), config=_usage(call, llm))
+    return router.call(
+        lambda client: client.invoke(build(client), config=_usage(call, client)),
+        endpoint, getattr(llm, "temperature", None), pool,
+    )
+
+
+def _routed_stream(chunks: Iterable, endpoint: str) -> Iterator:
+    # Outcomes only: stream durations depend on the answer length, not just the endpoint
+    try:
+        yield from chunks
+    except Exception:
+        router.record(endpoint, None, False)
+        raise
+    router.record(endpoint, None, True)
 
 def extract_sql(text: str) -> str:
     m = re.search(r"```sql(.*?)```", text, flags=re.S | re.I)
@@ -42,17 +151,127 @@ def first_statement(sql_text: str) -> str:
 def ensure_limit(sql_text: str, limit: int = 200) -> str:
     return sql_text if re.search(r"\blimit\s+\d+\b", sql_text, flags=re.I) else f"{sql_text} LIMIT {limit}"
 
-def generate_sql(question: str, schema_text: str, llm: ChatDatabricks, context: Optional[str] = None) -> str:
-    ctx = f"\n\nRelevant context:\n{context}" if context else ""
-    messages = [
-        SystemMessage(content=(
-            "You are a Databricks SQL expert. Write ONE single SQL statement for Databricks SQL. "
-            "Use only samples.nyctaxi.trips. Return ONLY the SQL in a fenced ```sql block. "
-            "Do NOT include multiple statements; exactly one SELECT."
-        )),
-        HumanMessage(content=f"Schema:\n{schema_text}{ctx}\n\nQuestion:\n{question}")
-    ]
-    raw = llm.invoke(messages)
+class SemanticSQLCache:
+    """Question -> validated SQL, looked up by cosine similarity of question embeddings.
+
+    Entries are scoped to the schema text they were generated against. Only SQL that ran
+    successfully should be stored; the oldest entries are dropped past ``max_entries``.
+    """
+
+    def __init__(
+        self,
+        embed: Callable[[str], List[float]],
+        threshold: float = SQL_SEMANTIC_CACHE_THRESHOLD,
+        max_entries: int = SQL_SEMANTIC_CACHE_SIZE,
+    ):
+        self._embed = embed
+        self._threshold = threshold
+        self._max_entries = max_entries
+        self._vectors = None  # (n, dim) float32, rows L2-normalized
+        self._entries: List[tuple] = []  # (schema_key, question, sql), aligned with _vectors
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _schema_key(schema_text: str) -> str:
+        return hashlib.sha256(schema_text.encode("utf-8")).hexdigest()
+
+    def _vector(self, question: str) -> np.ndarray:
+        # rag.embed_query keeps an LRU of query embeddings, so lookup + store embed only once
+        vec = np.asarray(self._embed(question), dtype=np.float32)
+        return vec / max(float(np.linalg.norm(vec)), 1e-12)
+
+    def _best_locked(self, vec: np.ndarray, schema_key: str):
+        if self._vectors is None or not self._entries:
+            return None, -1.0
+        scores = self._vectors @ vec
+        mask = np.fromiter((e[0] == schema_key for e in self._entries), dtype=bool, count=len(self._entries))
+        scores = np.where(mask, scores, -1.0)
+        i = int(np.argmax(scores))
+        return i, float(scores[i])
+
+    def lookup(self, question: str, schema_text: str) -> Optional[str]:
+        vec = self._vector(question)
+        with self._lock:
+            i, score = self._best_locked(vec, self._schema_key(schema_text))
+            if i is None or score < self._threshold:
+                return None
+            _, cached_question, sql_text = self._entries[i]
+        logger.info(f"Semantic SQL cache hit ({score:.3f}) for {question!r} ~ {cached_question!r}")
+        return sql_text
+
+    def store(self, question: str, schema_text: str, sql_text: str) -> None:
+        vec = self._vector(question)
+        schema_key = self._schema_key(schema_text)
+        with self._lock:
+            i, score = self._best_locked(vec, schema_key)
+            if i is not None and score >= self._threshold:
+                # A near-duplicate question now maps to the SQL that last worked
+                self._entries[i] = (schema_key, question, sql_text)
+                return
+            self._entries.append((schema_key, question, sql_text))
+            row = vec[None, :]
+            self._vectors = row if self._vectors is None else np.vstack([self._vectors, row])
+            if len(self._entries) > self._max_entries:
+                drop = len(self._entries) - self._max_entries
+                self._entries = self._entries[drop:]
+                self._vectors = self._vectors[drop:]
+
+
+_SQL_CACHE = SemanticSQLCache(embed_query)
+
+
+def remember_sql(question: str, schema_text: str, sql_text: str) -> None:
+    """Store SQL that ran successfully for ``question`` in the semantic cache."""
+    if not SQL_SEMANTIC_CACHE:
+        return
+    try:
+        _SQL_CACHE.store(question, schema_text, sql_text)
+    except Exception as e:
+        logger.warning(f"Could not update semantic SQL cache: {e}")
+
+
+def lookup_sql(question: str, schema_text: str) -> Optional[str]:
+    """SQL that previously worked for a near-identical question, or None."""
+    if not SQL_SEMANTIC_CACHE:
+        return None
+    try:
+        return _SQL_CACHE.lookup(question, schema_text)
+    except Exception as e:
+        logger.warning(f"Semantic SQL cache lookup failed: {e}")
+        return None
+
+
+def generate_sql(
+    question: str,
+    schema_text: str,
+    llm: ChatDatabricks,
+    context: Optional[str] = None,
+    use_cache: bool = True,
+) -> str:
+    if use_cache:
+        cached = lookup_sql(question, schema_text)
+        if cached:
+            return cached
+    system = (
+        "You are a Databricks SQL expert. Write ONE single SQL statement for Databricks SQL. "
+        "Use only the tables listed in the schema (samples.nyctaxi.trips when it lists no table names). "
+        "Return ONLY the SQL in a fenced ```sql block. "
+        "Do NOT include multiple statements; exactly one SELECT."
+    )
+    prompt = f"Schema:\n{schema_text}\n\nQuestion:\n{question}"
+
+    def build(client) -> list:
+        # The schema and question are required; RAG context gets whatever budget they leave
+        endpoint = endpoint_of(client)
+        budget = prompt_budget(endpoint) - tokens(system + prompt, endpoint)
+        fitted = fit_context(question, context, budget, endpoint)
+        ctx = f"\n\nRelevant context:\n{fitted}" if fitted else ""
+        return [
+            SystemMessage(content=system),
+            HumanMessage(content=f"Schema:\n{schema_text}{ctx}\n\nQuestion:\n{question}")
+        ]
+
+    raw = _invoke("generate_sql", llm, build)
     return extract_sql(raw.content)
 
 
@@ -64,23 +283,71 @@ def refine_sql(question: str, schema_text: str, prev_sql: str, error_text: str,
         )),
         HumanMessage(content=(
             f"Schema:\n{schema_text}\n\nQuestion:\n{question}\n\n"
-            f"Previous SQL:\n{prev_sql}\n\nError from Databricks:\n{error_text}\n\n"
+            f"Previous SQL:\n{prev_sql}\n\nError from Databricks:\n{compact_error(error_text)}\n\n"
             "Provide the corrected SQL now."
         ))
     ]
-    raw = llm.invoke(messages)
+    # Fixing a query is a small task: it goes to the small endpoints first
+    raw = _invoke("refine_sql", llm, lambda client: messages, pool=LLM_SMALL_ENDPOINTS)
     return extract_sql(raw.content)
 
-def summarize_answer(question: str, df: pd.DataFrame, llm: ChatDatabricks, context: Optional[str] = None) -> str:
-    sample = df.head(10)
-    csv_preview = sample.to_csv(index=False)
+def _summary_messages(question: str, df: pd.DataFrame, llm, context: Optional[str] = None) -> list:
+    system = (
+        "You are a helpful analyst. Answer concisely based only on the provided query result "
+        "and optional additional context. If insufficient, say so."
+    )
+    endpoint = endpoint_of(llm)
+    left = prompt_budget(endpoint) - tokens(system + question, endpoint)
+    result = describe_result(df, min(PROMPT_RESULT_TOKENS, left), endpoint)
+    context = fit_context(question, context, left - tokens(result, endpoint), endpoint)
     ctx = f"\n\nAdditional context:\n{context}" if context else ""
-    messages = [
-        SystemMessage(content=(
-            "You are a helpful analyst. Answer concisely based only on the provided CSV preview "
-            "and optional additional context. If insufficient, say so."
-        )),
-        HumanMessage(content=f"Question:\n{question}\n\nCSV preview (up to 10 rows):\n{csv_preview}{ctx}")
+    return [
+        SystemMessage(content=system),
+        HumanMessage(content=f"Question:\n{question}\n\n{result}{ctx}")
     ]
-    resp = llm.invoke(messages)
-    return resp.content
\ No newline at end of file
+
+
+def summarize_answer(question: str, df: pd.DataFrame, llm: ChatDatabricks, context: Optional[str] = None) -> str:
+    resp = _invoke("summary", llm, lambda client: _summary_messages(question, df, client, context))
+    return resp.content
+
+
+def timed_stream(chunks: Iterable, label: str) -> Iterator[str]:
+    """Yield the text of streamed model chunks, logging time to first token and total time.
+
+    The clock starts when the first chunk is requested, which is when the model call is made.
+    """
+    t0 = time.perf_counter()
+    ttft = None
+    n = 0
+    try:
+        for chunk in chunks:
+            text = getattr(chunk, "content", chunk)
+            if not text:
+                continue
+            if ttft is None:
+                ttft = time.perf_counter() - t0
+                observe_stage(f"{label}_first_token", ttft)
+                logger.info(f"{label}: first token after {ttft:.2f}s")
+            n += 1
+            yield text
+    finally:
+        total = time.perf_counter() - t0
+        observe_stage(label, total)
+        first = f"{ttft:.2f}s" if ttft is not None else "n/a"
+        logger.info(f"{label}: {n} chunks in {total:.2f}s (first token {first})")
+
+
+def stream_summary(
+    question: str, df: pd.DataFrame, llm: ChatDatabricks, context: Optional[str] = None
+) -> Iterator[str]:
+    """Like ``summarize_answer``, but yields the answer text as the model generates it.
+
+    Streams are not hedged; with routing on they only avoid endpoints whose breaker is open.
+    """
+    endpoint = getattr(llm, "endpoint", None)
+    if LLM_ROUTING and endpoint:
+        endpoint = router.pick(endpoint)
+        llm = get_chat_llm(endpoint, getattr(llm, "temperature", None))
+    chunks = llm.stream(_summary_messages(question, df, llm, context), config=_usage("summary", llm))
+    return timed_stream(_routed_stream(chunks, endpoint) if LLM_ROUTING and endpoint else chunks, "summary")
@@ -0,0 +1,117 @@
+import time
+import uuid
+import asyncio
+import logging
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, Iterator, Optional, Tuple
+
+from prometheus_client import CONTENT_TYPE_LATEST, Counter, Gauge, Histogram, generate_latest
+
+logger = logging.getLogger(__name__)
+
+_STAGE_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+STAGE_SECONDS = Histogram(
+    "app_stage_seconds", "Duration of request stages", ["stage", "outcome"], buckets=_STAGE_BUCKETS
+)
+SQL_ATTEMPTS = Histogram(
+    "app_sql_attempts", "SQL candidates tried per question", buckets=(1, 2, 3, 4, 5, 7, 10, 15)
+)
+SQL_ATTEMPT_ERRORS = Counter("app_sql_attempt_errors_total", "Failed SQL candidates", ["kind"])
+LLM_TOKENS = Counter("app_llm_tokens_total", "Model tokens (estimated when not reported)", ["call", "kind"])
+ROWS_FETCHED = Counter("app_sql_rows_fetched_total", "Rows fetched from the warehouse")
+BYTES_FETCHED = Counter("app_sql_bytes_fetched_total", "Arrow bytes fetched from the warehouse")
+SQL_QUEUE_DEPTH = Gauge("app_sql_queue_depth", "Statements waiting for warehouse admission")
+SQL_RUNNING = Gauge("app_sql_running", "Statements admitted to the warehouse")
+SQL_REJECTED = Counter("app_sql_rejected_total", "Statements refused by admission control", ["reason"])
+
+_TRACE_ID: ContextVar[str] = ContextVar("trace_id", default="-")
+
+
+# -------- trace ids --------
+def new_trace_id(trace_id: Optional[str] = None) -> str:
+    """Start a trace for the current request; asyncio tasks and copied contexts inherit it."""
+    trace_id = trace_id or uuid.uuid4().hex[:16]
+    _TRACE_ID.set(trace_id)
+    return trace_id
+
+
+def current_trace_id() -> str:
+    return _TRACE_ID.get()
+
+
+def ensure_trace_id() -> str:
+    """The active trace id, or a new one when called outside a traced request."""
+    trace_id = _TRACE_ID.get()
+    return new_trace_id() if trace_id == "-" else trace_id
+
+
+class TraceIdFilter(logging.Filter):
+    def filter(self, record: logging.LogRecord) -> bool:
+        record.trace_id = _TRACE_ID.get()
+        return True
+
+
+def install_trace_logging(fmt: str = "%(levelname)s:%(name)s:[%(trace_id)s] %(message)s") -> None:
+    """Add the current trace id to every record written by the root logger's handlers."""
+    for handler in logging.getLogger().handlers:
+        handler.addFilter(TraceIdFilter())
+        handler.setFormatter(logging.Formatter(fmt))
+
+
+# -------- spans and counters --------
+class Span:
+    def __init__(self, stage: str):
+        self.stage = stage
+        self.outcome = "ok"
+
+
+@contextmanager
+def span(stage: str) -> Iterator[Span]:
+    """Time the block into ``app_stage_seconds``; set ``outcome`` on the yielded span to relabel it."""
+    s = Span(stage)
+    t0 = time.perf_counter()
+    try:
+        yield s
+    except BaseException as e:
+        if s.outcome == "ok":
+            s.outcome = "cancelled" if isinstance(e, asyncio.CancelledError) else "error"
+        raise
+    finally:
+        observe_stage(stage, time.perf_counter() - t0, s.outcome)
+
+
+def observe_stage(stage: str, seconds: float, outcome: str = "ok") -> None:
+    STAGE_SECONDS.labels(stage, outcome).observe(seconds)
+
+
+def record_tokens(call: str, prompt: int, completion: int) -> None:
+    LLM_TOKENS.labels(call, "prompt").inc(prompt)
+    LLM_TOKENS.labels(call, "completion").inc(completion)
+
+
+def record_sql_attempts(attempts: int, errors: Dict[str, int]) -> None:
+    """Candidates tried for one question, and why the failed ones failed (validation, warehouse, ...)."""
+    SQL_ATTEMPTS.observe(attempts)
+    for kind, n in errors.items():
+        SQL_ATTEMPT_ERRORS.labels(kind).inc(n)
+
+
+def record_fetch(rows: int, nbytes: int) -> None:
+    ROWS_FETCHED.inc(rows)
+    BYTES_FETCHED.inc(nbytes)
+
+
+def record_admission(queued: int, running: int) -> None:
+    SQL_QUEUE_DEPTH.set(queued)
+    SQL_RUNNING.set(running)
+
+
+def record_rejection(reason: str) -> None:
+    SQL_REJECTED.labels(reason).inc()
+
+
+def metrics_response() -> Tuple[bytes, int, Dict[str, str]]:
+    """Prometheus exposition of all metrics, as a Flask response tuple."""
+    return generate_latest(), 200, {"Content-Type": CONTENT_TYPE_LATEST}
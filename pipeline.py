@@ -0,0 +1,148 @@
+import os
+import time
+import asyncio
+import inspect
+import logging
+import functools
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Iterable, List, Optional
+
+logger = logging.getLogger(__name__)
+
+PIPELINE_WORKERS = int(os.getenv("PIPELINE_WORKERS", "32"))
+
+_NO_FALLBACK = object()
+# Shared by all pipelines instead of the event loop's default executor: a thread left behind by
+# a timed-out stage must not hold up the shutdown of a per-request event loop
+_EXECUTOR = ThreadPoolExecutor(max_workers=PIPELINE_WORKERS, thread_name_prefix="pipeline")
+
+
+async def run_in_thread(fn: Callable[..., Any], *args: Any, **kwargs: Any) -> Any:
+    """``asyncio.to_thread`` on the shared executor, so abandoned calls do not delay the loop's shutdown."""
+    loop = asyncio.get_running_loop()
+    # Run in a copy of the caller's context so context variables (e.g. trace ids) carry over
+    ctx = contextvars.copy_context()
+    return await loop.run_in_executor(_EXECUTOR, functools.partial(ctx.run, fn, *args, **kwargs))
+
+
+class Stage:
+    """One step of a ``Pipeline``.
+
+    ``fn`` is called with the results of ``deps`` (stage or input names) as keyword arguments.
+    Coroutine functions are awaited; plain functions run in a worker thread. When the stage
+    fails or exceeds ``timeout`` seconds, ``fallback`` is used as its result instead (called
+    with the exception if it is callable); without a fallback the error fails the pipeline.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        fn: Callable[..., Any],
+        deps: Iterable[str] = (),
+        timeout: Optional[float] = None,
+        fallback: Any = _NO_FALLBACK,
+    ):
+        self.name = name
+        self.fn = fn
+        self.deps = tuple(deps)
+        self.timeout = timeout
+        self.fallback = fallback
+
+    async def _call(self, kwargs: Dict[str, Any]) -> Any:
+        if inspect.iscoroutinefunction(self.fn):
+            return await self.fn(**kwargs)
+        return await run_in_thread(self.fn, **kwargs)
+
+    def _fallback(self, error: BaseException) -> Any:
+        return self.fallback(error) if callable(self.fallback) else self.fallback
+
+
+class Pipeline:
+    """Runs stages as a dependency graph: every stage starts as soon as its dependencies are done."""
+
+    def __init__(self, stages: List[Stage]):
+        self.stages = {s.name: s for s in stages}
+        if len(self.stages) != len(stages):
+            raise ValueError("Stage names must be unique.")
+        self._check_acyclic()
+        self._listeners: List[Callable[[str, float, str], None]] = []
+
+    def add_listener(self, fn: Callable[[str, float, str], None]) -> None:
+        """Call ``fn(stage, seconds, outcome)`` after every stage; outcome is ok, fallback or failed."""
+        self._listeners.append(fn)
+
+    def _notify(self, name: str, seconds: float, outcome: str) -> None:
+        for fn in self._listeners:
+            try:
+                fn(name, seconds, outcome)
+            except Exception as e:
+                logger.warning(f"Pipeline listener failed: {e}")
+
+    def _check_acyclic(self) -> None:
+        state: Dict[str, int] = {}  # 1 = visiting, 2 = done
+
+        def visit(name: str) -> None:
+            if state.get(name) == 2 or name not in self.stages:
+                return
+            if state.get(name) == 1:
+                raise ValueError(f"Pipeline has a dependency cycle through {name}.")
+            state[name] = 1
+            for dep in self.stages[name].deps:
+                visit(dep)
+            state[name] = 2
+
+        for name in self.stages:
+            visit(name)
+
+    async def run(self, **inputs: Any) -> Dict[str, Any]:
+        """Run every stage and return all results (and ``inputs``) by name.
+
+        Per-stage durations and fallbacks are logged. If a stage without a fallback fails,
+        the stages still running are cancelled and its exception is raised.
+        """
+        for stage in self.stages.values():
+            unknown = [d for d in stage.deps if d not in self.stages and d not in inputs]
+            if unknown:
+                raise ValueError(f"Stage {stage.name} depends on unknown {', '.join(unknown)}.")
+
+        results: Dict[str, Any] = dict(inputs)
+        timings: Dict[str, str] = {}
+        tasks: Dict[str, asyncio.Task] = {}
+
+        async def run_stage(stage: Stage) -> Any:
+            await asyncio.gather(*(tasks[d] for d in stage.deps if d in tasks))
+            kwargs = {d: results[d] for d in stage.deps}
+            t0 = time.perf_counter()
+            try:
+                value = await asyncio.wait_for(stage._call(kwargs), timeout=stage.timeout)
+                outcome = "ok"
+            except Exception as e:
+                if stage.fallback is _NO_FALLBACK:
+                    elapsed = time.perf_counter() - t0
+                    timings[stage.name] = f"{elapsed:.2f}s failed"
+                    self._notify(stage.name, elapsed, "failed")
+                    raise
+                reason = f"timed out after {stage.timeout:.1f}s" if isinstance(e, asyncio.TimeoutError) else str(e)
+                logger.warning(f"Stage {stage.name} {reason}; using fallback")
+                value = stage._fallback(e)
+                outcome = "fallback"
+            elapsed = time.perf_counter() - t0
+            timings[stage.name] = f"{elapsed:.2f}s" + ("" if outcome == "ok" else f" {outcome}")
+            self._notify(stage.name, elapsed, outcome)
+            results[stage.name] = value
+            return value
+
+        # Tasks are created up front; each waits on its dependencies' tasks before starting
+        for name in self.stages:
+            tasks[name] = asyncio.ensure_future(run_stage(self.stages[name]))
+        t0 = time.perf_counter()
+        try:
+            await asyncio.gather(*tasks.values())
+        finally:
+            for task in tasks.values():
+                if not task.done():
+                    task.cancel()
+            summary = ", ".join(f"{n} {timings.get(n, 'cancelled')}" for n in self.stages)
+            logger.info(f"Pipeline finished in {time.perf_counter() - t0:.2f}s: {summary}")
+        return results
@@ -1,65 +1,615 @@
 import base64
+import codecs
+import contextvars
+import hashlib
+import io
+import json
 import logging
 import os
-from typing import List, Tuple
+import re
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, Executor, Future, ThreadPoolExecutor, wait
+from html.parser import HTMLParser
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
 
+from langchain_core.embeddings import Embeddings
 from langchain_community.vectorstores import DatabricksVectorSearch
 from langchain_community.embeddings import DatabricksEmbeddings
 
+from cache import TTLCache
+from metrics import span, observe_stage
+from vectorstore import LocalVectorStore, open_local_store
+
 logger = logging.getLogger(__name__)
 
-def _get_embeddings() -> DatabricksEmbeddings:
+RAG_INGEST_BATCH_SIZE = int(os.getenv("RAG_INGEST_BATCH_SIZE", "64"))
+RAG_INGEST_WORKERS = int(os.getenv("RAG_INGEST_WORKERS", "4"))
+# Local record of chunk ids per source file, so re-uploads only embed changed chunks
+RAG_INGEST_MANIFEST = os.getenv("RAG_INGEST_MANIFEST", ".rag_manifest.json")
+# Chunk size in tokens; keep it under the embedding model's input limit (512 for gte-large)
+RAG_CHUNK_TOKENS = int(os.getenv("RAG_CHUNK_TOKENS", "400"))
+RAG_CHUNK_OVERLAP_TOKENS = int(os.getenv("RAG_CHUNK_OVERLAP_TOKENS", "50"))
+_DECODE_BLOCK_CHARS = 1 << 20  # base64 characters decoded per step; a multiple of 4
+
+# "databricks" uses Vector Search; "local" uses only the in-process index (offline, tests, benchmarks).
+# With the databricks backend, setting RAG_LOCAL_INDEX_DIR adds the local index as a read tier.
+RAG_BACKEND = os.getenv("RAG_BACKEND", "databricks")
+RAG_LOCAL_INDEX_DIR = os.getenv("RAG_LOCAL_INDEX_DIR")
+# The read tier only holds what this process ingested; it answers alone only when declared to mirror
+# the whole remote index, and otherwise serves as a fallback while Vector Search is unavailable
+RAG_LOCAL_INDEX_COMPLETE = os.getenv("RAG_LOCAL_INDEX_COMPLETE", "0") == "1"
+
+# Query embeddings (LRU) and top-k retrieval results (TTL); ingestion clears the results cache
+RAG_EMBED_CACHE_SIZE = int(os.getenv("RAG_EMBED_CACHE_SIZE", "2048"))
+RAG_RESULTS_CACHE_SIZE = int(os.getenv("RAG_RESULTS_CACHE_SIZE", "1024"))
+RAG_RESULTS_TTL_SECONDS = float(os.getenv("RAG_RESULTS_TTL_SECONDS", "600"))
+
+_EMBED_CACHE = TTLCache(max_entries=RAG_EMBED_CACHE_SIZE)
+_RESULTS_CACHE = TTLCache(max_entries=RAG_RESULTS_CACHE_SIZE, ttl=RAG_RESULTS_TTL_SECONDS)
+_CLIENTS: Dict[str, object] = {}
+_CLIENTS_LOCK = threading.Lock()
+
+def _client(name: str, factory):
+    # Clients are long-lived: building them costs a round trip (the VS client describes the index)
+    with _CLIENTS_LOCK:
+        client = _CLIENTS.get(name)
+        if client is None:
+            client = _CLIENTS[name] = factory()
+        return client
+
+def get_embeddings() -> DatabricksEmbeddings:
+    """Shared client of the ``EMBEDDING_ENDPOINT`` serving endpoint."""
     endpoint = os.getenv("EMBEDDING_ENDPOINT", "databricks-gte-large-en")
-    return DatabricksEmbeddings(endpoint=endpoint)
+    return _client(f"embeddings:{endpoint}", lambda: DatabricksEmbeddings(endpoint=endpoint))
 
-def _get_vs() -> DatabricksVectorSearch:
+def embed_query(text: str) -> List[float]:
+    key = text.strip()
+    vector = _EMBED_CACHE.get(key)
+    if vector is None:
+        vector = get_embeddings().embed_query(key)
+        _EMBED_CACHE.set(key, vector)
+    return vector
+
+def clear_retrieval_cache() -> None:
+    _RESULTS_CACHE.clear()
+
+def _local_index_dir() -> str:
+    return RAG_LOCAL_INDEX_DIR or ".rag_index"
+
+def _index_name() -> str:
+    if RAG_BACKEND == "local":
+        return f"local:{os.path.abspath(_local_index_dir())}"
+    return os.getenv("RAG_VS_INDEX", "workspace.rag.docs_index")
+
+def _get_vs(embedding: Optional[Embeddings] = None) -> DatabricksVectorSearch:
+    """Shared client for retrieval; ingestion passes its own (timed) embedding and gets a fresh one."""
     endpoint = os.getenv("RAG_VS_ENDPOINT", "rag-endpoint")
-    index = os.getenv("RAG_VS_INDEX", "workspace.rag.docs_index")
-    return DatabricksVectorSearch(
-        endpoint=endpoint,
-        index_name=index,
-        embedding=_get_embeddings(),
-    )
-
-def _chunk_text(text: str, chunk_size: int = 800, overlap: int = 100) -> List[str]:
-    chunks = []
-    start = 0
-    n = len(text)
-    while start < n:
-        end = min(n, start + chunk_size)
-        chunks.append(text[start:end])
-        if end == n:
-            break
-        start = end - overlap
-    return chunks
-
-def _decode_content(content_b64: str) -> str:
+    index_name = _index_name()
+
+    def build():
+        return DatabricksVectorSearch(
+            endpoint=endpoint,
+            index_name=index_name,
+            embedding=embedding or get_embeddings(),
+        )
+
+    if embedding is not None:
+        return build()
+    return _client(f"vs:{endpoint}:{index_name}", build)
+
+def _get_local_vs() -> Optional[LocalVectorStore]:
+    if RAG_BACKEND != "local" and not RAG_LOCAL_INDEX_DIR:
+        return None
+    return open_local_store(_local_index_dir(), embedding=get_embeddings())
+
+_TOKEN_RE = re.compile(r"\w+|[^\w\s]")
+# Sentence ends and paragraph breaks; the whitespace stays with the preceding unit
+_BOUNDARY_RE = re.compile(r"(?<=[.!?])\s+|\n\s*\n")
+_WORD_RE = re.compile(r"\S+\s*")
+
+def count_tokens(text: str) -> int:
+    """Approximate token count: words and punctuation marks."""
+    return len(_TOKEN_RE.findall(text))
+
+def _iter_decoded(content_b64: str, block_chars: int = _DECODE_BLOCK_CHARS) -> Iterator[str]:
     # dcc.Upload provides content like "data:<mime>;base64,<payload>"
-    _, b64data = content_b64.split(",", 1)
-    return base64.b64decode(b64data).decode("utf-8", errors="ignore")
+    start = content_b64.index(",") + 1
+    block = max(4, block_chars - block_chars % 4)
+    decoder = codecs.getincrementaldecoder("utf-8")(errors="ignore")
+    for i in range(start, len(content_b64), block):
+        yield decoder.decode(base64.b64decode(content_b64[i:i + block]))
+    tail = decoder.decode(b"", final=True)
+    if tail:
+        yield tail
+
+def _iter_units(pieces: Iterable[str], max_chars: int) -> Iterator[str]:
+    """Split streamed text into sentences/paragraphs, holding at most one partial unit."""
+    buf = ""
+    for piece in pieces:
+        buf += piece
+        last = 0
+        for m in _BOUNDARY_RE.finditer(buf):
+            yield buf[last:m.end()]
+            last = m.end()
+        buf = buf[last:]
+        while len(buf) > max_chars:
+            # No boundary in sight (e.g. minified text): cut at the last space to bound memory
+            cut = buf.rfind(" ", 0, max_chars)
+            cut = cut if cut > 0 else max_chars
+            yield buf[:cut]
+            buf = buf[cut:]
+    if buf.strip():
+        yield buf
+
+def _split_long(unit: str, max_tokens: int) -> Iterator[Tuple[str, int]]:
+    part, n = [], 0
+    for word in _WORD_RE.findall(unit):
+        k = count_tokens(word)
+        if part and n + k > max_tokens:
+            yield "".join(part), n
+            part, n = [], 0
+        part.append(word)
+        n += k
+    if part:
+        yield "".join(part), n
+
+def _iter_chunks(
+    pieces: Iterable[str],
+    max_tokens: int = RAG_CHUNK_TOKENS,
+    overlap_tokens: int = RAG_CHUNK_OVERLAP_TOKENS,
+) -> Iterator[str]:
+    """Pack sentences and paragraphs into chunks of at most ``max_tokens`` tokens.
+
+    Consecutive chunks share up to ``overlap_tokens`` tokens of whole trailing sentences. Only
+    sentences longer than ``max_tokens`` are split mid-sentence (on word boundaries).
+    """
+    window: List[Tuple[str, int]] = []
+    total = 0
+    for unit in _iter_units(pieces, max_chars=max_tokens * 8):
+        n = count_tokens(unit)
+        if n == 0:
+            continue
+        parts = _split_long(unit, max_tokens) if n > max_tokens else [(unit, n)]
+        for text, k in parts:
+            if window and total + k > max_tokens:
+                yield "".join(t for t, _ in window).strip()
+                carry, c = [], 0
+                for t, tk in reversed(window):
+                    if c + tk > overlap_tokens:
+                        break
+                    carry.insert(0, (t, tk))
+                    c += tk
+                window, total = (carry, c) if c + k <= max_tokens else ([], 0)
+            window.append((text, k))
+            total += k
+    if window:
+        yield "".join(t for t, _ in window).strip()
+
+def _chunk_text(text: str) -> List[str]:
+    return list(_iter_chunks([text]))
+
+# Plain text is decoded and chunked as a stream; the other types are parsed whole
+TEXT_EXTENSIONS = (".txt", ".md")
+DOCUMENT_EXTENSIONS = TEXT_EXTENSIONS + (".pdf", ".docx", ".html", ".htm")
+
+
+class _HTMLText(HTMLParser):
+    """Visible text of an HTML page, with block elements as paragraph breaks."""
+
+    _SKIP = {"script", "style", "noscript", "template", "head"}
+    _BLOCKS = {"p", "div", "br", "li", "tr", "h1", "h2", "h3", "h4", "h5", "h6", "section", "article", "pre"}
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.parts: List[str] = []
+        self._skipping = 0
+
+    def handle_starttag(self, tag, attrs):
+        if tag in self._SKIP:
+            self._skipping += 1
+        elif tag in self._BLOCKS:
+            self.parts.append("\n\n")
+
+    def handle_endtag(self, tag):
+        if tag in self._SKIP and self._skipping:
+            self._skipping -= 1
+
+    def handle_data(self, data):
+        if not self._skipping:
+            self.parts.append(data)
+
+
+def _html_text(data: bytes) -> str:
+    parser = _HTMLText()
+    parser.feed(data.decode("utf-8", errors="ignore"))
+    parser.close()
+    return re.sub(r"[ \t]+", " ", "".join(parser.parts))
+
+
+def _pdf_text(data: bytes) -> str:
+    try:
+        from pypdf import PdfReader
+    except ImportError:
+        raise RuntimeError("PDF ingestion needs the pypdf package")
+    reader = PdfReader(io.BytesIO(data))
+    return "\n\n".join(page.extract_text() or "" for page in reader.pages)
+
+
+def _docx_text(data: bytes) -> str:
+    try:
+        import docx
+    except ImportError:
+        raise RuntimeError("DOCX ingestion needs the python-docx package")
+    document = docx.Document(io.BytesIO(data))
+    paragraphs = [p.text for p in document.paragraphs]
+    for table in document.tables:
+        paragraphs.extend(" | ".join(cell.text for cell in row.cells) for row in table.rows)
+    return "\n\n".join(paragraphs)
+
+
+_EXTRACTORS = {".pdf": _pdf_text, ".docx": _docx_text, ".html": _html_text, ".htm": _html_text}
+
+
+def extract_text(data: bytes, filename: str) -> str:
+    """Text of a document, by file extension; unknown types are read as UTF-8 text."""
+    extract = _EXTRACTORS.get(os.path.splitext(filename)[1].lower())
+    return extract(data) if extract else data.decode("utf-8", errors="ignore")
+
+
+def _dedupe(source: str, chunks: Iterable[str]) -> List[Tuple[str, str]]:
+    out: Dict[str, str] = {}
+    for chunk in chunks:
+        out.setdefault(chunk_id(source, chunk), chunk)
+    return list(out.items())
+
+
+def _iter_file(path: str, block_chars: int = _DECODE_BLOCK_CHARS) -> Iterator[str]:
+    with open(path, "r", encoding="utf-8", errors="ignore") as f:
+        while True:
+            piece = f.read(block_chars)
+            if not piece:
+                return
+            yield piece
+
+def chunk_file(path: str, source: str) -> List[Tuple[str, str]]:
+    """``(chunk id, chunk)`` pairs of a file on disk, without duplicates; ids match uploads of the same source."""
+    if path.lower().endswith(TEXT_EXTENSIONS):
+        return _dedupe(source, _iter_chunks(_iter_file(path)))
+    with open(path, "rb") as f:
+        return _dedupe(source, _iter_chunks([extract_text(f.read(), path)]))
+
+def parse_document(content_b64: str, filename: str) -> Tuple[float, int, float, List[Tuple[str, str]]]:
+    """Decode, parse and chunk one uploaded PDF/DOCX/HTML file, in a parse worker process.
 
-def ingest_uploaded_files(contents: List[str], filenames: List[str]) -> int:
-    """Return number of chunks indexed."""
+    Returns (decode seconds, decoded bytes, parse and chunk seconds, chunks). Text files are not
+    sent here: they stream through ``_iter_chunks`` on the ingesting thread.
+    """
+    t0 = time.perf_counter()
+    data = base64.b64decode(content_b64[content_b64.index(",") + 1:])
+    t1 = time.perf_counter()
+    chunks = _dedupe(filename, _iter_chunks([extract_text(data, filename)]))
+    return t1 - t0, len(data), time.perf_counter() - t1, chunks
+
+class IngestStats:
+    """Per-stage busy time and item counts for one ingestion run."""
+
+    STAGES = ("decode", "chunk", "embed", "upsert")
+    UNITS = {"decode": "bytes", "chunk": "chunks", "embed": "chunks", "upsert": "chunks"}
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.seconds = {s: 0.0 for s in self.STAGES}
+        self.items = {s: 0 for s in self.STAGES}
+        self.skipped = 0  # unchanged chunks that were not re-embedded
+        self.deleted = 0  # chunks of a previous upload that no longer exist
+        self.files_total = 0
+        self.files_done = 0  # parsed and queued for embedding
+        self.failed_files: List[str] = []
+
+    def add(self, stage: str, seconds: float, items: int) -> None:
+        with self._lock:
+            self.seconds[stage] += seconds
+            self.items[stage] += items
+
+    def throughput(self) -> Dict[str, float]:
+        return {s: self.items[s] / self.seconds[s] if self.seconds[s] else 0.0 for s in self.STAGES}
+
+    def summary(self) -> str:
+        rates = self.throughput()
+        parts = [
+            f"{s} {self.items[s]} {self.UNITS[s]} in {self.seconds[s]:.2f}s ({rates[s]:.0f}/s)"
+            for s in self.STAGES
+        ]
+        return "; ".join(parts) + f"; skipped {self.skipped} unchanged, deleted {self.deleted} stale"
+
+
+class _TimedEmbeddings(Embeddings):
+    """Wraps the embedding client so embed time can be told apart from upsert time."""
+
+    def __init__(self, inner: Embeddings, stats: IngestStats):
+        self._inner = inner
+        self._stats = stats
+        self._local = threading.local()
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        t0 = time.perf_counter()
+        vectors = self._inner.embed_documents(texts)
+        self._local.last_seconds = time.perf_counter() - t0
+        self._local.last_vectors = vectors
+        self._stats.add("embed", self._local.last_seconds, len(texts))
+        return vectors
+
+    def embed_query(self, text: str) -> List[float]:
+        return self._inner.embed_query(text)
+
+    def last_seconds(self) -> float:
+        """Duration of the last embed_documents call made on this thread."""
+        return getattr(self._local, "last_seconds", 0.0)
+
+    def last_vectors(self) -> List[List[float]]:
+        """Vectors returned by the last embed_documents call made on this thread."""
+        return getattr(self._local, "last_vectors", [])
+
+
+def chunk_id(source: str, chunk: str) -> str:
+    return hashlib.sha256(f"{source}\x00{chunk}".encode("utf-8")).hexdigest()
+
+
+_MANIFEST_LOCK = threading.Lock()
+
+def _load_manifest() -> Dict[str, Dict[str, List[str]]]:
+    if not RAG_INGEST_MANIFEST or not os.path.exists(RAG_INGEST_MANIFEST):
+        return {}
+    try:
+        with open(RAG_INGEST_MANIFEST, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except Exception as e:
+        logger.warning(f"Could not read ingest manifest {RAG_INGEST_MANIFEST}: {e}")
+        return {}
+
+def _save_manifest(manifest: Dict[str, Dict[str, List[str]]]) -> None:
+    if not RAG_INGEST_MANIFEST:
+        return
+    tmp = f"{RAG_INGEST_MANIFEST}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(manifest, f)
+    os.replace(tmp, RAG_INGEST_MANIFEST)
+
+
+last_ingest_stats: Optional[IngestStats] = None
+
+def ingest_uploaded_files(
+    contents: List[str],
+    filenames: List[str],
+    stats: Optional[IngestStats] = None,
+    parse_pool: Optional[Executor] = None,
+) -> int:
+    """Return number of chunks indexed (new or changed; unchanged chunks are skipped).
+
+    ``stats`` can be read while this runs, for progress. With a ``parse_pool`` (a process pool),
+    PDF/DOCX/HTML files are parsed and chunked there instead of on the calling thread.
+    """
+    global last_ingest_stats
     if not contents:
         return 0
-    vs = _get_vs()
-    total_chunks = 0
-    for content_b64, fname in zip(contents, filenames or []):
-        try:
-            text = _decode_content(content_b64)
-        except Exception as e:
-            logger.warning(f"Failed to decode {fname}: {e}")
-            continue
-        # Basic support for .txt/.md; extend as needed for PDF/Docx
-        chunks = _chunk_text(text)
-        if not chunks:
-            continue
-        metadatas = [{"source": fname}] * len(chunks)
-        vs.add_texts(texts=chunks, metadatas=metadatas)
-        total_chunks += len(chunks)
-    return total_chunks
+    stats = stats or IngestStats()
+    last_ingest_stats = stats
+    try:
+        with span("ingest"):
+            return _ingest(contents, filenames, stats, parse_pool)
+    finally:
+        # Retrieval results cached before (or during) this upload may now be stale
+        clear_retrieval_cache()
+        for name, seconds in stats.seconds.items():
+            observe_stage(f"ingest_{name}", seconds)
+
+class ChunkWriter:
+    """Embeds batches of ``(chunk id, text, source)`` into the configured index(es) and records what they hold.
+
+    Shared by uploads and the bulk loader in index.py; stage times go to ``stats``.
+    """
+
+    def __init__(self, stats: IngestStats):
+        self.stats = stats
+        self.index_name = _index_name()
+        self._timed = _TimedEmbeddings(get_embeddings(), stats)
+        self._vs = _get_vs(embedding=self._timed) if RAG_BACKEND != "local" else None
+        self._local = _get_local_vs()
+
+    def known(self) -> Dict[str, List[str]]:
+        """Chunk ids the index holds per source, as of the last commit."""
+        with _MANIFEST_LOCK:
+            return _load_manifest().get(self.index_name, {})
+
+    def add(self, batch: List[Tuple[str, str, str]]) -> List[str]:
+        texts = [text for _, text, _ in batch]
+        metadatas = [{"source": source} for _, _, source in batch]
+        ids = [cid for cid, _, _ in batch]
+        t0 = time.perf_counter()
+        if self._vs is not None:
+            added = self._vs.add_texts(texts=texts, metadatas=metadatas, ids=ids)
+            vectors = self._timed.last_vectors()
+        else:
+            vectors = self._timed.embed_documents(texts)
+            added = ids
+        if self._local is not None:
+            # Mirror into the local index with the vectors already computed for the remote one
+            ok = set(added)
+            rows = [(t, v, m, i) for t, v, m, i in zip(texts, vectors, metadatas, ids) if i in ok]
+            self._local.add_embeddings(
+                [r[0] for r in rows], [r[1] for r in rows], [r[2] for r in rows], [r[3] for r in rows]
+            )
+        # The embed share of this batch is already recorded by _TimedEmbeddings
+        self.stats.add("upsert", time.perf_counter() - t0 - self._timed.last_seconds(), len(added))
+        return added
+
+    def commit(self, known: Dict[str, List[str]], file_ids: Dict[str, List[str]], indexed: set) -> None:
+        """Drop chunks of re-ingested files that are no longer present, then record what the index holds.
+
+        ``known`` is the manifest as read before ingesting, ``file_ids`` the chunk ids of each fully
+        read file, and ``indexed`` the ids added in this run.
+        """
+        if not file_ids:
+            return
+        with _MANIFEST_LOCK:
+            manifest = _load_manifest()
+            current = manifest.setdefault(self.index_name, {})
+            for fname, ids in file_ids.items():
+                previous = set(known.get(fname, ()))
+                keep = [cid for cid in ids if cid in indexed or cid in previous]
+                uploaded = set(ids)
+                stale = [cid for cid in current.get(fname, ()) if cid not in uploaded]
+                if stale:
+                    try:
+                        for store in (self._vs, self._local):
+                            if store is not None:
+                                store.delete(ids=stale)
+                        self.stats.deleted += len(stale)
+                    except Exception as e:
+                        logger.warning(f"Failed to delete stale chunks of {fname}: {e}")
+                        keep.extend(stale)  # retried on the next upload of this file
+                current[fname] = keep
+            _save_manifest(manifest)
+        if self._local is not None:
+            # Re-ingested and deleted chunks leave superseded records in the document log
+            self._local.compact()
+
+
+def _ingest(
+    contents: List[str], filenames: List[str], stats: IngestStats, parse_pool: Optional[Executor] = None
+) -> int:
+    started = time.perf_counter()
+    writer = ChunkWriter(stats)
+    known = writer.known()
+
+    def timed_decode(content_b64: str) -> Iterator[str]:
+        pieces = _iter_decoded(content_b64)
+        while True:
+            t0 = time.perf_counter()
+            piece = next(pieces, None)
+            stats.add("decode", time.perf_counter() - t0, len(piece or ""))
+            if piece is None:
+                return
+            yield piece
+
+    # Text files are decoded and chunked as a stream; batches span file boundaries and at most
+    # 2 * RAG_INGEST_WORKERS batches are queued, so memory stays bounded for large uploads
+    file_ids: Dict[str, List[str]] = {}
+    indexed = set()
+    batch: List[Tuple[str, str, str]] = []
+    in_flight = set()
+    workers = max(1, RAG_INGEST_WORKERS)
+
+    def drain(limit: int) -> None:
+        nonlocal in_flight
+        while len(in_flight) > limit:
+            done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+            for fut in done:
+                try:
+                    indexed.update(fut.result())
+                except Exception as e:
+                    logger.warning(f"Failed to index a batch of chunks: {e}")
+
+    files = list(zip(contents, filenames or []))
+    stats.files_total = len(files)
+    parsing: Dict[int, Future] = {}
+
+    def stream_chunks(content_b64: str, fname: str) -> Iterator[Tuple[str, str]]:
+        chunks = _iter_chunks(timed_decode(content_b64))
+        ids_set = set()
+        while True:
+            t0 = time.perf_counter()
+            decode_before = stats.seconds["decode"]
+            chunk = next(chunks, None)
+            # Chunking time excludes the decode time spent pulling the next piece
+            elapsed = time.perf_counter() - t0 - (stats.seconds["decode"] - decode_before)
+            stats.add("chunk", elapsed, 0 if chunk is None else 1)
+            if chunk is None:
+                return
+            cid = chunk_id(fname, chunk)
+            if cid not in ids_set:
+                ids_set.add(cid)
+                yield cid, chunk
+
+    def is_text(i: int) -> bool:
+        return files[i][1].lower().endswith(TEXT_EXTENSIONS)
+
+    def file_chunks(i: int) -> Iterable[Tuple[str, str]]:
+        content_b64, fname = files[i]
+        if is_text(i):
+            return stream_chunks(content_b64, fname)
+        if parse_pool is None:
+            decode_s, nbytes, chunk_s, pairs = parse_document(content_b64, fname)
+        else:
+            # Parse a few documents ahead, so the worker processes stay busy while this one is embedded
+            for j in range(i, min(len(files), i + workers)):
+                if j not in parsing and not is_text(j):
+                    parsing[j] = parse_pool.submit(parse_document, *files[j])
+            decode_s, nbytes, chunk_s, pairs = parsing.pop(i).result()
+        stats.add("decode", decode_s, nbytes)
+        stats.add("chunk", chunk_s, len(pairs))
+        return pairs
+
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="rag-ingest") as pool:
+        for i, (content_b64, fname) in enumerate(files):
+            seen = set(known.get(fname, ()))
+            ids: List[str] = []
+            try:
+                for cid, chunk in file_chunks(i):
+                    ids.append(cid)
+                    if cid in seen:
+                        stats.skipped += 1
+                        continue
+                    batch.append((cid, chunk, fname))
+                    if len(batch) >= RAG_INGEST_BATCH_SIZE:
+                        in_flight.add(pool.submit(contextvars.copy_context().run, writer.add, batch))
+                        batch = []
+                        drain(2 * workers)
+            except Exception as e:
+                # A partly read file must not mark its older chunks as stale
+                logger.warning(f"Failed to read {fname}: {e}")
+                stats.failed_files.append(fname)
+            else:
+                file_ids[fname] = ids
+            stats.files_done += 1
+        if batch:
+            in_flight.add(pool.submit(contextvars.copy_context().run, writer.add, batch))
+        drain(0)
+
+    writer.commit(known, file_ids, indexed)
+
+    logger.info(f"Ingested {len(indexed)} chunk(s) in {time.perf_counter() - started:.2f}s: {stats.summary()}")
+    return len(indexed)
+
+def _search(vs, query: str, k: int) -> List:
+    try:
+        return vs.similarity_search_by_vector(embed_query(query), k=k)
+    except ValueError:
+        # Indexes with Databricks-managed embeddings only accept text queries
+        return vs.similarity_search(query, k=k)
 
 def retrieve_context(query: str, k: int = 5) -> str:
-    vs = _get_vs()
-    docs = vs.similarity_search(query, k=k)
-    return "\n\n".join(d.page_content for d in docs)
\ No newline at end of file
+    with span("retrieve_context") as s:
+        local = _get_local_vs()
+        use_local = RAG_BACKEND == "local" or (local is not None and RAG_LOCAL_INDEX_COMPLETE and len(local) > 0)
+        key = (f"local:{_local_index_dir()}" if use_local else _index_name(), query.strip(), k)
+        cached = _RESULTS_CACHE.get(key)
+        if cached is not None:
+            s.outcome = "cache_hit"
+            return cached
+        if use_local:
+            docs = _search(local, query, k)
+        else:
+            try:
+                docs = _search(_get_vs(), query, k)
+            except Exception as e:
+                if local is None or len(local) == 0:
+                    raise
+                logger.warning(f"Vector Search failed, answering from the local index: {e}")
+                s.outcome = "local_fallback"
+                # Not cached: the local tier may be missing documents the remote index has
+                return "\n\n".join(d.page_content for d in _search(local, query, k))
+        context = "\n\n".join(d.page_content for d in docs)
+        _RESULTS_CACHE.set(key, context)
+        return context
@@ -0,0 +1,192 @@
+import os
+import time
+import logging
+import threading
+import contextvars
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Any, Callable, Deque, Dict, Iterable, List, Optional
+
+import numpy as np
+
+from metrics import observe_stage
+
+logger = logging.getLogger(__name__)
+
+# Rolling window of calls kept per endpoint for latency and error rates
+LLM_ROUTER_WINDOW = int(os.getenv("LLM_ROUTER_WINDOW", "100"))
+# A backup request goes to another endpoint once a call outlives the primary's p95 latency
+LLM_HEDGE = os.getenv("LLM_HEDGE", "1") == "1"
+LLM_HEDGE_QUANTILE = float(os.getenv("LLM_HEDGE_QUANTILE", "95"))
+LLM_HEDGE_MIN_SAMPLES = int(os.getenv("LLM_HEDGE_MIN_SAMPLES", "20"))
+LLM_HEDGE_MIN_SECONDS = float(os.getenv("LLM_HEDGE_MIN_SECONDS", "1.0"))
+# Circuit breaker: an endpoint leaves rotation after this many failures in a row, or a high error rate
+LLM_BREAKER_FAILURES = int(os.getenv("LLM_BREAKER_FAILURES", "5"))
+LLM_BREAKER_ERROR_RATE = float(os.getenv("LLM_BREAKER_ERROR_RATE", "0.5"))
+LLM_BREAKER_COOLDOWN_SECONDS = float(os.getenv("LLM_BREAKER_COOLDOWN_SECONDS", "30"))
+LLM_ROUTER_WORKERS = int(os.getenv("LLM_ROUTER_WORKERS", "32"))
+
+_EXECUTOR = ThreadPoolExecutor(max_workers=LLM_ROUTER_WORKERS, thread_name_prefix="llm")
+
+
+class EndpointStats:
+    """Rolling latencies and outcomes of one endpoint, and its circuit breaker."""
+
+    def __init__(self, window: int):
+        self.latencies: Deque[float] = deque(maxlen=window)
+        self.outcomes: Deque[bool] = deque(maxlen=window)
+        self.consecutive_failures = 0
+        self.open_until = 0.0  # breaker open (endpoint out of rotation) until this monotonic time
+        self.probe_until = 0.0  # half-open: a trial call is in flight; another may start after this
+
+    def quantile(self, q: float) -> Optional[float]:
+        return float(np.percentile(self.latencies, q)) if self.latencies else None
+
+    def error_rate(self) -> float:
+        return 1.0 - sum(self.outcomes) / len(self.outcomes) if self.outcomes else 0.0
+
+
+class Router:
+    """Routes model calls across endpoints by rolling latency, hedges slow calls, and sheds failing endpoints.
+
+    ``client(endpoint, temperature)`` returns the (pooled) chat model for an endpoint. Calls go
+    to the preferred endpoint while its breaker is closed, otherwise to the fastest healthy one.
+    """
+
+    def __init__(self, client: Callable[[str, Optional[float]], Any], endpoints: Iterable[str] = ()):
+        self._client = client
+        self._base = list(endpoints)
+        self._stats: Dict[str, EndpointStats] = {}
+        self._lock = threading.Lock()
+
+    def _stats_locked(self, endpoint: str) -> EndpointStats:
+        stats = self._stats.get(endpoint)
+        if stats is None:
+            stats = self._stats[endpoint] = EndpointStats(LLM_ROUTER_WINDOW)
+        return stats
+
+    def record(self, endpoint: str, seconds: Optional[float], ok: bool) -> None:
+        """Add a call's outcome; ``seconds`` may be None when only success or failure is known."""
+        with self._lock:
+            s = self._stats_locked(endpoint)
+            s.outcomes.append(ok)
+            s.probe_until = 0.0
+            if ok:
+                if seconds is not None:
+                    s.latencies.append(seconds)
+                s.consecutive_failures = 0
+                s.open_until = 0.0
+                return
+            s.consecutive_failures += 1
+            tripped = s.consecutive_failures >= LLM_BREAKER_FAILURES or (
+                len(s.outcomes) >= LLM_BREAKER_FAILURES * 2 and s.error_rate() >= LLM_BREAKER_ERROR_RATE
+            )
+            if tripped:
+                if s.open_until <= time.monotonic():
+                    logger.warning(f"Circuit breaker open for endpoint {endpoint} ({s.consecutive_failures} failures)")
+                s.open_until = time.monotonic() + LLM_BREAKER_COOLDOWN_SECONDS
+        if seconds is not None:
+            observe_stage(f"llm:{endpoint}", seconds, "ok" if ok else "error")
+
+    def _available_locked(self, endpoint: str) -> bool:
+        s = self._stats.get(endpoint)
+        if s is None or s.open_until == 0.0:
+            return True
+        now = time.monotonic()
+        if s.open_until > now or s.probe_until > now:
+            return False
+        # Cooldown over: let one call through to test the endpoint (another if it never reports back)
+        s.probe_until = now + LLM_BREAKER_COOLDOWN_SECONDS
+        return True
+
+    def _ranked_locked(self, endpoints: Iterable[str]) -> List[str]:
+        def p50(ep: str) -> float:
+            s = self._stats.get(ep)
+            value = s.quantile(50) if s else None
+            return value if value is not None else float("inf")
+
+        return sorted(dict.fromkeys(endpoints), key=p50)
+
+    def pick(self, preferred: str, pool: Optional[List[str]] = None) -> str:
+        """The fastest healthy endpoint in ``pool``, else ``preferred`` if healthy, else the fastest healthy other."""
+        with self._lock:
+            candidates = (self._ranked_locked(pool) if pool else []) + [preferred]
+            for ep in candidates + self._ranked_locked(self._routable_locked(preferred)):
+                if self._available_locked(ep):
+                    return ep
+        return preferred  # every endpoint is failing; still try the requested one
+
+    def _routable_locked(self, preferred: str) -> List[str]:
+        # Base endpoints, plus discovered ones only once they have answered a chat call
+        seen = [ep for ep, s in self._stats.items() if s.latencies]
+        return [ep for ep in dict.fromkeys(self._base + seen) if ep != preferred]
+
+    def _backup(self, primary: str, pool: Optional[List[str]]) -> Optional[str]:
+        with self._lock:
+            for ep in self._ranked_locked((pool or []) + self._routable_locked(primary)):
+                if ep != primary and self._available_locked(ep):
+                    return ep
+        return None
+
+    def _hedge_after(self, endpoint: str) -> Optional[float]:
+        if not LLM_HEDGE:
+            return None
+        with self._lock:
+            s = self._stats.get(endpoint)
+            if s is None or len(s.latencies) < LLM_HEDGE_MIN_SAMPLES:
+                return None
+            return max(LLM_HEDGE_MIN_SECONDS, s.quantile(LLM_HEDGE_QUANTILE))
+
+    def _submit(self, fn: Callable[[Any], Any], endpoint: str, temperature: Optional[float]):
+        def call():
+            t0 = time.perf_counter()
+            try:
+                result = fn(self._client(endpoint, temperature))
+            except Exception:
+                self.record(endpoint, time.perf_counter() - t0, False)
+                raise
+            self.record(endpoint, time.perf_counter() - t0, True)
+            return result
+
+        return _EXECUTOR.submit(contextvars.copy_context().run, call)
+
+    def call(
+        self,
+        fn: Callable[[Any], Any],
+        preferred: str,
+        temperature: Optional[float] = None,
+        pool: Optional[List[str]] = None,
+    ) -> Any:
+        """Run ``fn(client)`` on a routed endpoint; past the p95 deadline a backup races it on another."""
+        primary = self.pick(preferred, pool)
+        futures = {self._submit(fn, primary, temperature): primary}
+        deadline = self._hedge_after(primary)
+        done, _ = wait(futures, timeout=deadline)
+        if not done:
+            backup = self._backup(primary, pool)
+            if backup is not None:
+                logger.info(f"Hedging slow call to {primary} (> {deadline:.2f}s) with {backup}")
+                futures[self._submit(fn, backup, temperature)] = backup
+        error: Optional[BaseException] = None
+        pending = set(futures)
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    # The loser keeps running on its thread; its outcome still feeds the stats
+                    return future.result()
+                error = future.exception()
+        raise error
+
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        with self._lock:
+            return {
+                ep: {
+                    "calls": len(s.outcomes),
+                    "p50": s.quantile(50),
+                    "p95": s.quantile(95),
+                    "error_rate": round(s.error_rate(), 3),
+                    "open": s.open_until > time.monotonic(),
+                }
+                for ep, s in self._stats.items()
+            }
@@ -0,0 +1,102 @@
+import os
+import json
+import time
+import hashlib
+import logging
+import threading
+from typing import Dict, List, Optional
+
+from cache import TTLCache
+
+logger = logging.getLogger(__name__)
+
+# Chat histories by session id; the least recently used sessions are evicted past the limit
+SESSION_STORE_MAX = int(os.getenv("SESSION_STORE_MAX", "1000"))
+SESSION_TTL_SECONDS = float(os.getenv("SESSION_TTL_SECONDS", str(24 * 3600)))
+SESSION_STORE_DIR = os.getenv("SESSION_STORE_DIR")  # optional on-disk tier, e.g. /tmp/sessions
+_PRUNE_INTERVAL_SECONDS = 600
+
+
+class SessionStore:
+    """Chat history per session: a bounded in-memory LRU, optionally backed by JSONL files.
+
+    With ``directory`` set, every message is appended to ``<directory>/<hash>.jsonl`` so
+    histories survive restarts and memory eviction; files idle for ``ttl`` seconds are removed.
+    """
+
+    def __init__(
+        self,
+        max_sessions: int = SESSION_STORE_MAX,
+        ttl: float = SESSION_TTL_SECONDS,
+        directory: Optional[str] = SESSION_STORE_DIR,
+    ):
+        self._memory = TTLCache(max_entries=max_sessions, ttl=ttl)
+        self._ttl = ttl
+        self._dir = directory
+        self._lock = threading.Lock()
+        self._last_prune = 0.0
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    def _path(self, session_id: str) -> str:
+        return os.path.join(self._dir, hashlib.sha256(session_id.encode("utf-8")).hexdigest() + ".jsonl")
+
+    def _load_locked(self, session_id: str) -> List[Dict]:
+        messages = self._memory.get(session_id)
+        if messages is not None:
+            return messages
+        messages = []
+        if self._dir:
+            path = self._path(session_id)
+            try:
+                if time.time() - os.path.getmtime(path) <= self._ttl:
+                    with open(path, "r", encoding="utf-8") as f:
+                        messages = [json.loads(line) for line in f if line.strip()]
+            except FileNotFoundError:
+                pass
+            except Exception as e:
+                logger.warning(f"Could not read session history {path}: {e}")
+        self._memory.set(session_id, messages)
+        return messages
+
+    def history(self, session_id: str) -> List[Dict]:
+        with self._lock:
+            return list(self._load_locked(session_id))
+
+    def append(self, session_id: str, *messages: Dict) -> int:
+        """Add messages to the session's history and return its new length."""
+        with self._lock:
+            history = self._load_locked(session_id)
+            history.extend(messages)
+            if self._dir:
+                try:
+                    with open(self._path(session_id), "a", encoding="utf-8") as f:
+                        for m in messages:
+                            f.write(json.dumps(m) + "\n")
+                except Exception as e:
+                    logger.warning(f"Could not persist session history: {e}")
+            length = len(history)
+        self._maybe_prune()
+        return length
+
+    def clear(self, session_id: str) -> None:
+        with self._lock:
+            self._memory.pop(session_id)
+            if self._dir:
+                try:
+                    os.remove(self._path(session_id))
+                except FileNotFoundError:
+                    pass
+
+    def _maybe_prune(self) -> None:
+        now = time.time()
+        if not self._dir or now - self._last_prune < _PRUNE_INTERVAL_SECONDS:
+            return
+        self._last_prune = now
+        for name in os.listdir(self._dir):
+            path = os.path.join(self._dir, name)
+            try:
+                if name.endswith(".jsonl") and now - os.path.getmtime(path) > self._ttl:
+                    os.remove(path)
+            except OSError:
+                pass
@@ -0,0 +1,149 @@
+import os
+import time
+import asyncio
+import logging
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+
+import pandas as pd
+from langchain_community.chat_models import ChatDatabricks
+
+from dbsql import QueryCancelledError, normalize_sql
+from pipeline import run_in_thread
+from llm import generate_sql, refine_sql, get_chat_llm, first_statement, ensure_limit
+
+logger = logging.getLogger(__name__)
+
+# Speculative mode: several SQL candidates are generated and validated at once; the first that runs wins
+SQL_SPECULATIVE = os.getenv("SQL_SPECULATIVE", "0") == "1"
+SQL_SPECULATIVE_FANOUT = int(os.getenv("SQL_SPECULATIVE_FANOUT", "3"))
+SQL_SPECULATIVE_ROUNDS = int(os.getenv("SQL_SPECULATIVE_ROUNDS", "3"))
+SQL_SPECULATIVE_BUDGET_SECONDS = float(os.getenv("SQL_SPECULATIVE_BUDGET_SECONDS", "60"))
+SQL_SPECULATIVE_TEMPERATURES = [
+    float(t) for t in os.getenv("SQL_SPECULATIVE_TEMPERATURES", "0.0,0.4,0.8").split(",") if t.strip()
+]
+# Extra endpoints to spread candidates over, in addition to the one selected in the UI
+SQL_SPECULATIVE_ENDPOINTS = [e.strip() for e in os.getenv("SQL_SPECULATIVE_ENDPOINTS", "").split(",") if e.strip()]
+
+
+class CandidateFailed(Exception):
+    def __init__(self, sql_text: str, error: str):
+        super().__init__(error)
+        self.sql_text = sql_text
+        self.error = error
+
+
+def candidate_llms(endpoint: str, fanout: int = SQL_SPECULATIVE_FANOUT) -> List[Tuple[str, ChatDatabricks]]:
+    """One (label, client) per candidate, cycling through endpoints and temperatures."""
+    endpoints = [endpoint] + [e for e in SQL_SPECULATIVE_ENDPOINTS if e != endpoint]
+    temperatures = SQL_SPECULATIVE_TEMPERATURES or [0.0]
+    llms = []
+    for i in range(max(1, fanout)):
+        ep = endpoints[i % len(endpoints)]
+        temperature = temperatures[i % len(temperatures)]
+        llms.append((f"{ep} t={temperature}", get_chat_llm(ep, temperature=temperature)))
+    return llms
+
+
+async def speculative_sql(
+    question: str,
+    schema_text: str,
+    llms: List[Tuple[str, ChatDatabricks]],
+    validate: Callable[[str], Awaitable[pd.DataFrame]],
+    logs: List[str],
+    context: Optional[str] = None,
+    rounds: int = SQL_SPECULATIVE_ROUNDS,
+    budget: float = SQL_SPECULATIVE_BUDGET_SECONDS,
+    cached_sql: Optional[str] = None,
+) -> Tuple[str, pd.DataFrame]:
+    """Return the first candidate SQL that ``validate`` runs successfully, with its result.
+
+    Round 1 generates one candidate per client concurrently; each later round refines every
+    failed candidate concurrently. The remaining candidates are cancelled (including their
+    warehouse statements) as soon as one succeeds. Raises ``TimeoutError`` once ``budget``
+    seconds have passed and ``RuntimeError`` when every round failed. Progress goes to ``logs``.
+    ``cached_sql`` (a semantic SQL cache hit) is validated alone first; candidates are only
+    generated, without consulting the cache again, when it fails.
+    """
+    deadline = time.monotonic() + budget
+    # Validations by normalized SQL, so a candidate repeated across clients or rounds runs once
+    validations: Dict[str, asyncio.Task] = {}
+
+    async def run(sql_text: str) -> pd.DataFrame:
+        key = normalize_sql(sql_text)
+        if key not in validations:
+            task = validations[key] = asyncio.ensure_future(validate(sql_text))
+            # Retrieve the outcome even when every waiter was cancelled, so asyncio does not log it
+            task.add_done_callback(lambda t: t.cancelled() or t.exception())
+        try:
+            return await asyncio.shield(validations[key])
+        except (QueryCancelledError, asyncio.CancelledError):
+            raise
+        except Exception as e:
+            raise CandidateFailed(sql_text, str(e))
+
+    async def attempt(
+        rnd: int, label: str, llm: ChatDatabricks, prev: Optional[CandidateFailed]
+    ) -> Tuple[str, pd.DataFrame]:
+        if prev is None:
+            raw = await run_in_thread(generate_sql, question, schema_text, llm, context, False)
+        else:
+            raw = await run_in_thread(refine_sql, question, schema_text, prev.sql_text, prev.error, llm)
+        sql_text = ensure_limit(first_statement(raw), 200)
+        logs.append(f"Round {rnd} [{label}] SQL:\n{sql_text}")
+        return sql_text, await run(sql_text)
+
+    failed: List[Tuple[str, ChatDatabricks, Optional[CandidateFailed]]] = [(label, llm, None) for label, llm in llms]
+    try:
+        if cached_sql is not None:
+            # A cache hit costs no LLM calls, so it runs before (not beside) the fan-out
+            sql_text = ensure_limit(first_statement(cached_sql), 200)
+            logs.append(f"Cached SQL:\n{sql_text}")
+            try:
+                df = await asyncio.wait_for(run(sql_text), deadline - time.monotonic())
+            except asyncio.TimeoutError:
+                raise TimeoutError(f"No SQL candidate succeeded within {budget:.0f}s.")
+            except CandidateFailed as e:
+                logs.append(f"Cached SQL error:\n{e.error}")
+            else:
+                logs.append("Cached SQL succeeded.")
+                return sql_text, df
+        for rnd in range(1, rounds + 1):
+            tasks = {
+                asyncio.ensure_future(attempt(rnd, label, llm, prev)): (label, llm) for label, llm, prev in failed
+            }
+            for task in tasks:
+                # Candidates that finish alongside the winner are never looked at; keep asyncio quiet about them
+                task.add_done_callback(lambda t: t.cancelled() or t.exception())
+            failed = []
+            pending = set(tasks)
+            try:
+                while pending:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        raise TimeoutError(f"No SQL candidate succeeded within {budget:.0f}s.")
+                    done, pending = await asyncio.wait(pending, timeout=remaining, return_when=asyncio.FIRST_COMPLETED)
+                    for task in done:
+                        label, llm = tasks[task]
+                        try:
+                            sql_text, df = task.result()
+                        except CandidateFailed as e:
+                            logs.append(f"Round {rnd} [{label}] error:\n{e.error}")
+                            failed.append((label, llm, e))
+                        except QueryCancelledError:
+                            raise
+                        except Exception as e:
+                            logs.append(f"Round {rnd} [{label}] generation error:\n{e}")
+                        else:
+                            logs.append(f"Round {rnd} [{label}] succeeded.")
+                            return sql_text, df
+            finally:
+                for task in pending:
+                    task.cancel()
+            if not failed:
+                break
+        raise RuntimeError("Every SQL candidate failed.")
+    finally:
+        # Losing validations are cancelled, which cancels their statements on the warehouse
+        for task in validations.values():
+            if not task.done():
+                task.cancel()
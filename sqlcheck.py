@@ -0,0 +1,133 @@
+import os
+import re
+import logging
+from functools import lru_cache
+from typing import Dict, FrozenSet, Optional
+
+import sqlglot
+from sqlglot import exp
+from sqlglot.errors import ParseError
+
+logger = logging.getLogger(__name__)
+
+# Generated SQL is checked locally before it is sent to the warehouse; set to 0 to skip the check
+SQL_PREVALIDATE = os.getenv("SQL_PREVALIDATE", "1") == "1"
+SQL_DIALECT = "databricks"
+TRIPS_TABLE = "samples.nyctaxi.trips"
+
+# Statement types that modify data or metadata, wherever they appear in the tree
+_WRITES = (
+    exp.Insert, exp.Update, exp.Delete, exp.Merge, exp.Create, exp.Drop,
+    exp.Alter, exp.TruncateTable, exp.Command,
+)
+# A column name is a backticked identifier (which may contain spaces; `` is an escaped backtick) or a bare word
+_COLUMN_LINE = re.compile(r"^\s*-\s*(?:`((?:[^`]|``)+)`|(\S+))\s+\S")
+_TABLE_LINE = re.compile(r"^\s*Table\s+([\w.`]+):\s*$")
+
+
+class SQLValidationError(ValueError):
+    """Generated SQL rejected before execution. ``kind`` is syntax, statement, table or column."""
+
+    def __init__(self, kind: str, message: str):
+        super().__init__(message)
+        self.kind = kind
+
+
+@lru_cache(maxsize=32)
+def parse_schema_text(schema_text: str, table: str = TRIPS_TABLE) -> Dict[str, FrozenSet[str]]:
+    """Map table names to column names from the ``get_trips_schema_text`` format.
+
+    Columns belong to ``table`` until a ``Table <name>:`` line starts another table's section.
+    """
+    tables: Dict[str, set] = {table.lower(): set()}
+    current = table.lower()
+    for line in schema_text.splitlines():
+        m = _TABLE_LINE.match(line)
+        if m:
+            current = m.group(1).replace("`", "").lower()
+            tables.setdefault(current, set())
+            continue
+        m = _COLUMN_LINE.match(line)
+        if m:
+            name = m.group(1).replace("``", "`") if m.group(1) is not None else m.group(2)
+            tables[current].add(name.lower())
+    if len(tables) > 1 and not tables[table.lower()]:
+        # Every column sits under a table line: ``table`` is not part of this schema
+        del tables[table.lower()]
+    return {name: frozenset(cols) for name, cols in tables.items()}
+
+
+def _table_name(table: exp.Table) -> str:
+    return ".".join(p for p in (table.catalog, table.db, table.name) if p).lower()
+
+
+def _resolve(name: str, tables: Dict[str, FrozenSet[str]]) -> Optional[str]:
+    """Known table that ``name`` refers to; a partially qualified name matches on its suffix."""
+    if name in tables:
+        return name
+    matches = [t for t in tables if t.endswith("." + name)]
+    return matches[0] if len(matches) == 1 else None
+
+
+def validate_sql(sql_text: str, tables: Dict[str, FrozenSet[str]]) -> None:
+    """Raise ``SQLValidationError`` unless ``sql_text`` is one read-only query over known tables and columns.
+
+    Only references that are certainly wrong are rejected: columns of CTEs, subqueries and
+    aliases are accepted, as are qualified names that are not a known table (struct fields).
+    """
+    try:
+        statements = [s for s in sqlglot.parse(sql_text, read=SQL_DIALECT) if s is not None]
+    except ParseError as e:
+        if e.errors:
+            err = e.errors[0]
+            detail = f"{err['description']} near '{err['highlight']}' (line {err['line']}, column {err['col']})"
+        else:
+            detail = str(e).splitlines()[0]
+        raise SQLValidationError("syntax", f"SQL syntax error: {detail}")
+    if len(statements) != 1:
+        raise SQLValidationError("statement", f"Expected exactly one statement, got {len(statements)}.")
+    tree = statements[0]
+    if not isinstance(tree, exp.Query) or tree.find(*_WRITES):
+        raise SQLValidationError("statement", f"Only SELECT queries are allowed, got {tree.key.upper()}.")
+
+    ctes = {cte.alias_or_name.lower() for cte in tree.find_all(exp.CTE)}
+    # Qualifier (alias or name) -> resolved known table
+    sources: Dict[str, str] = {}
+    for table in tree.find_all(exp.Table):
+        name = _table_name(table)
+        if not table.db and name in ctes:
+            continue
+        resolved = _resolve(name, tables)
+        if resolved is None:
+            raise SQLValidationError(
+                "table", f"Unknown table {name}. Available tables: {', '.join(sorted(tables))}."
+            )
+        sources[table.alias_or_name.lower()] = resolved
+        sources[table.name.lower()] = resolved
+
+    derived = {a.alias.lower() for a in tree.find_all(exp.Alias)}
+    derived |= {c.name.lower() for alias in tree.find_all(exp.TableAlias) for c in alias.columns}
+    # Unqualified columns may come from a subquery or CTE; only check them against plain table scans
+    only_tables = not ctes and not any(isinstance(s.this, exp.Query) for s in tree.find_all(exp.Subquery))
+    known = frozenset().union(*(tables[t] for t in set(sources.values())))
+    for column in tree.find_all(exp.Column):
+        name = column.name.lower()
+        if not name or name in derived:
+            continue
+        qualifier = column.table.lower()
+        if qualifier:
+            table = sources.get(qualifier)
+            if table is not None and tables[table] and name not in tables[table]:
+                raise SQLValidationError(
+                    "column", f"Unknown column {name} in {table}. Available columns: {', '.join(sorted(tables[table]))}."
+                )
+        elif only_tables and known and name not in known:
+            raise SQLValidationError(
+                "column", f"Unknown column {name}. Available columns: {', '.join(sorted(known))}."
+            )
+
+
+def check_sql(sql_text: str, schema_text: str) -> None:
+    """Validate generated SQL against the trips schema text, if pre-validation is enabled."""
+    if SQL_PREVALIDATE:
+        validate_sql(sql_text, parse_schema_text(schema_text))
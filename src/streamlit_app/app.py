@@ -1,5 +1,6 @@
 import logging
 import os
+import time
 import streamlit as st
 # ...existing code...
 # from databricks.sdk import WorkspaceClient
@@ -27,6 +28,17 @@ def get_user_info():
         user_id=headers.get("X-Forwarded-User"),
     )
 
+def stream_response(prompt: str):
+    """Yield response tokens as they are generated, logging time to first token and total time."""
+    t0 = time.perf_counter()
+    ttft = None
+    for chunk in llm.stream(prompt):
+        if ttft is None:
+            ttft = time.perf_counter() - t0
+            logger.info(f"First token after {ttft:.2f}s")
+        yield chunk
+    logger.info(f"Response finished in {time.perf_counter() - t0:.2f}s (first token {ttft or 0:.2f}s)")
+
 user_info = get_user_info()
 
 # Streamlit app
@@ -58,8 +70,7 @@ if prompt := st.chat_input("What is up?"):
     with st.chat_message("assistant"):
         try:
             # Simple instruction prefix; include more context/history if desired
-            assistant_response = llm.invoke(f"You are a helpful assistant.\nUser: {prompt}")
-            st.markdown(assistant_response)
+            assistant_response = st.write_stream(stream_response(f"You are a helpful assistant.\nUser: {prompt}"))
         except Exception as e:
             assistant_response = f"Error querying model: {e}"
             st.error(assistant_response)
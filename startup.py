@@ -0,0 +1,113 @@
+import os
+import json
+import time
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Iterable, Optional
+
+logger = logging.getLogger(__name__)
+
+STARTUP_SNAPSHOT_PATH = os.getenv("STARTUP_SNAPSHOT_PATH", ".startup_snapshot.json")
+# Target for import-to-serving time; exceeding it is logged as a warning
+STARTUP_BUDGET_SECONDS = float(os.getenv("STARTUP_BUDGET_SECONDS", "3"))
+
+
+class WarmCache:
+    """Startup values served from a local snapshot while fresh ones load in the background.
+
+    ``loaders`` map a name to a zero-argument callable returning a JSON-serializable value.
+    Until a loader has finished, ``get`` returns the snapshot value or the given default. A loader
+    signals failure by raising; only values it returned are saved. ``transient`` loaders run for
+    their side effects (e.g. opening connections) and are never saved or restored.
+    """
+
+    def __init__(
+        self,
+        loaders: Dict[str, Callable[[], Any]],
+        defaults: Optional[Dict[str, Any]] = None,
+        snapshot_path: Optional[str] = STARTUP_SNAPSHOT_PATH,
+        transient: Iterable[str] = (),
+    ):
+        self._loaders = loaders
+        self._transient = set(transient)
+        self._snapshot_path = snapshot_path
+        self._values: Dict[str, Any] = dict(defaults or {})
+        self._persist: Dict[str, bool] = {name: False for name in loaders}  # has a real (non-default) value
+        self._finished: Dict[str, bool] = {name: False for name in loaders}
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self._load_snapshot()
+
+    def _load_snapshot(self) -> None:
+        if not self._snapshot_path or not os.path.exists(self._snapshot_path):
+            return
+        try:
+            with open(self._snapshot_path, "r", encoding="utf-8") as f:
+                snapshot = json.load(f)
+            values = {
+                k: v for k, v in snapshot.get("values", {}).items() if k in self._loaders and k not in self._transient
+            }
+            self._values.update(values)
+            self._persist.update({k: True for k in values})
+            age = time.time() - snapshot.get("saved_at", 0)
+            logger.info(f"Loaded startup snapshot ({', '.join(values)}) from {age:.0f}s ago")
+        except Exception as e:
+            logger.warning(f"Could not read startup snapshot {self._snapshot_path}: {e}")
+
+    def _save_snapshot(self) -> None:
+        if not self._snapshot_path:
+            return
+        with self._lock:
+            values = {k: v for k, v in self._values.items() if self._persist.get(k)}
+        tmp = f"{self._snapshot_path}.tmp"
+        try:
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump({"saved_at": time.time(), "values": values}, f)
+            os.replace(tmp, self._snapshot_path)
+        except Exception as e:
+            logger.warning(f"Could not write startup snapshot {self._snapshot_path}: {e}")
+
+    def _run(self, name: str) -> None:
+        t0 = time.perf_counter()
+        try:
+            value = self._loaders[name]()
+        except Exception as e:
+            logger.warning(f"Warm-up of {name} failed: {e}")
+            with self._lock:
+                self._finished[name] = True
+            return
+        with self._lock:
+            self._values[name] = value
+            self._persist[name] = name not in self._transient
+            self._finished[name] = True
+        logger.info(f"Warmed {name} in {time.perf_counter() - t0:.2f}s")
+
+    def refresh(self) -> None:
+        with ThreadPoolExecutor(max_workers=max(1, len(self._loaders)), thread_name_prefix="warmup") as pool:
+            list(pool.map(self._run, self._loaders))
+        self._save_snapshot()
+
+    def start(self) -> None:
+        if self._thread is None:
+            self._thread = threading.Thread(target=self.refresh, name="warmup", daemon=True)
+            self._thread.start()
+
+    def get(self, name: str, default: Any = None) -> Any:
+        with self._lock:
+            return self._values.get(name, default)
+
+    def is_finished(self, name: Optional[str] = None) -> bool:
+        """Whether the background load of ``name`` (or of everything) is over, successful or not."""
+        with self._lock:
+            return self._finished[name] if name else all(self._finished.values())
+
+
+def check_startup_budget(started_at: float, budget: float = STARTUP_BUDGET_SECONDS) -> float:
+    """Log seconds since ``started_at`` (a ``time.perf_counter()`` value) against the budget."""
+    elapsed = time.perf_counter() - started_at
+    if elapsed > budget:
+        logger.warning(f"Startup took {elapsed:.2f}s, over the {budget:.2f}s budget")
+    else:
+        logger.info(f"Startup took {elapsed:.2f}s (budget {budget:.2f}s)")
+    return elapsed
@@ -0,0 +1,94 @@
+import os
+import uuid
+import contextvars
+import logging
+import threading
+from typing import Iterable, Optional, Tuple
+
+from cache import TTLCache
+
+logger = logging.getLogger(__name__)
+
+# Finished or abandoned answer streams are dropped after this long
+ANSWER_STREAM_TTL_SECONDS = float(os.getenv("ANSWER_STREAM_TTL_SECONDS", "600"))
+ANSWER_STREAM_MAX = int(os.getenv("ANSWER_STREAM_MAX", "1000"))
+
+
+class TokenStream:
+    """Text produced by a background generator, readable while it is still being written."""
+
+    def __init__(self):
+        self._parts = []
+        self._lock = threading.Lock()
+        self.done = False
+        self.delivered = False
+        self.error: Optional[str] = None
+        self.cancelled = threading.Event()
+
+    def consume(self, chunks: Iterable[str]) -> None:
+        try:
+            for chunk in chunks:
+                if self.cancelled.is_set():
+                    break
+                with self._lock:
+                    self._parts.append(chunk)
+        except Exception as e:
+            logger.warning(f"Answer stream failed: {e}")
+            self.error = str(e)
+        finally:
+            close = getattr(chunks, "close", None)
+            if close is not None:
+                close()  # stops the underlying model stream when cancelled
+            self.done = True
+
+    def text(self) -> str:
+        with self._lock:
+            return "".join(self._parts)
+
+
+class StreamRegistry:
+    """Server-side buffers for answers streamed to clients that poll for them by id."""
+
+    def __init__(self, ttl: float = ANSWER_STREAM_TTL_SECONDS, max_streams: int = ANSWER_STREAM_MAX):
+        self._streams = TTLCache(max_entries=max_streams, ttl=ttl)
+
+    def start(self, chunks: Iterable[str]) -> str:
+        stream_id = uuid.uuid4().hex
+        stream = TokenStream()
+        self._streams.set(stream_id, stream)
+        # The copied context carries the request's trace id into the generating thread's logs
+        ctx = contextvars.copy_context()
+        threading.Thread(
+            target=ctx.run, args=(stream.consume, chunks), name=f"stream-{stream_id[:8]}", daemon=True
+        ).start()
+        return stream_id
+
+    def read(self, stream_id: Optional[str]) -> Tuple[str, bool, Optional[str]]:
+        """Return (text so far, done, error). An unknown or expired id reads as finished and empty."""
+        stream = self._streams.get(stream_id) if stream_id else None
+        if stream is None:
+            return "", True, None
+        return stream.text(), stream.done, stream.error
+
+    def _take(self, stream_id: Optional[str], require_done: bool) -> Optional[TokenStream]:
+        stream = self._streams.get(stream_id) if stream_id else None
+        if stream is None or (require_done and not stream.done):
+            return None
+        with stream._lock:
+            if stream.delivered:
+                return None
+            stream.delivered = True
+        self._streams.pop(stream_id)
+        return stream
+
+    def claim(self, stream_id: Optional[str]) -> bool:
+        """Drop a finished stream; True only for the first caller, so its text is delivered once."""
+        return self._take(stream_id, require_done=True) is not None
+
+    def abandon(self, stream_id: Optional[str]) -> Optional[Tuple[str, bool]]:
+        """Stop a stream that is no longer wanted. Returns (text so far, done) if it was never delivered."""
+        stream = self._take(stream_id, require_done=False)
+        if stream is None:
+            return None
+        stream.cancelled.set()
+        return stream.text(), stream.done
@@ -0,0 +1,107 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from admission import PRIORITY_BACKGROUND, PRIORITY_INTERACTIVE, AdmissionError, AdmissionQueue
+
+
+def _wait_queued(queue: AdmissionQueue, n: int) -> None:
+    deadline = time.monotonic() + 2
+    while queue.stats()["queued"] < n:
+        assert time.monotonic() < deadline, "statements never queued"
+        time.sleep(0.01)
+
+
+def _start(queue: AdmissionQueue, order: list, name: str, user=None, priority=PRIORITY_INTERACTIVE, **kwargs):
+    def run():
+        try:
+            with queue.slot(user, priority, **kwargs):
+                order.append(name)
+        except AdmissionError as e:
+            order.append(f"{name}:{e.reason}")
+
+    t = threading.Thread(target=run)
+    t.start()
+    return t
+
+
+def test_lower_priority_runs_first_then_arrival_order():
+    queue = AdmissionQueue(max_running=1, per_user=1, max_queued=10)
+    order = []
+    with queue.slot():
+        threads = []
+        for i, (name, priority) in enumerate(
+            [("bg1", PRIORITY_BACKGROUND), ("ui1", PRIORITY_INTERACTIVE), ("bg2", PRIORITY_BACKGROUND),
+             ("ui2", PRIORITY_INTERACTIVE)]
+        ):
+            threads.append(_start(queue, order, name, priority=priority))
+            _wait_queued(queue, i + 1)
+    for t in threads:
+        t.join(2)
+    assert order == ["ui1", "ui2", "bg1", "bg2"]
+
+
+def test_per_user_limit_lets_other_users_pass():
+    queue = AdmissionQueue(max_running=3, per_user=1, max_queued=10)
+    order = []
+    with queue.slot("alice"):
+        alice = _start(queue, order, "alice2", user="alice")
+        _wait_queued(queue, 1)
+        bob = _start(queue, order, "bob", user="bob")
+        bob.join(2)
+        assert order == ["bob"]
+    alice.join(2)
+    assert order == ["bob", "alice2"]
+    assert queue.stats() == {"queued": 0, "running": 0, "users": 0}
+
+
+def test_cancel_drops_only_that_users_queued_statements():
+    queue = AdmissionQueue(max_running=1, per_user=1, max_queued=10)
+    order = []
+    with queue.slot():
+        threads = [_start(queue, order, "a", user="a")]
+        _wait_queued(queue, 1)
+        threads.append(_start(queue, order, "b", user="b"))
+        _wait_queued(queue, 2)
+        assert queue.cancel("a") == 1
+        threads[0].join(2)
+        assert order == ["a:cancelled"]
+    threads[1].join(2)
+    assert order == ["a:cancelled", "b"]
+
+
+def test_queue_timeout_and_queue_full():
+    queue = AdmissionQueue(max_running=1, per_user=1, max_queued=1)
+    order = []
+    with queue.slot():
+        waiter = _start(queue, order, "late", timeout=0.1)
+        _wait_queued(queue, 1)
+        with pytest.raises(AdmissionError) as e:
+            with queue.slot():
+                pass
+        assert e.value.reason == "queue_full"
+        waiter.join(2)
+    assert order == ["late:queue_timeout"]
+    assert queue.stats() == {"queued": 0, "running": 0, "users": 0}
+
+
+def test_cancelled_async_waiter_leaves_the_queue():
+    queue = AdmissionQueue(max_running=1, per_user=1, max_queued=10)
+
+    async def main():
+        async with queue.slot_async("a"):
+            async def wait():
+                async with queue.slot_async("b"):
+                    pass
+
+            task = asyncio.ensure_future(wait())
+            await asyncio.sleep(0.05)
+            assert queue.stats()["queued"] == 1
+            task.cancel()
+            with pytest.raises(asyncio.CancelledError):
+                await task
+
+    asyncio.run(main())
+    assert queue.stats() == {"queued": 0, "running": 0, "users": 0}
@@ -0,0 +1,116 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from cache import AsyncSingleFlight, SingleFlight, TTLCache
+
+
+def test_ttl_cache_expires_and_evicts_least_recently_used():
+    cache = TTLCache(max_entries=2, ttl=0.05)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    assert cache.get("a") == 1
+    cache.set("c", 3)  # evicts b, the least recently used
+    assert cache.get("b") is None
+    time.sleep(0.1)
+    assert cache.get("a") is None
+
+
+def test_single_flight_shares_one_call():
+    flight = SingleFlight()
+    calls = []
+    started = threading.Event()
+    release = threading.Event()
+
+    def fn():
+        calls.append(1)
+        started.set()
+        release.wait(2)
+        return "value"
+
+    results = []
+    leader = threading.Thread(target=lambda: results.append(flight.do("k", fn)))
+    leader.start()
+    started.wait(2)
+    followers = [threading.Thread(target=lambda: results.append(flight.do("k", fn))) for _ in range(3)]
+    for t in followers:
+        t.start()
+    time.sleep(0.05)
+    release.set()
+    for t in [leader, *followers]:
+        t.join(2)
+    assert results == ["value"] * 4
+    assert len(calls) == 1
+
+
+def test_single_flight_propagates_errors_to_followers_and_then_forgets_them():
+    flight = SingleFlight()
+    started = threading.Event()
+    release = threading.Event()
+
+    def fail():
+        started.set()
+        release.wait(2)
+        raise ValueError("boom")
+
+    errors = []
+
+    def call():
+        try:
+            flight.do("k", fail)
+        except ValueError as e:
+            errors.append(str(e))
+
+    threads = [threading.Thread(target=call)]
+    threads[0].start()
+    started.wait(2)
+    threads.append(threading.Thread(target=call))
+    threads[1].start()
+    time.sleep(0.05)
+    release.set()
+    for t in threads:
+        t.join(2)
+    assert errors == ["boom", "boom"]
+    assert flight.do("k", lambda: "fresh") == "fresh"
+
+
+def test_async_single_flight_propagates_errors():
+    flight = AsyncSingleFlight()
+    calls = []
+
+    async def fail():
+        calls.append(1)
+        await asyncio.sleep(0.05)
+        raise ValueError("boom")
+
+    async def main():
+        return await asyncio.gather(*(flight.do("k", fail) for _ in range(3)), return_exceptions=True)
+
+    results = asyncio.run(main())
+    assert [str(e) for e in results] == ["boom"] * 3
+    assert len(calls) == 1
+
+
+def test_async_single_flight_retries_on_leader_specific_errors():
+    flight = AsyncSingleFlight()
+    calls = []
+
+    async def fn():
+        calls.append(1)
+        await asyncio.sleep(0.05)
+        if len(calls) == 1:
+            raise KeyError("leader's own")
+        return "value"
+
+    async def main():
+        leader = asyncio.ensure_future(flight.do("k", fn, retry_on=(KeyError,)))
+        await asyncio.sleep(0.01)
+        follower = await flight.do("k", fn, retry_on=(KeyError,))
+        with pytest.raises(KeyError):
+            await leader
+        return follower
+
+    assert asyncio.run(main()) == "value"
+    assert len(calls) == 2
@@ -0,0 +1,247 @@
+import asyncio
+import threading
+import time
+
+import pyarrow as pa
+import pytest
+
+import dbsql
+
+
+class FakeCursor:
+    """Enough of the connector's cursor for ``dbsql``: every statement returns ``conn.table``."""
+
+    def __init__(self, conn: "FakeConnection"):
+        self._conn = conn
+        self._result = None
+        self._offset = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    @property
+    def description(self):
+        return None if self._result is None else [(f.name, str(f.type)) for f in self._result.schema]
+
+    def execute(self, query: str) -> None:
+        self._conn.executed.append(query)
+        time.sleep(self._conn.latency)
+        if query.startswith("SET"):
+            self._result = None  # no result set
+        else:
+            self._result = pa.table({}) if query.startswith("EXPLAIN") else self._conn.table
+        self._offset = 0
+
+    def execute_async(self, query: str) -> None:
+        self.execute(query)
+
+    def is_query_pending(self) -> bool:
+        return False
+
+    def get_async_execution_result(self) -> None:
+        pass
+
+    def fetchmany_arrow(self, size: int) -> pa.Table:
+        table = self._result.slice(self._offset, size)
+        self._offset += table.num_rows
+        return table
+
+    def fetchall_arrow(self) -> pa.Table:
+        return self.fetchmany_arrow(self._result.num_rows)
+
+    def fetchall(self):
+        return [tuple(r.values()) for r in self.fetchall_arrow().to_pylist()]
+
+    def cancel(self) -> None:
+        pass
+
+    def close(self) -> None:
+        self._result = None
+
+
+class FakeConnection:
+    def __init__(self, table: pa.Table = pa.table({"x": [1, 2, 3]}), latency: float = 0.0):
+        self.table = table
+        self.latency = latency
+        self.executed = []
+        self.closed = False
+
+    def cursor(self) -> FakeCursor:
+        return FakeCursor(self)
+
+    def close(self) -> None:
+        self.closed = True
+
+
+@pytest.fixture
+def pool(monkeypatch):
+    """A fresh pool of fake connections installed as the module's pool, with an empty result cache."""
+    pool = dbsql.ConnectionPool(connect=FakeConnection, min_size=0, max_size=2, checkout_timeout=1)
+    monkeypatch.setattr(dbsql, "_POOL", pool)
+    dbsql.clear_result_cache()
+    yield pool
+    pool.close()
+
+
+def test_cancel_during_acquire_returns_the_connection(monkeypatch, pool):
+    def slow_connect():
+        time.sleep(0.2)
+        return FakeConnection()
+
+    monkeypatch.setattr(pool, "_connect", slow_connect)
+
+    async def main():
+        task = asyncio.ensure_future(dbsql.run_sql_async("SELECT 1", use_cache=False))
+        await asyncio.sleep(0.05)  # the worker thread is inside connect()
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+        await asyncio.sleep(0.4)
+
+    asyncio.run(main())
+    stats = pool.stats()
+    assert stats["in_use"] == 0
+    assert stats["idle"] == 1
+
+
+def _executions(conns, query):
+    return sum(c.executed.count(query) for c in conns)
+
+
+def test_identical_async_queries_share_one_execution(monkeypatch, pool):
+    conns = []
+
+    def connect():
+        conns.append(FakeConnection(latency=0.2))
+        return conns[-1]
+
+    monkeypatch.setattr(pool, "_connect", connect)
+    query = "SELECT x FROM t"
+
+    async def main():
+        return await asyncio.gather(*(dbsql.run_sql_async(query) for _ in range(3)))
+
+    # One event loop per thread, as each Dash request gets
+    results = []
+    threads = [threading.Thread(target=lambda: results.extend(asyncio.run(main()))) for _ in range(2)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert len(results) == 6
+    assert all(list(df["x"]) == [1, 2, 3] for df in results)
+    assert _executions(conns, query) == 1
+
+
+def test_waiters_rerun_a_query_cancelled_for_its_session(monkeypatch, pool):
+    conns = []
+
+    def connect():
+        conns.append(FakeConnection(latency=0.2))
+        return conns[-1]
+
+    monkeypatch.setattr(pool, "_connect", connect)
+    query = "SELECT x FROM t"
+
+    async def main():
+        leader = asyncio.ensure_future(dbsql.run_sql_async(query, session_id="a"))
+        await asyncio.sleep(0.05)
+        follower = asyncio.ensure_future(dbsql.run_sql_async(query, session_id="b"))
+        await asyncio.sleep(0.05)
+        leader.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await leader
+        return await follower
+
+    assert list(asyncio.run(main())["x"]) == [1, 2, 3]
+    assert _executions(conns, query) == 2
+
+
+def test_timed_out_query_discards_its_connection(monkeypatch, pool):
+    monkeypatch.setattr(pool, "_connect", lambda: FakeConnection(latency=0.3))
+    with pytest.raises(TimeoutError):
+        asyncio.run(dbsql.run_sql_async("SELECT x FROM slow", timeout=0.05, use_cache=False))
+    stats = pool.stats()
+    assert stats["in_use"] == 0
+    assert stats["evicted"] == 1
+
+
+class CastErrorCursor(FakeCursor):
+    def fetchmany_arrow(self, size: int) -> pa.Table:
+        raise ValueError("[CAST_INVALID_INPUT] 'abc' cannot be cast to INT")
+
+    def fetchall_arrow(self) -> pa.Table:
+        return self.fetchmany_arrow(0)
+
+
+@pytest.mark.parametrize("max_rows", [None, 10])
+def test_fetch_error_on_the_first_batch_raises(monkeypatch, pool, max_rows):
+    conn = FakeConnection()
+    monkeypatch.setattr(conn, "cursor", lambda: CastErrorCursor(conn))
+    monkeypatch.setattr(pool, "_connect", lambda: conn)
+    with pytest.raises(ValueError, match="CAST_INVALID_INPUT"):
+        dbsql.run_sql("SELECT CAST(s AS INT) FROM t", max_rows=max_rows)
+    assert dbsql.cache_stats()["entries"] == 0
+
+
+def test_statement_without_a_result_set_returns_an_empty_frame(pool):
+    assert dbsql.run_sql("SET ansi_mode = true", max_rows=10).empty
+
+
+def test_pool_reuses_released_connections(pool):
+    first = pool.acquire()
+    pool.release(first)
+    assert pool.acquire() is first
+    assert pool.stats()["created"] == 1
+
+
+def test_pool_discards_broken_connections(pool):
+    conn = pool.acquire()
+    pool.release(conn, broken=True)
+    assert conn.closed
+    stats = pool.stats()
+    assert (stats["size"], stats["idle"], stats["in_use"], stats["evicted"]) == (0, 0, 0, 1)
+    assert pool.acquire() is not conn
+
+
+def test_connection_errors_discard_the_connection(pool):
+    with pytest.raises(OSError):
+        with pool.connection() as conn:
+            raise OSError("connection reset")
+    assert conn.closed
+    assert pool.stats()["size"] == 0
+
+
+def test_pool_checkout_times_out_when_exhausted(pool):
+    held = [pool.acquire(), pool.acquire()]
+    with pytest.raises(TimeoutError):
+        pool.acquire()
+    pool.release(held[0])
+    assert pool.acquire() is held[0]
+
+
+def test_pool_hands_a_released_connection_to_a_waiter(pool):
+    held = [pool.acquire(), pool.acquire()]
+    got = []
+    waiter = threading.Thread(target=lambda: got.append(pool.acquire()))
+    waiter.start()
+    while pool.stats()["waiting"] == 0:
+        time.sleep(0.01)
+    pool.release(held[1])
+    waiter.join(1)
+    assert got == [held[1]]
+
+
+def test_pool_closes_idle_connections_above_min_size():
+    pool = dbsql.ConnectionPool(connect=FakeConnection, min_size=1, max_size=3, idle_seconds=0.05)
+    conns = [pool.acquire() for _ in range(3)]
+    for conn in conns:
+        pool.release(conn)
+    time.sleep(0.1)
+    kept = pool.acquire()
+    assert pool.stats()["size"] == 1
+    assert sum(c.closed for c in conns) == 2
+    assert not kept.closed
@@ -0,0 +1,48 @@
+import asyncio
+
+import pandas as pd
+import pytest
+
+import speculative
+
+
+@pytest.fixture
+def generated(monkeypatch):
+    """SQL texts the fake LLM was asked to generate; every candidate selects its own column."""
+    calls = []
+
+    def generate_sql(question, schema_text, llm, context=None, use_cache=True):
+        calls.append(llm)
+        return f"SELECT {llm} FROM t"
+
+    monkeypatch.setattr(speculative, "generate_sql", generate_sql)
+    return calls
+
+
+def _validate(good: str):
+    async def validate(sql_text: str) -> pd.DataFrame:
+        if good not in sql_text:
+            raise ValueError(f"bad: {sql_text}")
+        return pd.DataFrame({"x": [1]})
+
+    return validate
+
+
+def test_cache_hit_runs_alone(generated):
+    llms = [("a", "a"), ("b", "b"), ("c", "c")]
+    sql_text, df = asyncio.run(
+        speculative.speculative_sql("q", "", llms, _validate("cached"), [], cached_sql="SELECT cached FROM t")
+    )
+    assert sql_text.startswith("SELECT cached FROM t")
+    assert generated == []
+
+
+def test_failed_cache_hit_falls_back_to_fanout(generated):
+    llms = [("a", "a"), ("b", "b"), ("c", "c")]
+    logs = []
+    sql_text, _ = asyncio.run(
+        speculative.speculative_sql("q", "", llms, _validate("SELECT b"), logs, cached_sql="SELECT stale FROM t")
+    )
+    assert sql_text.startswith("SELECT b FROM t")
+    assert "b" in generated
+    assert any(line.startswith("Cached SQL error") for line in logs)
@@ -0,0 +1,33 @@
+import json
+
+from startup import WarmCache
+
+
+def _snapshot(path):
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)["values"]
+
+
+def test_failed_loader_keeps_the_previous_snapshot(tmp_path):
+    path = str(tmp_path / "snapshot.json")
+    WarmCache({"schema": lambda: "good"}, snapshot_path=path).refresh()
+
+    def unreachable():
+        raise ConnectionError("warehouse down")
+
+    warm = WarmCache({"schema": unreachable}, defaults={"schema": "fallback"}, snapshot_path=path)
+    warm.refresh()
+    assert warm.get("schema") == "good"
+    assert warm.is_finished()
+    assert _snapshot(path) == {"schema": "good"}
+
+
+def test_transient_loaders_are_not_saved(tmp_path):
+    path = str(tmp_path / "snapshot.json")
+    ran = []
+    warm = WarmCache(
+        {"pool": lambda: ran.append(1) or 2, "tables": lambda: ["trips"]}, snapshot_path=path, transient=["pool"]
+    )
+    warm.refresh()
+    assert ran == [1]
+    assert _snapshot(path) == {"tables": ["trips"]}
@@ -0,0 +1,71 @@
+import numpy as np
+
+from vectorstore import LocalVectorStore
+
+
+class KeywordEmbeddings:
+    """One dimension per keyword, so similarity is predictable."""
+
+    words = ["taxi", "fare", "zip", "tip"]
+
+    def embed_documents(self, texts):
+        return [self.embed_query(t) for t in texts]
+
+    def embed_query(self, text):
+        return [float(w in text) + 1e-3 for w in self.words]
+
+
+def _store(path):
+    return LocalVectorStore(str(path), embedding=KeywordEmbeddings())
+
+
+def test_add_and_search(tmp_path):
+    store = _store(tmp_path)
+    store.add_texts(
+        ["taxi rides", "fare rules", "zip codes"], metadatas=[{"n": 1}, {"n": 2}, {"n": 3}], ids=["a", "b", "c"]
+    )
+    assert len(store) == 3
+    [doc] = store.similarity_search("fare", k=1)
+    assert (doc.page_content, doc.metadata) == ("fare rules", {"n": 2, "id": "b"})
+
+
+def test_add_overwrites_an_existing_id(tmp_path):
+    store = _store(tmp_path)
+    store.add_texts(["taxi rides"], ids=["a"])
+    store.add_texts(["tip amounts"], ids=["a"])
+    assert len(store) == 1
+    assert store.similarity_search("tip", k=5)[0].page_content == "tip amounts"
+
+
+def test_delete_hides_documents_and_reuses_rows(tmp_path):
+    store = _store(tmp_path)
+    store.add_texts(["taxi rides", "fare rules"], ids=["a", "b"])
+    store.delete(["a", "missing"])
+    assert len(store) == 1
+    assert [d.page_content for d in store.similarity_search("taxi", k=5)] == ["fare rules"]
+    store.add_texts(["zip codes"], ids=["c"])
+    assert store._rows == 2  # the deleted row was reused
+
+
+def test_reload_restores_documents_and_vectors(tmp_path):
+    store = _store(tmp_path)
+    store.add_texts(["taxi rides", "fare rules", "zip codes"], ids=["a", "b", "c"])
+    store.delete(["b"])
+    store.add_texts(["taxi tips"], ids=["a"])
+
+    reloaded = _store(tmp_path)
+    assert len(reloaded) == 2
+    assert [d.page_content for d in reloaded.similarity_search("zip", k=1)] == ["zip codes"]
+    assert {d.page_content for d in reloaded.similarity_search("taxi", k=5)} == {"taxi tips", "zip codes"}
+    row = reloaded._ids["a"]
+    assert np.allclose(reloaded._matrix[row], store._matrix[row])
+
+
+def test_compact_rewrites_the_log_to_live_documents(tmp_path):
+    store = _store(tmp_path)
+    for i in range(5):
+        store.add_texts(["taxi rides"], ids=["a"])
+    assert store.compact(max_ratio=2.0)
+    with open(store._log_path(), encoding="utf-8") as f:
+        assert len(f.readlines()) == 2  # meta + one document
+    assert [d.page_content for d in _store(tmp_path).similarity_search("taxi", k=5)] == ["taxi rides"]
@@ -0,0 +1,263 @@
+import os
+import json
+import uuid
+import logging
+import threading
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+from langchain_core.vectorstores import VectorStore
+
+logger = logging.getLogger(__name__)
+
+_VECTORS_FILE = "vectors.f32"
+_LOG_FILE = "docs.jsonl"
+_MIN_CAPACITY = 1024
+
+
+class LocalVectorStore(VectorStore):
+    """In-process vector index with the ``add_texts``/``similarity_search`` surface rag.py uses.
+
+    Embeddings are L2-normalized rows of one contiguous float32 matrix, memory-mapped from
+    ``<directory>/vectors.f32`` so the index survives restarts without being loaded into RAM.
+    Documents live in an append-only ``docs.jsonl`` log that ``persist()`` compacts. Deleted
+    rows are zeroed, masked out of search and reused by later appends.
+    """
+
+    def __init__(self, directory: str, embedding: Optional[Embeddings] = None):
+        self._dir = directory
+        self._embedding = embedding
+        self._lock = threading.RLock()
+        self._dim: Optional[int] = None
+        self._matrix: Optional[np.memmap] = None
+        self._valid = np.zeros(0, dtype=bool)
+        self._rows = 0  # high-water mark of used rows
+        self._free: List[int] = []
+        self._ids: Dict[str, int] = {}
+        self._docs: Dict[int, Tuple[str, str, Dict[str, Any]]] = {}  # row -> (id, text, metadata)
+        self._log_lines = 0
+        os.makedirs(directory, exist_ok=True)
+        self._load()
+
+    # -------- persistence --------
+    def _log_path(self) -> str:
+        return os.path.join(self._dir, _LOG_FILE)
+
+    def _vectors_path(self) -> str:
+        return os.path.join(self._dir, _VECTORS_FILE)
+
+    def _load(self) -> None:
+        path = self._log_path()
+        if not os.path.exists(path):
+            return
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                self._log_lines += 1
+                rec = json.loads(line)
+                if rec["op"] == "meta":
+                    self._dim = rec["dim"]
+                elif rec["op"] == "add":
+                    row = rec["row"]
+                    self._ids[rec["id"]] = row
+                    self._docs[row] = (rec["id"], rec["text"], rec.get("metadata") or {})
+                    self._rows = max(self._rows, row + 1)
+                elif rec["op"] == "delete":
+                    row = self._ids.pop(rec["id"], None)
+                    if row is not None:
+                        self._docs.pop(row, None)
+        if self._dim is None:
+            return
+        capacity = os.path.getsize(self._vectors_path()) // (4 * self._dim)
+        self._matrix = np.memmap(self._vectors_path(), dtype=np.float32, mode="r+", shape=(capacity, self._dim))
+        self._valid = np.zeros(capacity, dtype=bool)
+        self._valid[list(self._docs)] = True
+        self._free = [r for r in range(self._rows) if not self._valid[r]]
+
+    def _append_log(self, records: Iterable[Dict[str, Any]]) -> None:
+        with open(self._log_path(), "a", encoding="utf-8") as f:
+            for rec in records:
+                f.write(json.dumps(rec) + "\n")
+                self._log_lines += 1
+
+    def _ensure_capacity(self, dim: int, rows: int) -> None:
+        if self._dim is None:
+            self._dim = dim
+            self._append_log([{"op": "meta", "dim": dim}])
+        elif dim != self._dim:
+            raise ValueError(f"Embedding dimension {dim} does not match index dimension {self._dim}.")
+        capacity = 0 if self._matrix is None else self._matrix.shape[0]
+        if rows <= capacity:
+            return
+        new_capacity = max(_MIN_CAPACITY, capacity * 2, rows)
+        if self._matrix is not None:
+            self._matrix.flush()
+            del self._matrix
+        # Growing the file keeps existing rows in place; the new tail reads as zeros
+        with open(self._vectors_path(), "ab") as f:
+            f.truncate(new_capacity * self._dim * 4)
+        self._matrix = np.memmap(self._vectors_path(), dtype=np.float32, mode="r+", shape=(new_capacity, self._dim))
+        valid = np.zeros(new_capacity, dtype=bool)
+        valid[: len(self._valid)] = self._valid
+        self._valid = valid
+
+    def persist(self) -> None:
+        """Flush vectors and compact the document log to the live documents."""
+        with self._lock:
+            if self._matrix is not None:
+                self._matrix.flush()
+            tmp = self._log_path() + ".tmp"
+            with open(tmp, "w", encoding="utf-8") as f:
+                if self._dim is not None:
+                    f.write(json.dumps({"op": "meta", "dim": self._dim}) + "\n")
+                for row, (doc_id, text, metadata) in sorted(self._docs.items()):
+                    f.write(json.dumps({"op": "add", "row": row, "id": doc_id, "text": text, "metadata": metadata}) + "\n")
+            os.replace(tmp, self._log_path())
+            self._log_lines = len(self._docs) + (self._dim is not None)
+
+    def compact(self, max_ratio: float = 2.0) -> bool:
+        """``persist()`` once overwritten and deleted documents make the log ``max_ratio`` times the live ones."""
+        with self._lock:
+            if self._log_lines <= max_ratio * (len(self._docs) + 1):
+                return False
+            self.persist()
+            return True
+
+    # -------- writes --------
+    @property
+    def embeddings(self) -> Optional[Embeddings]:
+        return self._embedding
+
+    def add_embeddings(
+        self,
+        texts: List[str],
+        embeddings: List[List[float]],
+        metadatas: Optional[List[Dict[str, Any]]] = None,
+        ids: Optional[List[str]] = None,
+    ) -> List[str]:
+        """Add precomputed embeddings; an existing id is overwritten in place."""
+        if not texts:
+            return []
+        vectors = np.asarray(embeddings, dtype=np.float32)
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        vectors /= np.maximum(norms, 1e-12)
+        ids = list(ids) if ids else [str(uuid.uuid4()) for _ in texts]
+        metadatas = metadatas or [{} for _ in texts]
+        with self._lock:
+            new = sum(1 for doc_id in ids if doc_id not in self._ids)
+            self._ensure_capacity(vectors.shape[1], self._rows + max(0, new - len(self._free)))
+            records = []
+            for doc_id, text, metadata, vector in zip(ids, texts, metadatas, vectors):
+                row = self._ids.get(doc_id)
+                if row is None:
+                    if self._free:
+                        row = self._free.pop()
+                    else:
+                        row = self._rows
+                        self._rows += 1
+                    self._ids[doc_id] = row
+                self._matrix[row] = vector
+                self._valid[row] = True
+                self._docs[row] = (doc_id, text, metadata)
+                records.append({"op": "add", "row": row, "id": doc_id, "text": text, "metadata": metadata})
+            self._matrix.flush()
+            self._append_log(records)
+        return ids
+
+    def add_texts(
+        self,
+        texts: Iterable[str],
+        metadatas: Optional[List[Dict[str, Any]]] = None,
+        ids: Optional[List[str]] = None,
+        **kwargs: Any,
+    ) -> List[str]:
+        if self._embedding is None:
+            raise ValueError("An embedding model is required to add texts.")
+        texts = list(texts)
+        return self.add_embeddings(texts, self._embedding.embed_documents(texts), metadatas, ids)
+
+    def delete(self, ids: Optional[List[str]] = None, **kwargs: Any) -> Optional[bool]:
+        if ids is None:
+            raise ValueError("ids must be provided.")
+        with self._lock:
+            records = []
+            for doc_id in ids:
+                row = self._ids.pop(doc_id, None)
+                if row is None:
+                    continue
+                self._docs.pop(row, None)
+                self._valid[row] = False
+                self._matrix[row] = 0.0
+                self._free.append(row)
+                records.append({"op": "delete", "id": doc_id})
+            self._append_log(records)
+        return True
+
+    # -------- reads --------
+    def __len__(self) -> int:
+        return len(self._ids)
+
+    def similarity_search_by_vector_with_score(
+        self, embedding: List[float], k: int = 4, **kwargs: Any
+    ) -> List[Tuple[Document, float]]:
+        with self._lock:
+            if not self._ids or self._matrix is None:
+                return []
+            query = np.asarray(embedding, dtype=np.float32)
+            query /= max(float(np.linalg.norm(query)), 1e-12)
+            scores = self._matrix[: self._rows] @ query
+            scores[~self._valid[: self._rows]] = -np.inf
+            k = min(k, len(self._ids))
+            # argpartition finds the top k in O(n); only those k are sorted
+            top = np.argpartition(-scores, k - 1)[:k]
+            top = top[np.argsort(-scores[top])]
+            results = []
+            for row in top:
+                doc_id, text, metadata = self._docs[int(row)]
+                results.append((Document(page_content=text, metadata={**metadata, "id": doc_id}), float(scores[row])))
+            return results
+
+    def similarity_search_by_vector(self, embedding: List[float], k: int = 4, **kwargs: Any) -> List[Document]:
+        return [doc for doc, _ in self.similarity_search_by_vector_with_score(embedding, k=k)]
+
+    def similarity_search_with_score(self, query: str, k: int = 4, **kwargs: Any) -> List[Tuple[Document, float]]:
+        if self._embedding is None:
+            raise ValueError("An embedding model is required to search by text.")
+        return self.similarity_search_by_vector_with_score(self._embedding.embed_query(query), k=k)
+
+    def similarity_search(self, query: str, k: int = 4, **kwargs: Any) -> List[Document]:
+        return [doc for doc, _ in self.similarity_search_with_score(query, k=k)]
+
+    @classmethod
+    def from_texts(
+        cls,
+        texts: List[str],
+        embedding: Embeddings,
+        metadatas: Optional[List[Dict[str, Any]]] = None,
+        *,
+        ids: Optional[List[str]] = None,
+        directory: Optional[str] = None,
+        **kwargs: Any,
+    ) -> "LocalVectorStore":
+        if directory is None:
+            raise ValueError("directory is required for LocalVectorStore.")
+        store = cls(directory, embedding=embedding)
+        store.add_texts(texts, metadatas=metadatas, ids=ids)
+        return store
+
+
+_STORES: Dict[str, LocalVectorStore] = {}
+_STORES_LOCK = threading.Lock()
+
+
+def open_local_store(directory: str, embedding: Optional[Embeddings] = None) -> LocalVectorStore:
+    """Return the process-wide store for ``directory`` (one memmap and lock per index)."""
+    key = os.path.abspath(directory)
+    with _STORES_LOCK:
+        store = _STORES.get(key)
+        if store is None:
+            store = _STORES[key] = LocalVectorStore(directory, embedding=embedding)
+        elif embedding is not None and store.embeddings is None:
+            store._embedding = embedding
+        return store